@@ -2,6 +2,7 @@ from celery import Celery
 from celery.schedules import crontab
 import os
 import django
+from django.conf import settings
 
 # Set the Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_core.config.settings.development')
@@ -19,6 +20,10 @@ app.conf.beat_schedule = {
         'task': 'apps.gamification.tasks.process_daily_logins',
         'schedule': crontab(hour=0, minute=0),
     },
+    'apply-points-awards': {
+        'task': 'apps.gamification.tasks.apply_points_awards',
+        'schedule': float(settings.GAMIFICATION_AWARD_FLUSH_INTERVAL),
+    },
     'expire-stories': {
         'task': 'apps.content.tasks.expire_old_stories',
         'schedule': crontab(minute='*/15'),  # Every 15 minutes
@@ -31,4 +36,32 @@ app.conf.beat_schedule = {
         'task': 'apps.gamification.tasks.check_daily_quests',
         'schedule': crontab(hour='*/1'),  # Every hour
     },
+    'cleanup-expired-notifications': {
+        'task': 'apps.notifications.tasks.cleanup_expired_notifications',
+        'schedule': crontab(hour=3, minute=0),  # Daily, off-peak
+    },
+    'flush-notification-analytics': {
+        'task': 'apps.notifications.tasks.update_notification_analytics',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    },
+    'release-scheduled-notifications': {
+        'task': 'apps.notifications.tasks.release_scheduled_notifications',
+        'schedule': float(settings.NOTIFICATION_SCHEDULER_TICK),  # Timing wheel tick
+    },
+    'dispatch-scheduled-campaigns': {
+        'task': 'apps.notifications.tasks.dispatch_scheduled_campaigns',
+        'schedule': crontab(),  # Every minute
+    },
+    'flush-email-tracking': {
+        'task': 'apps.notifications.tasks.flush_email_tracking',
+        'schedule': crontab(),  # Every minute
+    },
+    'materialize-segments': {
+        'task': 'apps.notifications.tasks.materialize_segments',
+        'schedule': float(settings.SEGMENT_REFRESH_INTERVAL),
+    },
+    'reconcile-unread-counters': {
+        'task': 'apps.notifications.tasks.reconcile_unread_counters',
+        'schedule': crontab(minute=30),  # Every hour
+    },
 }
@@ -1,5 +1,4 @@
-import json
-from core.encryption_middleware import EncryptionMiddleware
+from . import protocol
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from datetime import datetime
@@ -10,6 +9,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.conversation_group_name = f'chat_{self.conversation_id}'
         self.user = self.scope['user']
+        self.subprotocol = protocol.select_subprotocol(self.scope.get('subprotocols', []))
 
         # Join conversation group
         await self.channel_layer.group_add(
@@ -17,7 +17,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept(subprotocol=self.subprotocol)
 
         # Notify others user joined
         await self.channel_layer.group_send(
@@ -47,43 +47,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
 
-    async def receive(self, text_data):
-        # Decrypt if encrypted payload
-        try:
-            data_json = json.loads(text_data)
-            if 'payload' in data_json:
-                middleware = EncryptionMiddleware()
-                # Run sync decryption
-                decrypted_text = middleware.decrypt(data_json['payload'])
-                if decrypted_text:
-                    text_data = decrypted_text
-        except:
-            pass
-            
-        try:
-            data = json.loads(text_data)
-            message_type = data.get('type', 'message')
-
-            if message_type == 'message':
-                await self.handle_message(data)
-            elif message_type == 'typing':
-                await self.handle_typing(data)
-            elif message_type == 'read_receipt':
-                await self.handle_read_receipt(data)
-        except json.JSONDecodeError:
-            pass
+    async def receive(self, text_data=None, bytes_data=None):
+        data = protocol.decode(text_data, bytes_data)
+        if data is None:
+            return
+
+        message_type = data.get('type', 'message')
+
+        if message_type == 'message':
+            await self.handle_message(data)
+        elif message_type == 'typing':
+            await self.handle_typing(data)
+        elif message_type == 'read_receipt':
+            await self.handle_read_receipt(data)
 
-    async def send(self, text_data=None, bytes_data=None, close=False):
-        if text_data:
-            try:
-                # Encrypt outgoing
-                middleware = EncryptionMiddleware()
-                encrypted = middleware.encrypt(text_data)
-                text_data = json.dumps({'payload': encrypted})
-            except Exception as e:
-                print(f"WS Encryption failed: {e}")
-                
-        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+    async def send_frame(self, data):
+        """Encrypt and send a frame in the connection's negotiated format"""
+        text_data, bytes_data = protocol.encode(data, self.subprotocol)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
 
     async def handle_message(self, data):
         """Handle new message"""
@@ -155,42 +136,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     # Receive message from conversation group
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'message',
             'message': event['message']
-        }))
+        })
 
     async def typing_indicator(self, event):
         # Don't send to self
         if event['user_id'] != str(self.user.id):
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'typing',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'is_typing': event['is_typing'],
-            }))
+            })
 
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'user_joined',
             'user_id': event['user_id'],
             'username': event['username'],
-        }))
+        })
 
     async def user_left(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'user_left',
             'user_id': event['user_id'],
             'username': event['username'],
-        }))
+        })
 
     async def read_receipt(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'read_receipt',
             'message_id': event['message_id'],
             'user_id': event['user_id'],
             'read_at': event['read_at'],
-        }))
+        })
 
     # Database operations
     @database_sync_to_async
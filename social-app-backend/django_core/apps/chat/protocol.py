@@ -0,0 +1,89 @@
+"""
+Chat socket frame encoding.
+
+Legacy clients get JSON text frames wrapped in the {'payload': 'iv:ct'}
+envelope. Clients that offer the chat.msgpack.v1 subprotocol get binary
+frames: AES(IV + ciphertext) of a MessagePack map with short keys, with
+no JSON envelope and no base64.
+"""
+import json
+import msgpack
+from core import encryption
+
+MSGPACK_SUBPROTOCOL = 'chat.msgpack.v1'
+JSON_SUBPROTOCOL = 'chat.json'
+
+# Short keys used on the wire in MessagePack frames
+SHORT_KEYS = {
+    'type': 't',
+    'message': 'm',
+    'id': 'i',
+    'sender_id': 's',
+    'sender_username': 'sn',
+    'sender_avatar': 'sa',
+    'content': 'c',
+    'media_url': 'mu',
+    'message_type': 'mt',
+    'reply_to': 'rt',
+    'created_at': 'ca',
+    'user_id': 'u',
+    'username': 'un',
+    'is_typing': 'ty',
+    'message_id': 'mi',
+    'read_at': 'ra',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+def select_subprotocol(offered):
+    """Pick the subprotocol to accept from the client's offer, None for legacy clients"""
+    for subprotocol in (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL):
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
+def _rename(value, keys):
+    if isinstance(value, dict):
+        return {keys.get(k, k): _rename(v, keys) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rename(v, keys) for v in value]
+    return value
+
+
+def encode(data, subprotocol=None):
+    """
+    Encrypt and frame a dict for a connection.
+    Returns (text_data, bytes_data) ready for consumer.send().
+    """
+    if subprotocol == MSGPACK_SUBPROTOCOL:
+        return None, encryption.encrypt_raw(msgpack.packb(_rename(data, SHORT_KEYS)))
+    return json.dumps({'payload': encryption.encrypt(json.dumps(data))}), None
+
+
+def decode(text_data=None, bytes_data=None):
+    """
+    Decode an incoming frame, returns None if it is invalid.
+
+    Binary frames are encrypted MessagePack. Text frames are parsed once,
+    and only an encrypted envelope's body is parsed a second time.
+    """
+    try:
+        if bytes_data is not None:
+            plaintext = encryption.decrypt_raw(bytes_data)
+            if plaintext is None:
+                return None
+            data = _rename(msgpack.unpackb(plaintext), LONG_KEYS)
+        else:
+            data = json.loads(text_data)
+            if isinstance(data, dict) and 'payload' in data:
+                decrypted = encryption.decrypt_bytes(data['payload'])
+                if decrypted is None:
+                    return None
+                data = json.loads(decrypted)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        return None
+
+    if not isinstance(data, dict):
+        return None
+    return data
@@ -3,7 +3,7 @@ from django.dispatch import receiver
 from django.db import models
 from .models import Post
 from apps.users.models import UserProfile
-from apps.gamification.tasks import award_points
+from apps.gamification import ledger
 
 @receiver(post_save, sender=Post)
 def handle_post_created(sender, instance, created, **kwargs):
@@ -14,7 +14,7 @@ def handle_post_created(sender, instance, created, **kwargs):
             posts_count=models.F('posts_count') + 1
         )
         # Award points for uploading
-        award_points.delay(
+        ledger.award(
             user_id=str(instance.user.id),
             action_type='upload_post',
             points=50
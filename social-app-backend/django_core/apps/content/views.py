@@ -8,6 +8,7 @@ from .models import Post, Story
 from .serializers import PostSerializer, PostCreateSerializer, StorySerializer
 from .tasks import process_video_upload
 from apps.social.models import Like, Comment
+from apps.notifications.services import NotificationService
 
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.select_related('user__profile').all()
@@ -156,6 +157,7 @@ class PostViewSet(viewsets.ModelViewSet):
                 return Response({'error': 'Parent comment not found'}, status=status.HTTP_404_NOT_FOUND)
 
         comment = Comment.objects.create(**comment_data)
+        NotificationService.notify_new_comment(str(request.user.id), str(comment.post.user_id), pk, text)
 
         return Response({
             'id': str(comment.id),
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db import transaction
+from .config import invalidate
 from .models import (UserPoints, PointsTransaction, UserLevel,
                      Badge, UserBadge, DailyQuest, UserQuest, GamificationConfig)
 
@@ -59,3 +61,8 @@ class GamificationConfigAdmin(admin.ModelAdmin):
     list_editable = ['points', 'is_active']
     search_fields = ['key', 'description']
     ordering = ['key']
+
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes skip GamificationConfig.delete()
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(invalidate)
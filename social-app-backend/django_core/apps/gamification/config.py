@@ -0,0 +1,126 @@
+"""
+Cached gamification configuration.
+
+Each worker loads every GamificationConfig row once, over the
+POINTS_CONFIG / LEVEL_THRESHOLDS defaults, and afterwards only compares
+a Redis version key, at most every GAMIFICATION_CONFIG_CHECK_INTERVAL
+seconds. Saving or deleting a config (the admin included) bumps the
+version after commit, so every worker reloads within that interval
+without a query per award. Level thresholds, overridable with 'level_<n>'
+rows, are precomputed into sorted lists for bisect lookups.
+"""
+import bisect
+import logging
+import time
+from django.conf import settings
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+POINTS_CONFIG = {
+    'upload_post': 50,
+    'get_like': 1,
+    'get_comment': 5,
+    'comment_post': 2,      # New: points for commenting
+    'reply_comment': 2,     # New: points for replying
+    'follow_user': 10,      # New: points for following someone
+    'daily_login': 10,
+    'use_filter': 15,
+    'invite_friend': 100,
+    'complete_quest': 30,
+    'streak_bonus': 20,
+}
+
+LEVEL_THRESHOLDS = {
+    1: 0, 2: 100, 3: 250, 4: 500, 5: 750,
+    10: 2000, 15: 5000, 20: 10000, 25: 20000,
+    30: 50000, 35: 100000, 40: 200000
+}
+
+VERSION_KEY = 'gamification:config_version'
+CHECK_INTERVAL = getattr(settings, 'GAMIFICATION_CONFIG_CHECK_INTERVAL', 30)
+LEVEL_KEY_PREFIX = 'level_'
+
+_state = {'version': None, 'checked_at': 0.0, 'points': None, 'levels': None, 'thresholds': None}
+
+
+def _load(version):
+    from .models import GamificationConfig
+
+    rows = list(GamificationConfig.objects.values_list('key', 'points', 'is_active'))
+
+    # Keep a row per default action so they show up in the admin
+    missing = set(POINTS_CONFIG) - {key for key, _, _ in rows}
+    if missing:
+        GamificationConfig.objects.bulk_create([
+            GamificationConfig(key=key, points=POINTS_CONFIG[key], description=f"Points for {key}")
+            for key in sorted(missing)
+        ], ignore_conflicts=True)
+
+    points = dict(POINTS_CONFIG)
+    thresholds = dict(LEVEL_THRESHOLDS)
+    for key, value, is_active in rows:
+        if not is_active:
+            continue
+        if key.startswith(LEVEL_KEY_PREFIX) and key[len(LEVEL_KEY_PREFIX):].isdigit():
+            thresholds[int(key[len(LEVEL_KEY_PREFIX):])] = value
+        else:
+            points[key] = value
+
+    levels = sorted(thresholds)
+    _state.update(
+        version=version,
+        points=points,
+        levels=levels,
+        # Running max keeps the table monotonic for bisect
+        thresholds=[max(thresholds[level] for level in levels[:i + 1]) for i in range(len(levels))],
+    )
+
+
+def _current():
+    now = time.monotonic()
+    if _state['points'] is not None and now - _state['checked_at'] < CHECK_INTERVAL:
+        return _state
+
+    try:
+        version = get_redis().get(VERSION_KEY) or '0'
+    except Exception as e:
+        logger.warning(f"Could not check the gamification config version: {e}")
+        version = _state['version']
+
+    if _state['points'] is None or version != _state['version']:
+        _load(version)
+    _state['checked_at'] = now
+    return _state
+
+
+def points_for(action_type):
+    return _current()['points'].get(action_type, 0)
+
+
+def level_for(points, current_level=1):
+    """Highest level the points qualify for, never below current_level"""
+    state = _current()
+    index = bisect.bisect_right(state['thresholds'], points) - 1
+    level = state['levels'][index] if index >= 0 else 1
+    return max(level, current_level)
+
+
+def tier_for(level):
+    if level >= 31:
+        return 'influencer'
+    elif level >= 21:
+        return 'super_creator'
+    elif level >= 11:
+        return 'creator'
+    return 'beginner'
+
+
+def invalidate():
+    """Make every worker reload the config on its next check"""
+    _state['checked_at'] = 0.0
+    _state['version'] = None
+    try:
+        get_redis().incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not bump the gamification config version: {e}")
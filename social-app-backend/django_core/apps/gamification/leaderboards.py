@@ -0,0 +1,203 @@
+"""
+Points leaderboards on Redis sorted sets.
+
+One sorted set per period: 'all' holds every user's total_points, 'weekly'
+and 'daily' the points earned in the current ISO week / day. Periods
+reset by key rotation (leaderboard:weekly:2025-W14, leaderboard:daily:
+2025-04-02), old keys simply expire. The ledger records every applied
+batch (record()), so a rank or an "around me" window is a ZREVRANK plus a
+ZREVRANGE, O(log n), instead of sorting user_points per request.
+
+The all-time board is rebuilt from user_points by the rebuild_leaderboard
+task when it was never built (or Redis lost it), tracked by a ready
+marker. Until it is ready, and whenever Redis is unavailable, reads are
+served from the database: user_points for 'all', summed
+points_transactions of the period otherwise.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from django.db.models import Sum
+from django.utils import timezone
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('all', 'weekly', 'daily')
+# Rotated boards stay readable for a while after their period ends
+PERIOD_TTL = {'weekly': 15 * 24 * 60 * 60, 'daily': 2 * 24 * 60 * 60}
+REBUILD_CHUNK_SIZE = 5000
+MAX_LIMIT = 100
+READY_KEY = 'leaderboard:all:ready'
+# One queued rebuild at a time, expires in case the task is lost
+REBUILD_LOCK_KEY = 'leaderboard:all:rebuilding'
+REBUILD_LOCK_TTL = 10 * 60
+
+
+def board_key(period, day=None):
+    day = day or timezone.localdate()
+    if period == 'all':
+        return 'leaderboard:all'
+    if period == 'weekly':
+        year, week, _ = day.isocalendar()
+        return f'leaderboard:weekly:{year}-W{week:02d}'
+    if period == 'daily':
+        return f'leaderboard:daily:{day.isoformat()}'
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+
+def record(deltas, totals=None):
+    """
+    Add points earned ({user_id: points}) to the period boards and set
+    all-time totals ({user_id: total_points}), never raises
+    """
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for period in ('weekly', 'daily'):
+            key = board_key(period)
+            for user_id, points in deltas.items():
+                if points:
+                    pipe.zincrby(key, points, str(user_id))
+            pipe.expire(key, PERIOD_TTL[period])
+        if totals:
+            pipe.zadd(board_key('all'), {str(user_id): total for user_id, total in totals.items()})
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not update leaderboards: {e}")
+
+
+def rebuild():
+    """Reload the all-time board from user_points, returns the number of users"""
+    from .models import UserPoints
+
+    client = get_redis()
+    key = board_key('all')
+    staging = f'{key}:rebuild'
+    client.delete(staging)
+    count = 0
+    chunk = {}
+    for user_id, total_points in UserPoints.objects.order_by().values_list('user_id', 'total_points').iterator(
+        chunk_size=REBUILD_CHUNK_SIZE
+    ):
+        chunk[str(user_id)] = total_points
+        if len(chunk) == REBUILD_CHUNK_SIZE:
+            client.zadd(staging, chunk)
+            count += len(chunk)
+            chunk = {}
+    if chunk:
+        client.zadd(staging, chunk)
+        count += len(chunk)
+
+    pipe = client.pipeline()
+    if count:
+        pipe.rename(staging, key)
+    pipe.set(READY_KEY, 1)
+    pipe.delete(REBUILD_LOCK_KEY)
+    pipe.execute()
+    return count
+
+
+def _board(period):
+    """The period's board key, None when the all-time board isn't built yet (a rebuild is queued)"""
+    key = board_key(period)
+    if period == 'all':
+        client = get_redis()
+        if not client.exists(READY_KEY):
+            if client.set(REBUILD_LOCK_KEY, 1, nx=True, ex=REBUILD_LOCK_TTL):
+                from .tasks import rebuild_leaderboard
+                rebuild_leaderboard.delay()
+            return None
+    return key
+
+
+def _period_start(period):
+    day = timezone.localdate()
+    if period == 'weekly':
+        day -= timedelta(days=day.weekday())
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _db_scores(period):
+    """(user_id, points) of the period from the database, highest first"""
+    from .models import PointsTransaction, UserPoints
+
+    if period == 'all':
+        return UserPoints.objects.order_by('-total_points', 'user_id').values_list('user_id', 'total_points')
+    return PointsTransaction.objects.filter(created_at__gte=_period_start(period)).values('user_id').annotate(
+        score=Sum('points')
+    ).filter(score__gt=0).order_by('-score', 'user_id').values_list('user_id', 'score')
+
+
+def _db_top(period, limit):
+    rows = [(str(user_id), score) for user_id, score in _db_scores(period)[:limit]]
+    return _entries(rows, 1)
+
+
+def _db_around(user_id, period, radius):
+    scores = _db_scores(period)
+    mine = scores.filter(user_id=user_id).first()
+    if mine is None or not mine[1]:
+        return {'rank': None, 'points': 0, 'around': []}
+
+    score = mine[1]
+    field = 'total_points' if period == 'all' else 'score'
+    rank = scores.filter(**{f'{field}__gt': score}).count()
+    start = max(rank - radius, 0)
+    rows = [(str(uid), points) for uid, points in scores[start:rank + radius + 1]]
+    return {'rank': rank + 1, 'points': score, 'around': _entries(rows, start + 1)}
+
+
+def _entries(rows, start_rank):
+    """Ranked entries with username, avatar and level from one query"""
+    from apps.users.models import CustomUser
+
+    users = {
+        str(user['id']): user
+        for user in CustomUser.objects.filter(id__in=[user_id for user_id, _ in rows]).values(
+            'id', 'username', 'profile__avatar', 'level__current_level'
+        )
+    }
+    entries = []
+    for offset, (user_id, score) in enumerate(rows):
+        user = users.get(user_id)
+        if user is None:
+            continue
+        entries.append({
+            'rank': start_rank + offset,
+            'user_id': user_id,
+            'username': user['username'],
+            'avatar': user['profile__avatar'] or '',
+            'points': int(score),
+            'level': user['level__current_level'] or 1,
+        })
+    return entries
+
+
+def top(period='all', limit=MAX_LIMIT):
+    try:
+        key = _board(period)
+        if key is not None:
+            return _entries(get_redis().zrevrange(key, 0, limit - 1, withscores=True), 1)
+    except Exception as e:
+        logger.warning(f"Leaderboard unavailable, reading it from the database: {e}")
+    return _db_top(period, limit)
+
+
+def around(user_id, period='all', radius=5):
+    """The user's rank and points plus radius users above and below, rank None when unranked"""
+    try:
+        client = get_redis()
+        key = _board(period)
+        if key is None:
+            return _db_around(user_id, period, radius)
+        pipe = client.pipeline(transaction=False)
+        pipe.zrevrank(key, str(user_id))
+        pipe.zscore(key, str(user_id))
+        rank, score = pipe.execute()
+        if rank is None:
+            return {'rank': None, 'points': 0, 'around': []}
+        start = max(rank - radius, 0)
+        rows = client.zrevrange(key, start, rank + radius, withscores=True)
+    except Exception as e:
+        logger.warning(f"Leaderboard unavailable, reading it from the database: {e}")
+        return _db_around(user_id, period, radius)
+    return {'rank': rank + 1, 'points': int(score), 'around': _entries(rows, start + 1)}
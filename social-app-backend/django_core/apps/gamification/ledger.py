@@ -0,0 +1,247 @@
+"""
+Coalescing points ledger.
+
+award() appends an award to a Redis list instead of queueing a Celery task
+per like/comment/follow. apply_pending (every
+GAMIFICATION_AWARD_FLUSH_INTERVAL seconds) drains the list in batches and
+applies each batch at once: one bulk_create of PointsTransaction rows, one
+UPDATE of user_points adding every user's summed points through F() and a
+CASE, and level-ups checked inline from the new totals, which also feed
+the leaderboards. When Redis is down the award is queued as a task of its
+own (applied directly only if the task can't be queued either).
+Points and levels come from the cached config (see config.py).
+
+A batch is claimed with LMOVE onto a processing list and only dropped
+from it once applied, so a worker dying mid-batch loses nothing: the next
+run (one at a time, under a lock only its owner releases) recovers the
+list first. Every award
+carries an id that becomes its PointsTransaction id, and ids already in
+the database are skipped, so a recovered batch is never applied twice.
+A batch failing on bad data is retried entry by entry and the entries
+that still fail go to a dead-letter list; when the database itself is
+unavailable the batch stays in the processing list for the next run.
+"""
+import json
+import logging
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from core.redis_client import get_redis
+from . import config, leaderboards
+from .tasks import apply_points_award, send_level_up_notification
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'points:buffer'
+PROCESSING_KEY = 'points:processing'
+DEAD_LETTER_KEY = 'points:dead'
+LOCK_KEY = 'points:apply_lock'
+LOCK_TTL = 5 * 60
+# Delete the lock only if it still holds our token, a run outliving
+# LOCK_TTL must not release the next run's lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Errors that don't depend on the entries, retried as a whole next run
+RETRYABLE_ERRORS = (OperationalError, InterfaceError)
+BATCH_SIZE = getattr(settings, 'GAMIFICATION_AWARD_BATCH_SIZE', 1000)
+# Batches applied per run, the rest waits for the next one
+MAX_BATCHES = 50
+
+
+def award(user_id, action_type, points=None, metadata=None):
+    """Buffer an award, points=None uses the configured points for action_type"""
+    entry = {
+        'id': uuid.uuid4().hex,
+        'user_id': str(user_id),
+        'action_type': action_type,
+        'points': points,
+        'metadata': metadata or {},
+        'at': timezone.now().isoformat(),
+    }
+    try:
+        get_redis().rpush(BUFFER_KEY, json.dumps(entry))
+    except Exception as e:
+        logger.warning(f"Points buffer unavailable, queueing the award: {e}")
+        try:
+            apply_points_award.delay(entry)
+        except Exception as e:
+            logger.warning(f"Task queue unavailable too, awarding directly: {e}")
+            apply([entry])
+
+
+def apply(entries):
+    """Apply a batch of award entries, returns {user_id: points added}"""
+    from apps.users.models import CustomUser
+    from .models import PointsTransaction, UserPoints
+
+    user_ids = {entry['user_id'] for entry in entries}
+    existing = {str(user_id) for user_id in CustomUser.objects.filter(id__in=user_ids).values_list('id', flat=True)}
+    entries = [entry for entry in entries if entry['user_id'] in existing]
+    # Entries buffered before awards had ids get one now
+    for entry in entries:
+        entry.setdefault('id', uuid.uuid4().hex)
+    # Already applied, e.g. by a run that died before clearing its processing list
+    applied = {
+        transaction_id.hex
+        for transaction_id in PointsTransaction.objects.filter(
+            id__in=[entry['id'] for entry in entries]
+        ).values_list('id', flat=True)
+    }
+    entries = [entry for entry in entries if uuid.UUID(entry['id']).hex not in applied]
+    if not entries:
+        return {}
+
+    deltas = defaultdict(int)
+    rows = []
+    for entry in entries:
+        points = entry['points'] if entry['points'] is not None else config.points_for(entry['action_type'])
+        deltas[entry['user_id']] += points
+        rows.append(PointsTransaction(
+            id=entry['id'],
+            user_id=entry['user_id'],
+            action_type=entry['action_type'],
+            points=points,
+            description=f"Earned {points} points for {entry['action_type']}",
+            metadata=entry['metadata'],
+        ))
+
+    now = timezone.now()
+    with transaction.atomic():
+        UserPoints.objects.bulk_create(
+            [UserPoints(user_id=user_id) for user_id in deltas],
+            ignore_conflicts=True
+        )
+        PointsTransaction.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        UserPoints.objects.filter(user_id__in=deltas).update(
+            total_points=F('total_points') + Case(
+                *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            ),
+            updated_at=now
+        )
+        totals, leveled_up = _check_levels(deltas, now)
+
+    leaderboards.record(deltas, totals)
+    for user_id, level in leveled_up:
+        send_level_up_notification.delay(user_id, level)
+    return dict(deltas)
+
+
+def _check_levels(user_ids, now):
+    """
+    Level up users from their new totals, returns ({user_id: total_points},
+    [(user_id, new level)])
+    """
+    from .models import UserLevel, UserPoints
+
+    totals = {}
+    to_update = []
+    to_create = []
+    leveled_up = []
+    for user_id, total_points, level_id, current_level in UserPoints.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'total_points', 'user__level__id', 'user__level__current_level'):
+        totals[str(user_id)] = total_points
+        current_level = current_level or 1
+        new_level = config.level_for(total_points, current_level)
+        if new_level <= current_level:
+            continue
+        level = UserLevel(
+            id=level_id,
+            user_id=user_id,
+            current_level=new_level,
+            experience=total_points,
+            tier=config.tier_for(new_level),
+            updated_at=now
+        )
+        (to_update if level_id else to_create).append(level)
+        leveled_up.append((str(user_id), new_level))
+
+    if to_update:
+        UserLevel.objects.bulk_update(to_update, ['current_level', 'experience', 'tier', 'updated_at'])
+    if to_create:
+        UserLevel.objects.bulk_create(to_create)
+    return totals, leveled_up
+
+
+def _claim(count):
+    """Move up to count awards onto the processing list, returns them raw"""
+    pipe = get_redis().pipeline()
+    for _ in range(count):
+        pipe.lmove(BUFFER_KEY, PROCESSING_KEY, 'LEFT', 'RIGHT')
+    return [raw for raw in pipe.execute() if raw is not None]
+
+
+def _dead_letter(raw, error):
+    logger.error(f"Dead-lettering points award {raw}: {error}")
+    get_redis().rpush(DEAD_LETTER_KEY, json.dumps({
+        'entry': raw,
+        'error': str(error),
+        'at': timezone.now().isoformat(),
+    }))
+
+
+def _apply_claimed(claimed):
+    """Apply the processing list's awards, then clear it"""
+    entries = []
+    for raw in claimed:
+        try:
+            entries.append((raw, json.loads(raw)))
+        except ValueError as e:
+            _dead_letter(raw, e)
+
+    try:
+        apply([entry for _, entry in entries])
+    except RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        logger.warning(f"Points batch of {len(entries)} failed ({e}), applying one by one")
+        for raw, entry in entries:
+            try:
+                apply([entry])
+            except RETRYABLE_ERRORS:
+                raise
+            except Exception as e:
+                _dead_letter(raw, e)
+
+    get_redis().delete(PROCESSING_KEY)
+    return len(claimed)
+
+
+def apply_pending():
+    """Drain the buffer batch by batch, returns the number of awards processed"""
+    client = get_redis()
+    token = uuid.uuid4().hex
+    if not client.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL):
+        logger.info("Points awards are being applied by another worker")
+        return 0
+
+    try:
+        applied = 0
+        in_flight = client.lrange(PROCESSING_KEY, 0, -1)
+        if in_flight:
+            logger.warning(f"Recovering {len(in_flight)} in-flight points awards")
+            applied += _apply_claimed(in_flight)
+
+        for _ in range(MAX_BATCHES):
+            claimed = _claim(BATCH_SIZE)
+            if not claimed:
+                break
+            applied += _apply_claimed(claimed)
+            if len(claimed) < BATCH_SIZE:
+                break
+        return applied
+    finally:
+        client.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY, token)
+
+
+def pending():
+    return get_redis().llen(BUFFER_KEY)
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gamification", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GamificationConfig",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="Action key, e.g. upload_post",
+                        max_length=50,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "points",
+                    models.IntegerField(
+                        default=0, help_text="Points awarded for this action"
+                    ),
+                ),
+                ("description", models.CharField(blank=True, max_length=200)),
+                ("is_active", models.BooleanField(default=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Gamification Configuration",
+                "verbose_name_plural": "Gamification Configurations",
+                "db_table": "gamification_config",
+            },
+        ),
+    ]
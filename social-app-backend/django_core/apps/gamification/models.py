@@ -1,7 +1,7 @@
 
 
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from apps.users.models import CustomUser
@@ -145,3 +145,14 @@ class GamificationConfig(models.Model):
     
     def __str__(self):
         return f"{self.key}: {self.points} pts"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        from .config import invalidate
+        transaction.on_commit(invalidate)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        from .config import invalidate
+        transaction.on_commit(invalidate)
+        return result
@@ -0,0 +1,150 @@
+"""
+Set-based daily login streaks.
+
+process_daily_logins splits users into GAMIFICATION_STREAK_CHUNKS ranges
+of the UUID keyspace and queues one process_login_chunk per range, so the
+chunks run in parallel. A chunk is a couple of statements instead of a
+save() and two award tasks per user:
+
+1. INSERT ... SELECT the user_points rows missing for users who logged in
+2. UPDATE user_points ... FROM users advancing (or resetting) the streak,
+   longest_streak, last_login_date and total_points of everyone in range
+   who logged in that day, RETURNING the new streaks and totals
+3. one bulk_create of the daily_login / streak_bonus transactions, then
+   level-ups and leaderboards from the returned totals
+
+A user logged in on a day if there is a 'login' Activity for it (the login
+view records one per login). users.last_login only holds the latest login,
+so a login after midnight would otherwise hide the day that just ended; it
+is still accepted for logins that bypass the login view.
+
+Rows already stamped with the day are skipped, so a chunk can be rerun.
+"""
+import logging
+import uuid
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from . import config, leaderboards
+from .tasks import send_level_up_notification
+
+logger = logging.getLogger(__name__)
+
+CHUNKS = getattr(settings, 'GAMIFICATION_STREAK_CHUNKS', 16)
+BONUS_EVERY = 7
+KEYSPACE = 2 ** 128
+
+
+def chunk_bounds(chunk, chunks=CHUNKS):
+    """(lower, upper) user ids of a chunk, upper is None for the last one"""
+    lower = uuid.UUID(int=chunk * KEYSPACE // chunks)
+    upper = uuid.UUID(int=(chunk + 1) * KEYSPACE // chunks) if chunk + 1 < chunks else None
+    return lower, upper
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _db_uuid(value):
+    from .models import UserPoints
+
+    return UserPoints._meta.get_field('user').target_field.get_db_prep_value(value, connection)
+
+
+def process_chunk(day, chunk, chunks=CHUNKS):
+    """Advance the streaks of a chunk's users who logged in on day, returns how many"""
+    from .models import PointsTransaction
+    from .ledger import _check_levels
+
+    start, end = _day_range(day)
+    lower, upper = chunk_bounds(chunk, chunks)
+    login_points = config.points_for('daily_login')
+    bonus_points = config.points_for('streak_bonus')
+    now = timezone.now()
+
+    in_range = 'u.id >= %(lower)s' + (' AND u.id < %(upper)s' if upper else '')
+    params = {
+        'start': start,
+        'end': end,
+        'lower': _db_uuid(lower),
+        'upper': _db_uuid(upper) if upper else None,
+        'day': day,
+        'yesterday': day - timedelta(days=1),
+        'login_points': login_points,
+        'bonus_points': bonus_points,
+        'every': BONUS_EVERY,
+        'now': now,
+    }
+    logged_in = """(
+        (u.last_login >= %(start)s AND u.last_login < %(end)s)
+        OR EXISTS (
+            SELECT 1 FROM activities AS a
+            WHERE a.user_id = u.id AND a.activity_type = 'login'
+              AND a.timestamp >= %(start)s AND a.timestamp < %(end)s
+        )
+    )"""
+    streak = 'CASE WHEN up.last_login_date = %(yesterday)s THEN up.current_streak + 1 ELSE 1 END'
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO user_points (user_id, total_points, current_streak, longest_streak, created_at, updated_at)
+            SELECT u.id, 0, 0, 0, %(now)s, %(now)s
+            FROM users AS u
+            LEFT JOIN user_points AS up ON up.user_id = u.id
+            WHERE up.id IS NULL AND {logged_in} AND {in_range}
+            ON CONFLICT (user_id) DO NOTHING
+        """, params)
+
+        cursor.execute(f"""
+            UPDATE user_points AS up
+            SET current_streak = {streak},
+                longest_streak = {greatest}(up.longest_streak, {streak}),
+                last_login_date = %(day)s,
+                total_points = up.total_points + %(login_points)s + CASE
+                    WHEN ({streak}) %% %(every)s = 0 THEN %(bonus_points)s * (({streak}) / %(every)s)
+                    ELSE 0 END,
+                updated_at = %(now)s
+            FROM users AS u
+            WHERE u.id = up.user_id
+              AND {logged_in}
+              AND {in_range}
+              AND (up.last_login_date IS NULL OR up.last_login_date < %(day)s)
+            RETURNING user_id, current_streak
+        """, params)
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        user_field = PointsTransaction._meta.get_field('user').target_field
+        transactions = []
+        deltas = {}
+        for raw_user_id, current_streak in rows:
+            user_id = str(user_field.to_python(raw_user_id))
+            deltas[user_id] = login_points
+            transactions.append(PointsTransaction(
+                user_id=user_id,
+                action_type='daily_login',
+                points=login_points,
+                description=f"Earned {login_points} points for daily_login",
+            ))
+            if current_streak % BONUS_EVERY == 0:
+                bonus = bonus_points * (current_streak // BONUS_EVERY)
+                deltas[user_id] += bonus
+                transactions.append(PointsTransaction(
+                    user_id=user_id,
+                    action_type='streak_bonus',
+                    points=bonus,
+                    description=f"Earned {bonus} points for streak_bonus",
+                    metadata={'streak': current_streak},
+                ))
+        PointsTransaction.objects.bulk_create(transactions, batch_size=1000)
+        totals, leveled_up = _check_levels(deltas, now)
+
+    leaderboards.record(deltas, totals)
+    for user_id, level in leveled_up:
+        send_level_up_notification.delay(user_id, level)
+    return len(rows)
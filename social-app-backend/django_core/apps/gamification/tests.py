@@ -0,0 +1,285 @@
+import json
+from datetime import date, datetime, time, timedelta
+from unittest import mock
+import fakeredis
+from django.db import OperationalError
+from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from core import redis_client
+from apps.activities.models import Activity
+from apps.gamification import ledger, leaderboards, streaks
+from apps.gamification.models import PointsTransaction, UserPoints
+from apps.gamification.tasks import apply_points_award, rebuild_leaderboard
+
+User = get_user_model()
+
+
+class GamificationTestCase(TestCase):
+    """Users with points, core.redis_client pointed at an in-memory Redis"""
+
+    def setUp(self):
+        cache.clear()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(redis_client, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_user(self, username, points=0):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='testpass123')
+        UserPoints.objects.filter(user=user).update(total_points=points)
+        return user
+
+
+class LeaderboardTest(GamificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = self.create_user('ann', 300)
+        self.bob = self.create_user('bob', 500)
+        self.cat = self.create_user('cat', 100)
+
+    def usernames(self, entries):
+        return [entry['username'] for entry in entries]
+
+    def test_cold_start_queues_one_rebuild_and_reads_the_database(self):
+        with mock.patch.object(rebuild_leaderboard, 'delay') as delay:
+            first = leaderboards.top('all')
+            leaderboards.top('all')
+
+        delay.assert_called_once_with()
+        self.assertEqual(self.usernames(first), ['bob', 'ann', 'cat'])
+        self.assertEqual([entry['rank'] for entry in first], [1, 2, 3])
+
+    def test_rebuilt_board_is_served_from_redis(self):
+        self.assertEqual(leaderboards.rebuild(), 3)
+        UserPoints.objects.filter(user=self.cat).update(total_points=1000)
+
+        self.assertEqual(self.usernames(leaderboards.top('all')), ['bob', 'ann', 'cat'])
+        self.assertFalse(self.redis.exists(leaderboards.REBUILD_LOCK_KEY))
+
+    def test_redis_down_falls_back_to_the_database(self):
+        leaderboards.rebuild()
+        with mock.patch.object(self.redis, 'exists', side_effect=ConnectionError('down')), \
+                mock.patch.object(self.redis, 'zrevrange', side_effect=ConnectionError('down')):
+            self.assertEqual(self.usernames(leaderboards.top('all', 2)), ['bob', 'ann'])
+            mine = leaderboards.around(self.cat.id, 'all', radius=1)
+
+        self.assertEqual((mine['rank'], mine['points']), (3, 100))
+        self.assertEqual(self.usernames(mine['around']), ['ann', 'cat'])
+
+    def test_around_from_redis(self):
+        leaderboards.rebuild()
+        mine = leaderboards.around(self.ann.id, 'all', radius=1)
+
+        self.assertEqual((mine['rank'], mine['points']), (2, 300))
+        self.assertEqual(self.usernames(mine['around']), ['bob', 'ann', 'cat'])
+        self.assertEqual(leaderboards.around(self.create_user('dan').id, 'all')['rank'], None)
+
+    def test_around_falls_back_when_the_window_read_fails(self):
+        leaderboards.rebuild()
+        with mock.patch.object(self.redis, 'zrevrange', side_effect=ConnectionError('down')):
+            mine = leaderboards.around(self.ann.id, 'all', radius=1)
+
+        self.assertEqual((mine['rank'], mine['points']), (2, 300))
+        self.assertEqual(self.usernames(mine['around']), ['bob', 'ann', 'cat'])
+
+    def test_period_fallback_sums_the_period_transactions(self):
+        PointsTransaction.objects.create(user=self.cat, action_type='upload_post', points=50)
+        PointsTransaction.objects.create(user=self.ann, action_type='get_like', points=1)
+        PointsTransaction.objects.create(user=self.cat, action_type='get_like', points=1)
+
+        with mock.patch.object(self.redis, 'zrevrange', side_effect=ConnectionError('down')):
+            daily = leaderboards.top('daily')
+        self.assertEqual([(entry['username'], entry['points']) for entry in daily], [('cat', 51), ('ann', 1)])
+
+
+class LedgerTest(GamificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = self.create_user('ann')
+        self.bob = self.create_user('bob')
+
+    def points(self, user):
+        return UserPoints.objects.get(user=user).total_points
+
+    def test_buffered_awards_are_applied_in_bulk(self):
+        ledger.award(self.ann.id, 'upload_post')
+        ledger.award(self.ann.id, 'get_like')
+        ledger.award(self.bob.id, 'get_comment', points=7)
+        self.assertEqual(ledger.pending(), 3)
+
+        self.assertEqual(ledger.apply_pending(), 3)
+        self.assertEqual((self.points(self.ann), self.points(self.bob)), (51, 7))
+        self.assertEqual(PointsTransaction.objects.count(), 3)
+        self.assertEqual(ledger.pending(), 0)
+        self.assertFalse(self.redis.exists(ledger.PROCESSING_KEY, ledger.LOCK_KEY))
+
+    def test_bad_entries_are_dead_lettered_and_the_rest_applied(self):
+        ledger.award(self.ann.id, 'upload_post')
+        self.redis.rpush(ledger.BUFFER_KEY, '{not json', json.dumps({'user_id': 'not-a-uuid', 'action_type': 'x'}))
+        ledger.award(self.bob.id, 'upload_post')
+
+        self.assertEqual(ledger.apply_pending(), 4)
+        self.assertEqual((self.points(self.ann), self.points(self.bob)), (50, 50))
+        dead = [json.loads(item) for item in self.redis.lrange(ledger.DEAD_LETTER_KEY, 0, -1)]
+        self.assertEqual([item['entry'] for item in dead][0], '{not json')
+        self.assertEqual(len(dead), 2)
+        self.assertEqual(ledger.pending(), 0)
+
+    def test_in_flight_awards_are_recovered_once(self):
+        ledger.award(self.ann.id, 'upload_post')
+        ledger.award(self.bob.id, 'upload_post')
+        claimed = ledger._claim(ledger.BATCH_SIZE)
+        # The worker applied ann's award, then died before clearing the processing list
+        ledger.apply([json.loads(claimed[0])])
+
+        self.assertEqual(ledger.apply_pending(), 2)
+        self.assertEqual((self.points(self.ann), self.points(self.bob)), (50, 50))
+        self.assertEqual(PointsTransaction.objects.count(), 2)
+        self.assertEqual(self.redis.llen(ledger.PROCESSING_KEY), 0)
+
+    def test_database_errors_keep_the_batch_for_the_next_run(self):
+        ledger.award(self.ann.id, 'upload_post')
+        with mock.patch.object(ledger, 'apply', side_effect=OperationalError('server closed the connection')):
+            with self.assertRaises(OperationalError):
+                ledger.apply_pending()
+
+        self.assertEqual(self.redis.llen(ledger.PROCESSING_KEY), 1)
+        self.assertFalse(self.redis.exists(ledger.LOCK_KEY, ledger.DEAD_LETTER_KEY))
+        self.assertEqual(ledger.apply_pending(), 1)
+        self.assertEqual(self.points(self.ann), 50)
+
+    def test_one_run_at_a_time(self):
+        ledger.award(self.ann.id, 'upload_post')
+        self.redis.set(ledger.LOCK_KEY, 1)
+
+        self.assertEqual(ledger.apply_pending(), 0)
+        self.assertEqual(ledger.pending(), 1)
+
+    def test_lock_is_only_released_by_its_owner(self):
+        ledger.award(self.ann.id, 'upload_post')
+
+        def expire_and_relock(count):
+            # LOCK_TTL ran out mid-run and another worker took the lock
+            self.redis.set(ledger.LOCK_KEY, 'other-worker')
+            return []
+
+        with mock.patch.object(ledger, '_claim', side_effect=expire_and_relock):
+            ledger.apply_pending()
+        self.assertEqual(self.redis.get(ledger.LOCK_KEY), 'other-worker')
+
+        self.redis.delete(ledger.LOCK_KEY)
+        self.assertEqual(ledger.apply_pending(), 1)
+        self.assertFalse(self.redis.exists(ledger.LOCK_KEY))
+
+    def test_redis_down_queues_the_award(self):
+        with mock.patch.object(self.redis, 'rpush', side_effect=ConnectionError('down')), \
+                mock.patch.object(apply_points_award, 'delay') as delay:
+            ledger.award(self.ann.id, 'upload_post')
+        self.assertEqual(self.points(self.ann), 0)
+
+        entry, = delay.call_args.args
+        apply_points_award(entry)
+        apply_points_award(entry)
+        self.assertEqual(self.points(self.ann), 50)
+
+    def test_redis_and_queue_down_awards_directly(self):
+        with mock.patch.object(self.redis, 'rpush', side_effect=ConnectionError('down')), \
+                mock.patch.object(apply_points_award, 'delay', side_effect=ConnectionError('down')):
+            ledger.award(self.ann.id, 'upload_post')
+        self.assertEqual(self.points(self.ann), 50)
+
+
+class LoginStreakTest(GamificationTestCase):
+    day = date(2025, 4, 2)
+
+    def login(self, user, day=None, current_streak=None, last_login_date=None, longest_streak=None, at=time(12, 0)):
+        login_at = timezone.make_aware(datetime.combine(day or self.day, at))
+        User.objects.filter(pk=user.pk).update(last_login=login_at)
+        activity = Activity.objects.create(user=user, activity_type='login')
+        Activity.objects.filter(pk=activity.pk).update(timestamp=login_at)
+        fields = {'current_streak': current_streak, 'last_login_date': last_login_date, 'longest_streak': longest_streak}
+        fields = {field: value for field, value in fields.items() if value is not None}
+        if fields:
+            UserPoints.objects.filter(user=user).update(**fields)
+
+    def process(self, chunks=1):
+        with mock.patch('apps.gamification.streaks.send_level_up_notification.delay'):
+            return sum(streaks.process_chunk(self.day, chunk, chunks) for chunk in range(chunks))
+
+    def test_first_login_starts_a_streak(self):
+        ann = self.create_user('ann')
+        self.login(ann)
+
+        self.assertEqual(self.process(), 1)
+        points = UserPoints.objects.get(user=ann)
+        self.assertEqual((points.current_streak, points.longest_streak, points.total_points), (1, 1, 10))
+        self.assertEqual(points.last_login_date, self.day)
+        self.assertEqual(list(PointsTransaction.objects.values_list('action_type', 'points')), [('daily_login', 10)])
+
+    def test_seventh_day_earns_the_streak_bonus(self):
+        ann = self.create_user('ann', 100)
+        self.login(ann, current_streak=6, longest_streak=6, last_login_date=self.day - timedelta(days=1))
+
+        self.process()
+        points = UserPoints.objects.get(user=ann)
+        self.assertEqual((points.current_streak, points.longest_streak, points.total_points), (7, 7, 130))
+        self.assertEqual(PointsTransaction.objects.get(action_type='streak_bonus').metadata, {'streak': 7})
+        self.assertEqual(self.redis.zscore(leaderboards.board_key('all'), str(ann.id)), 130)
+
+    def test_missed_day_resets_the_streak_but_keeps_the_longest(self):
+        ann = self.create_user('ann')
+        self.login(ann, current_streak=12, longest_streak=12, last_login_date=self.day - timedelta(days=2))
+
+        self.process()
+        points = UserPoints.objects.get(user=ann)
+        self.assertEqual((points.current_streak, points.longest_streak), (1, 12))
+
+    def test_login_after_midnight_keeps_the_day_that_ended(self):
+        ann = self.create_user('ann')
+        self.login(ann, current_streak=3, longest_streak=3, last_login_date=self.day - timedelta(days=1))
+        # logs in again at 00:05, before the job for self.day runs
+        self.login(ann, day=self.day + timedelta(days=1), at=time(0, 5))
+
+        self.assertEqual(self.process(), 1)
+        points = UserPoints.objects.get(user=ann)
+        self.assertEqual((points.current_streak, points.last_login_date), (4, self.day))
+
+    def test_last_login_alone_still_counts(self):
+        ann = self.create_user('ann')
+        User.objects.filter(pk=ann.pk).update(
+            last_login=timezone.make_aware(datetime.combine(self.day, time(9, 0)))
+        )
+
+        self.assertEqual(self.process(), 1)
+
+    def test_rerun_is_idempotent(self):
+        ann = self.create_user('ann')
+        self.login(ann)
+
+        self.assertEqual(self.process(), 1)
+        self.assertEqual(self.process(), 0)
+        self.assertEqual(UserPoints.objects.get(user=ann).total_points, 10)
+        self.assertEqual(PointsTransaction.objects.count(), 1)
+
+    def test_only_that_days_logins_and_missing_rows_are_created(self):
+        ann, bob, cat = self.create_user('ann'), self.create_user('bob'), self.create_user('cat')
+        self.login(ann)
+        self.login(bob, day=self.day - timedelta(days=1))
+        UserPoints.objects.filter(user=cat).delete()
+        self.login(cat)
+
+        self.assertEqual(self.process(), 2)
+        self.assertEqual(UserPoints.objects.get(user=bob).total_points, 0)
+        self.assertEqual(UserPoints.objects.get(user=cat).current_streak, 1)
+
+    def test_chunks_cover_every_user_once(self):
+        users = [self.create_user(f'user{i}') for i in range(12)]
+        for user in users:
+            self.login(user)
+
+        self.assertEqual(self.process(chunks=4), 12)
+        self.assertEqual(streaks.chunk_bounds(0, 4)[0].int, 0)
+        self.assertIsNone(streaks.chunk_bounds(3, 4)[1])
+        self.assertEqual(PointsTransaction.objects.filter(action_type='daily_login').count(), 12)
@@ -3,6 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from . import leaderboards
 from .models import UserPoints, UserLevel, Badge, UserBadge, DailyQuest, UserQuest, PointsTransaction
 from .serializers import (UserPointsSerializer, UserLevelSerializer,
                           BadgeSerializer, UserBadgeSerializer, DailyQuestSerializer)
@@ -31,21 +32,31 @@ class GamificationViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def leaderboard(self, request):
-        """Get points leaderboard"""
-        top_users = UserPoints.objects.select_related(
-            'user__profile'
-        ).order_by('-total_points')[:100]
-
-        leaderboard_data = [{
-            'rank': idx + 1,
-            'user_id': str(up.user.id),
-            'username': up.user.username,
-            'avatar': up.user.profile.avatar,
-            'points': up.total_points,
-            'level': up.user.level.current_level if hasattr(up.user, 'level') else 1,
-        } for idx, up in enumerate(top_users)]
-
-        return Response(leaderboard_data)
+        """Get points leaderboard (?period=all|weekly|daily)"""
+        period = request.query_params.get('period', 'all')
+        if period not in leaderboards.PERIODS:
+            return Response({'error': 'Invalid period'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.query_params.get('limit', leaderboards.MAX_LIMIT)), leaderboards.MAX_LIMIT)
+        except ValueError:
+            limit = leaderboards.MAX_LIMIT
+
+        return Response(leaderboards.top(period, max(limit, 1)))
+
+    @action(detail=False, methods=['get'])
+    def my_rank(self, request):
+        """Get current user's leaderboard rank and the users around them"""
+        period = request.query_params.get('period', 'all')
+        if period not in leaderboards.PERIODS:
+            return Response({'error': 'Invalid period'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            radius = min(int(request.query_params.get('radius', 5)), 25)
+        except ValueError:
+            radius = 5
+
+        return Response(leaderboards.around(request.user.id, period, max(radius, 0)))
 
     @action(detail=False, methods=['get'])
     def daily_quests(self, request):
@@ -121,6 +132,8 @@ class GamificationViewSet(viewsets.ViewSet):
             level_obj.current_level = max(level_obj.current_level, new_level)
             level_obj.save()
 
+            leaderboards.record({user.id: points}, {user.id: points_obj.total_points})
+
             return Response({
                 'total_points': points_obj.total_points,
                 'current_level': level_obj.current_level,
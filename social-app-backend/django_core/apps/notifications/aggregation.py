@@ -0,0 +1,194 @@
+"""
+Windowed aggregation of like, comment and follow notifications.
+
+Events are buffered in Redis per recipient and group_key ('like:<post>',
+'comment:<post>', 'follow'). The first event of a window schedules
+flush_notification_group, which turns everything collected meanwhile into
+one Notification ("alice and 42 others liked your post") and one push,
+worded by the '<type>' / '<type>_grouped' templates (see templating.py).
+While that notification is unread, later windows fold into the same row
+and the push replaces the previous one on the device (collapse_key); the
+actors already counted for that row are kept in a Redis set, so someone
+who likes, unlikes and likes again is still counted once.
+"""
+import json
+import logging
+import time
+from django.conf import settings
+from django.utils import timezone
+from core.redis_client import get_redis
+from . import analytics, counters, realtime, templating
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION_WINDOW = getattr(settings, 'NOTIFICATION_AGGREGATION_WINDOW', 30)
+# Buffers outlive the window in case the flush task is delayed
+BUFFER_TTL = 24 * 60 * 60
+# Actors counted for an unread notification, refreshed on every fold
+SEEN_TTL = 30 * 24 * 60 * 60
+
+
+def group_key_for(notification_type, post_id=None):
+    return f'{notification_type}:{post_id}' if post_id else notification_type
+
+
+def _buffer_key(recipient_id, group_key):
+    return f'notif_agg:{recipient_id}:{group_key}'
+
+
+def record_event(recipient_id, notification_type, actor_id, post_id=None, data=None):
+    """
+    Buffer one event, the first of a window schedules the flush.
+    Falls back to emitting the single event from a task when Redis is
+    unavailable, never in the request.
+    """
+    if str(recipient_id) == str(actor_id):
+        return
+
+    from .tasks import emit_notification_group, flush_notification_group
+
+    group_key = group_key_for(notification_type, post_id)
+    data = dict(data or {}, post_id=str(post_id)) if post_id else dict(data or {})
+    key = _buffer_key(recipient_id, group_key)
+
+    try:
+        pipe = get_redis().pipeline()
+        # Sorted set: repeated events from one actor count once, latest score wins
+        pipe.zadd(f'{key}:actors', {str(actor_id): time.time()})
+        pipe.hset(f'{key}:meta', mapping={'type': notification_type, 'data': json.dumps(data)})
+        pipe.expire(f'{key}:actors', BUFFER_TTL)
+        pipe.expire(f'{key}:meta', BUFFER_TTL)
+        # Window marker, deleted by the flush; the TTL only covers lost flushes
+        pipe.set(f'{key}:window', 1, nx=True, ex=AGGREGATION_WINDOW * 2)
+        opened = pipe.execute()[-1]
+    except Exception as e:
+        logger.warning(f"Aggregation buffer unavailable, notifying without aggregation: {e}")
+        emit_notification_group.delay(str(recipient_id), group_key, notification_type, [str(actor_id)], data)
+        return
+
+    if opened:
+        flush_notification_group.apply_async(
+            args=[str(recipient_id), group_key],
+            countdown=AGGREGATION_WINDOW
+        )
+
+
+def flush(recipient_id, group_key):
+    """
+    Drain the buffer of one group and emit its collapsed notification.
+    Returns the number of actors flushed.
+    """
+    key = _buffer_key(recipient_id, group_key)
+
+    # MULTI/EXEC: events arriving after this land in a new window
+    pipe = get_redis().pipeline()
+    pipe.zrevrange(f'{key}:actors', 0, -1)
+    pipe.hgetall(f'{key}:meta')
+    pipe.delete(f'{key}:actors', f'{key}:meta', f'{key}:window')
+    actor_ids, meta, _ = pipe.execute()
+
+    if not actor_ids or not meta:
+        return 0
+
+    emit(recipient_id, group_key, meta['type'], actor_ids, json.loads(meta.get('data') or '{}'))
+    return len(actor_ids)
+
+
+def _message(notification_type, actor_name, total, data):
+    if total == 1:
+        template = templating.get(notification_type)
+        return template.render({'actor': actor_name, 'text': data.get('comment_text', '')[:50]})
+    others = total - 1
+    template = templating.get(f'{notification_type}_grouped')
+    return template.render({'actor': actor_name, 'others': f"{others} other{'s' if others > 1 else ''}"})
+
+
+def _count_actors(recipient_id, group_key, actor_ids, existing):
+    """
+    Distinct actors of the group's unread notification once actor_ids are
+    folded in, returns (total, base). base counts actors of a row whose set
+    was lost (expired or never kept), they can't be deduped any more.
+    """
+    key = f'{_buffer_key(recipient_id, group_key)}:seen'
+    try:
+        pipe = get_redis().pipeline()
+        if existing is None:
+            # A new notification starts a new set
+            pipe.delete(key)
+        pipe.exists(key)
+        pipe.sadd(key, *actor_ids)
+        pipe.scard(key)
+        pipe.expire(key, SEEN_TTL)
+        had_set, _, count, _ = pipe.execute()[-4:]
+    except Exception as e:
+        logger.warning(f"Could not dedupe actors of {group_key} for user {recipient_id}: {e}")
+        if existing is None:
+            return len(actor_ids), 0
+        count = existing.data.get('actor_count', 1)
+        new = set(actor_ids) - {str(existing.actor_id)}
+        return count + len(new), existing.data.get('actor_base', 0)
+
+    if existing is None:
+        return count, 0
+    base = existing.data.get('actor_base', 0) if had_set else existing.data.get('actor_count', 1)
+    return base + count, base
+
+
+def emit(recipient_id, group_key, notification_type, actor_ids, data):
+    """
+    Fold actor_ids (latest first) into the recipient's unread notification
+    for group_key, or create it, then send one push for the group
+    """
+    from .models import Notification
+    from .tasks import _send_push_to_users
+
+    latest_actor_id = actor_ids[0]
+    actor_name = templating.actor_names([latest_actor_id]).get(str(latest_actor_id))
+    if actor_name is None:
+        return
+
+    existing = Notification.objects.filter(
+        recipient_id=recipient_id,
+        group_key=group_key,
+        is_read=False
+    ).first()
+
+    total, base = _count_actors(recipient_id, group_key, actor_ids, existing)
+
+    title, message = _message(notification_type, actor_name, total, data)
+    data = dict(data, actor_id=str(latest_actor_id), actor_count=total)
+    if base:
+        data['actor_base'] = base
+
+    stats = _send_push_to_users(
+        [recipient_id], title, message, data, notification_type,
+        record=False, collapse_key=group_key
+    )
+    fields = {
+        'actor_id': latest_actor_id,
+        'title': title,
+        'message': message,
+        'data': data,
+        'is_grouped': total > 1,
+        'sent_via_push': stats['delivered'] > 0,
+    }
+    post_id = data.get('post_id')
+
+    if existing is not None:
+        # Bump to the top of the feed, created_at is auto_now_add so save() won't
+        fields['created_at'] = timezone.now()
+        Notification.objects.filter(id=existing.id).update(**fields)
+        for field, value in fields.items():
+            setattr(existing, field, value)
+        realtime.publish_notifications([existing], unread_delta=0, actor_username=actor_name)
+    else:
+        notification = Notification.objects.create(
+            recipient_id=recipient_id,
+            notification_type=notification_type,
+            group_key=group_key,
+            post_id=post_id,
+            **fields
+        )
+        counters.increment(recipient_id, publish=False)
+        analytics.record_sent(notification_type, 1, int(stats['delivered'] > 0))
+        realtime.publish_notifications([notification], actor_username=actor_name)
@@ -0,0 +1,159 @@
+"""
+Incremental notification analytics.
+
+Delivery code bumps per-day counters in a Redis hash
+(notif_stats:<YYYY-MM-DD>) as notifications are sent and read, and
+flush() copies the day's totals into NotificationAnalytics, so the
+periodic task no longer scans the notifications table.
+
+Hash fields: sent, delivered, read, clicked, type:<notification_type>,
+platform:<device_type>:sent and platform:<device_type>:delivered (push
+devices). backfill() rebuilds a day from the notification rows in one
+GROUP BY over a created_at range, for repairs.
+
+Both paths count the same things: sent are notifications created that
+day, delivered those of them whose push reached at least one device
+(Notification.sent_via_push), and read the notifications read that day
+(read_at), whenever they were created.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, time, timedelta
+from django.db.models import Count, Q
+from django.utils import timezone
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Counters are flushed every few minutes, the TTL only covers missed flushes
+STATS_TTL = 3 * 24 * 60 * 60
+
+
+def _key(day):
+    return f'notif_stats:{day.isoformat()}'
+
+
+def record(counts, day=None):
+    """Add a Counter/dict of field deltas to the day's counters (default: today)"""
+    counts = {field: delta for field, delta in counts.items() if delta}
+    if not counts:
+        return
+    key = _key(day or timezone.localdate())
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for field, delta in counts.items():
+            pipe.hincrby(key, field, delta)
+        pipe.expire(key, STATS_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record notification analytics: {e}")
+
+
+def record_sent(notification_type, count, delivered=0):
+    """delivered: how many of the count notifications reached a device by push"""
+    record({'sent': count, f'type:{notification_type}': count, 'delivered': delivered})
+
+
+def record_push(platform_counts):
+    """platform_counts: {(device_type, 'sent'|'delivered'): devices}"""
+    record({f'platform:{platform}:{outcome}': count for (platform, outcome), count in platform_counts.items()})
+
+
+def record_read(count=1):
+    record({'read': count})
+
+
+def _to_fields(counters):
+    by_type = {}
+    by_platform = {}
+    for field, value in counters.items():
+        value = int(value)
+        if field.startswith('type:'):
+            by_type[field[5:]] = value
+        elif field.startswith('platform:'):
+            _, platform, outcome = field.split(':', 2)
+            by_platform.setdefault(platform, {})[outcome] = value
+
+    return {
+        'notifications_sent': int(counters.get('sent', 0)),
+        'notifications_delivered': int(counters.get('delivered', 0)),
+        'notifications_read': int(counters.get('read', 0)),
+        'notifications_clicked': int(counters.get('clicked', 0)),
+        'by_type': by_type,
+        'by_platform': by_platform,
+    }
+
+
+def flush(day=None):
+    """Copy the day's counters into NotificationAnalytics (idempotent)"""
+    from .models import NotificationAnalytics, PushToken
+
+    day = day or timezone.localdate()
+    counters = get_redis().hgetall(_key(day))
+    if not counters:
+        return None
+
+    defaults = _to_fields(counters)
+    defaults['push_tokens_active'] = PushToken.objects.filter(is_active=True).count()
+    analytics, _ = NotificationAnalytics.objects.update_or_create(date=day, defaults=defaults)
+    return analytics
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def backfill(day):
+    """
+    Recompute a day from the notification rows in one pass: a single
+    GROUP BY notification_type over created_at >= start AND < end, which
+    uses the created_at index (unlike created_at__date), plus a count of
+    the notifications read that day over the read_at index. by_platform
+    isn't stored on rows and is kept as recorded.
+    """
+    from .models import Notification, NotificationAnalytics
+
+    start, end = _day_range(day)
+    rows = Notification.objects.filter(
+        created_at__gte=start,
+        created_at__lt=end
+    ).order_by().values('notification_type').annotate(
+        sent=Count('id'),
+        delivered=Count('id', filter=Q(sent_via_push=True)),
+    )
+
+    totals = Counter()
+    by_type = {}
+    for row in rows:
+        by_type[row['notification_type']] = row['sent']
+        totals.update({field: row[field] for field in ('sent', 'delivered')})
+    totals['read'] = Notification.objects.filter(read_at__gte=start, read_at__lt=end).count()
+
+    counters = {'sent': totals['sent'], 'delivered': totals['delivered'], 'read': totals['read']}
+    counters.update({f'type:{notification_type}': count for notification_type, count in by_type.items()})
+
+    # Keep live counters in line so the next flush doesn't undo the repair
+    key = _key(day)
+    try:
+        client = get_redis()
+        stale = [field for field in client.hkeys(key) if field.startswith('type:') and field not in counters]
+        pipe = client.pipeline()
+        if stale:
+            pipe.hdel(key, *stale)
+        pipe.hset(key, mapping=counters)
+        pipe.expire(key, STATS_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not update analytics counters for {day}: {e}")
+
+    analytics, _ = NotificationAnalytics.objects.update_or_create(
+        date=day,
+        defaults={
+            'notifications_sent': totals['sent'],
+            'notifications_delivered': totals['delivered'],
+            'notifications_read': totals['read'],
+            'by_type': by_type,
+        }
+    )
+    return analytics
@@ -0,0 +1,247 @@
+"""
+Email campaign dispatcher.
+
+dispatch() claims a draft/scheduled campaign (one worker wins), streams
+its recipients with a server-side cursor (.iterator()), renders each
+batch with the campaign template compiled once, and sends the batch over
+the worker's shared mail connection (see mail.py). Sends are throttled to
+EMAIL_CAMPAIGN_RATE_LIMIT messages per second, sent_count is bumped with
+an F() update per batch, and a campaign cancelled mid-send stops at the
+next batch. The last recipient attempted is kept in the cache after
+every batch, so an interrupted campaign resumes past it: a refused
+recipient is skipped rather than retried, and nobody is mailed twice.
+Every batch also bumps updated_at as a heartbeat; a campaign in 'sending'
+without one for STALE_AFTER seconds (mail server gone, worker died) is
+resumed by dispatch_scheduled_campaigns (see stale()).
+Each message carries an open pixel and tracked links (see tracking.py).
+
+EmailCampaign.content is a Django template written by staff in the admin.
+It is rendered with a fixed context of plain strings (TEMPLATE_CONTEXT),
+never model instances, so it can't reach other fields or relations.
+
+Only users who opted into marketing email (NotificationPreference
+.email_marketing) are sent to. target_segments can combine SQL criteria
+(SEGMENT_FILTERS) with a materialized segment expression under
+'segments' (see segments.py), whose members are fetched in id chunks.
+Locally, set EMAIL_BACKEND to the locmem backend, or point the SMTP
+backend at a sink such as
+`python -m aiosmtpd -n -l 127.0.0.1:1025`.
+"""
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import F
+from django.template import Context, Template
+from django.utils import timezone
+from django.utils.html import strip_tags
+from . import mail, segments, tracking
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'EMAIL_CAMPAIGN_BATCH_SIZE', 200)
+# Messages per second, 0 disables throttling
+RATE_LIMIT = getattr(settings, 'EMAIL_CAMPAIGN_RATE_LIMIT', 50)
+CURSOR_TTL = 7 * 24 * 60 * 60
+# A campaign in 'sending' without a batch for this long is resumed
+STALE_AFTER = getattr(settings, 'EMAIL_CAMPAIGN_STALE_AFTER', 10 * 60)
+
+# target_segments criteria -> CustomUser lookups
+SEGMENT_FILTERS = {
+    'is_verified': 'is_verified',
+    'is_creator': 'is_creator',
+    'joined_after': 'created_at__gte',
+    'joined_before': 'created_at__lt',
+    'min_followers': 'profile__followers_count__gte',
+    'location': 'profile__location__iexact',
+}
+
+
+# Variables available to EmailCampaign.content
+TEMPLATE_CONTEXT = ('username', 'email', 'campaign_name', 'subject')
+
+
+def _cursor_key(campaign_id):
+    return f'email_campaign:{campaign_id}:cursor'
+
+
+def segment_users(criteria):
+    """Users matching target_segments criteria, unknown criteria are an error"""
+    from apps.users.models import CustomUser
+
+    criteria = {key: value for key, value in criteria.items() if key != 'segments'}
+    unknown = set(criteria) - set(SEGMENT_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown segment criteria: {', '.join(sorted(unknown))}")
+    return CustomUser.objects.filter(**{SEGMENT_FILTERS[key]: value for key, value in criteria.items()})
+
+
+def recipients(campaign):
+    """Opted-in active recipients, target_users when set, else target_segments"""
+    from apps.users.models import CustomUser
+
+    if campaign.target_users.exists():
+        users = campaign.target_users.all()
+    elif campaign.target_segments:
+        users = segment_users(campaign.target_segments)
+    else:
+        users = CustomUser.objects.all()
+
+    return users.filter(
+        is_active=True,
+        notification_preferences__email_marketing=True
+    ).exclude(email='')
+
+
+def audience(campaign):
+    """Materialized segment to send to, None when target_segments has no 'segments' expression"""
+    expression = (campaign.target_segments or {}).get('segments')
+    if not expression or campaign.target_users.exists():
+        return None
+    return segments.evaluate(expression) & segments.get('email_marketing')
+
+
+def _count(users, segment):
+    """Number of recipients, segment members who are not recipients don't count"""
+    if segment is None:
+        return users.count()
+    return sum(
+        users.filter(id__in=user_ids).count()
+        for user_ids in segment.user_ids(segments.QUERY_CHUNK_SIZE)
+    )
+
+
+def _rows(users, segment, last_id):
+    """(id, email, username) of recipients in id order, after last_id"""
+    if segment is None:
+        if last_id is not None:
+            users = users.filter(id__gt=last_id)
+        yield from users.order_by('id').values_list('id', 'email', 'username').iterator(chunk_size=BATCH_SIZE)
+        return
+
+    for user_ids in segment.user_ids(BATCH_SIZE, after=last_id):
+        yield from users.filter(id__in=user_ids).order_by('id').values_list('id', 'email', 'username')
+
+
+def _build_messages(campaign, template, batch):
+    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@yourapp.com')
+    messages = []
+    for user_id, email, username in batch:
+        html = template.render(Context({
+            'username': username,
+            'email': email,
+            'campaign_name': campaign.name,
+            'subject': campaign.subject,
+        }))
+        html = tracking.instrument(html, campaign.id, user_id)
+        message = EmailMultiAlternatives(campaign.subject, strip_tags(html), from_email, [email])
+        message.attach_alternative(html, 'text/html')
+        messages.append(message)
+    return messages
+
+
+def _throttle(started, sent):
+    if RATE_LIMIT:
+        ahead = sent / RATE_LIMIT - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def stale():
+    """
+    Claim the campaigns stuck in 'sending' for a resume, returns their ids.
+    Claiming bumps the heartbeat, so concurrent callers don't both get one.
+    """
+    from .models import EmailCampaign
+
+    cutoff = timezone.now() - timedelta(seconds=STALE_AFTER)
+    claimed = []
+    for campaign_id in EmailCampaign.objects.filter(
+        status='sending', updated_at__lt=cutoff
+    ).values_list('id', flat=True):
+        if EmailCampaign.objects.filter(id=campaign_id, status='sending', updated_at__lt=cutoff).update(
+            updated_at=timezone.now()
+        ):
+            claimed.append(campaign_id)
+    return claimed
+
+
+def dispatch(campaign_id, resume=False):
+    """
+    Send a campaign, returns the number of messages sent by this call.
+    resume=True continues a campaign left in 'sending' by a dead worker.
+    """
+    from .models import EmailCampaign
+
+    campaign = EmailCampaign.objects.get(id=campaign_id)
+    # Before claiming, so invalid targeting leaves the campaign untouched
+    users = recipients(campaign)
+    segment = audience(campaign)
+
+    claimable = ['draft', 'scheduled'] + (['sending'] if resume else [])
+    if not EmailCampaign.objects.filter(id=campaign_id, status__in=claimable).update(
+        status='sending', updated_at=timezone.now()
+    ):
+        logger.info(f"Email campaign {campaign_id} is not sendable, skipping")
+        return 0
+
+    last_id = cache.get(_cursor_key(campaign_id)) if resume else None
+    if last_id is None:
+        total = _count(users, segment)
+        EmailCampaign.objects.filter(id=campaign_id).update(total_recipients=total, sent_count=0)
+
+    template = Template(campaign.content)
+    started = time.monotonic()
+    sent = 0
+    batch = []
+    rows = _rows(users, segment, last_id)
+
+    def record(last_id, count):
+        # The cursor moves past every attempted recipient, sent or refused
+        cache.set(_cursor_key(campaign_id), last_id, CURSOR_TTL)
+        # Incremental progress and heartbeat (queryset updates skip auto_now);
+        # no row left in 'sending' means it was cancelled
+        still_sending = EmailCampaign.objects.filter(id=campaign_id, status='sending').update(
+            sent_count=F('sent_count') + count, updated_at=timezone.now()
+        )
+        if not still_sending:
+            EmailCampaign.objects.filter(id=campaign_id).update(sent_count=F('sent_count') + count)
+        return still_sending
+
+    def send_batch(batch):
+        messages = _build_messages(campaign, template, batch)
+        try:
+            count = mail.send_messages(messages)
+        except mail.MailConnectionLost as e:
+            # Left in 'sending', resume=True continues after the last attempted recipient
+            if e.attempted:
+                record(batch[e.attempted - 1][0], e.sent)
+            logger.error(f"Email campaign {campaign_id} interrupted, mail server unreachable: {e}")
+            raise
+        if count < len(messages):
+            logger.warning(f"Email campaign {campaign_id}: {len(messages) - count} of {len(messages)} refused")
+        return count, record(batch[-1][0], count)
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) < BATCH_SIZE:
+            continue
+        count, still_sending = send_batch(batch)
+        sent += count
+        batch = []
+        if not still_sending:
+            logger.info(f"Email campaign {campaign_id} cancelled after {sent} messages")
+            return sent
+        _throttle(started, sent)
+
+    if batch:
+        count, _ = send_batch(batch)
+        sent += count
+
+    EmailCampaign.objects.filter(id=campaign_id, status='sending').update(status='sent', sent_at=timezone.now())
+    cache.delete(_cursor_key(campaign_id))
+    elapsed = time.monotonic() - started
+    logger.info(f"Email campaign {campaign_id} sent {sent} messages in {elapsed:.1f}s")
+    return sent
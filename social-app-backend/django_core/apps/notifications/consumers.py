@@ -0,0 +1,77 @@
+from apps.chat import protocol
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
+from . import counters, realtime
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Per-user notification feed: new notifications and unread count deltas
+    are pushed as they happen, so clients only need to poll rarely
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = realtime.group_name(self.user.id)
+        self.subprotocol = protocol.select_subprotocol(self.scope.get('subprotocols', []))
+
+        # Join the user's group, shared by all of their devices
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+
+        await self.accept(subprotocol=self.subprotocol)
+
+        # Starting point the deltas apply to
+        await self.send_unread_count()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = protocol.decode(text_data, bytes_data)
+        if data is None:
+            return
+
+        # Clients can resync after missing events (e.g. app resumed)
+        if data.get('type') == 'sync':
+            await self.send_unread_count()
+
+    async def send_frame(self, data):
+        """Encrypt and send a frame in the connection's negotiated format"""
+        text_data, bytes_data = protocol.encode(data, self.subprotocol)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def send_unread_count(self):
+        await self.send_frame({
+            'type': 'unread_count',
+            'unread_count': await self.get_unread_count(),
+        })
+
+    # Receive events from the user's group (see realtime.py)
+    async def notification_created(self, event):
+        await self.send_frame({
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_delta': event['unread_delta'],
+        })
+
+    async def unread_changed(self, event):
+        await self.send_frame({
+            'type': 'unread_delta',
+            'unread_delta': event['unread_delta'],
+        })
+
+    # Database operations
+    @database_sync_to_async
+    def get_unread_count(self):
+        return counters.get_unread(self.user.id)
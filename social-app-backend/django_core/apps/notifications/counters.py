@@ -0,0 +1,131 @@
+"""
+Unread notification counters in Redis.
+
+Each user has a hash notif_unread:<user_id> with 'count' and 'ready'.
+Writers only HINCRBY 'count', so they never need to know whether the
+counter exists; 'ready' is set when the count is loaded from the database,
+and a hash without it is recounted on the next read. Increments happen
+where notifications are created, decrements in the read/delete views,
+and reconcile() periodically corrects drift against the database.
+Changes are also pushed to connected devices (see realtime.py).
+"""
+import logging
+from django.conf import settings
+from django.db.models import Count
+from core.redis_client import get_redis
+from . import realtime
+
+logger = logging.getLogger(__name__)
+
+# Idle counters expire and are recounted on the next read
+UNREAD_COUNTER_TTL = getattr(settings, 'NOTIFICATION_UNREAD_COUNTER_TTL', 7 * 24 * 60 * 60)
+KEY_PREFIX = 'notif_unread:'
+
+
+def _key(user_id):
+    return f'{KEY_PREFIX}{user_id}'
+
+
+def _count_from_database(user_ids):
+    from .models import Notification
+
+    counts = {str(user_id): 0 for user_id in user_ids}
+    for row in Notification.objects.filter(
+        recipient_id__in=user_ids,
+        is_read=False
+    ).values('recipient_id').annotate(unread=Count('id')):
+        counts[str(row['recipient_id'])] = row['unread']
+    return counts
+
+
+def increment_many(counts, publish=True):
+    """
+    Apply {user_id: delta} in one round trip. publish=False when the caller
+    sends the delta along with the notification itself.
+    """
+    if not counts:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id, delta in counts.items():
+            pipe.hincrby(_key(user_id), 'count', delta)
+            pipe.expire(_key(user_id), UNREAD_COUNTER_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not update unread counters: {e}")
+    if publish:
+        realtime.publish_unread(counts)
+
+
+def increment(user_id, delta=1, publish=True):
+    increment_many({user_id: delta}, publish)
+
+
+def decrement(user_id, delta=1):
+    if delta:
+        increment_many({user_id: -delta})
+
+
+def store(counts, pipe=None):
+    """Set authoritative counts, marking the counters ready"""
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = get_redis().pipeline(transaction=False)
+    for user_id, count in counts.items():
+        pipe.hset(_key(user_id), mapping={'count': count, 'ready': 1})
+        pipe.expire(_key(user_id), UNREAD_COUNTER_TTL)
+    if own_pipe:
+        pipe.execute()
+
+
+def get_unread(user_id):
+    """Unread count, one HMGET unless the counter has to be (re)loaded"""
+    try:
+        count, ready = get_redis().hmget(_key(user_id), 'count', 'ready')
+        if ready:
+            return max(int(count or 0), 0)
+    except Exception as e:
+        logger.warning(f"Unread counter unavailable, counting in database: {e}")
+        return _count_from_database([user_id])[str(user_id)]
+
+    count = _count_from_database([user_id])[str(user_id)]
+    try:
+        store({user_id: count})
+    except Exception as e:
+        logger.warning(f"Could not store unread counter for user {user_id}: {e}")
+    return count
+
+
+def reconcile(batch_size=1000):
+    """
+    Compare every live counter with the database, one GROUP BY per batch.
+    Returns (checked, corrected).
+    """
+    client = get_redis()
+    checked = corrected = 0
+    batch = []
+
+    def check(user_ids):
+        pipe = client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hmget(_key(user_id), 'count', 'ready')
+        cached = dict(zip(user_ids, pipe.execute()))
+        actual = _count_from_database(user_ids)
+        wrong = {
+            user_id: count for user_id, count in actual.items()
+            if cached[user_id] != [str(count), '1']
+        }
+        store(wrong)
+        return len(wrong)
+
+    for key in client.scan_iter(match=f'{KEY_PREFIX}*', count=batch_size):
+        batch.append(key[len(KEY_PREFIX):])
+        if len(batch) >= batch_size:
+            corrected += check(batch)
+            checked += len(batch)
+            batch = []
+    if batch:
+        corrected += check(batch)
+        checked += len(batch)
+
+    return checked, corrected
@@ -0,0 +1,78 @@
+"""
+One mail connection per worker process.
+
+get_connection() is called once and the connection is opened explicitly,
+so the SMTP backend keeps it open between send_messages() calls instead of
+connecting and quitting per mail. Messages are handed to the backend one
+at a time: a recipient the server refuses only fails that message, and a
+connection the server dropped is reopened once to retry the message that
+was in flight, never the ones already accepted.
+"""
+import logging
+import smtplib
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Per-message failures: the message is dropped, the rest of the batch goes on
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+_connection = None
+
+
+class MailConnectionLost(Exception):
+    """The server went away for good, attempted messages were already handled"""
+
+    def __init__(self, message, sent, attempted):
+        super().__init__(message)
+        self.sent = sent
+        self.attempted = attempted
+
+
+def get_mail_connection():
+    global _connection
+    if _connection is None:
+        _connection = get_connection(fail_silently=False)
+    return _connection
+
+
+def _send_one(message):
+    connection = get_mail_connection()
+    try:
+        connection.open()
+        return connection.send_messages([message]) or 0
+    except CONNECTION_ERRORS as e:
+        logger.info(f"Mail connection lost ({e}), reconnecting")
+        close()
+        connection = get_mail_connection()
+        connection.open()
+        return connection.send_messages([message]) or 0
+
+
+def send_messages(messages):
+    """
+    Send EmailMessages on the shared connection, returns the number sent.
+    Raises MailConnectionLost (with how many were sent and attempted) when
+    the server can't be reached even after reconnecting.
+    """
+    sent = 0
+    for attempted, message in enumerate(messages):
+        try:
+            sent += _send_one(message)
+        except MESSAGE_ERRORS as e:
+            logger.warning(f"Mail to {', '.join(message.recipients())} was refused: {e}")
+        except (*CONNECTION_ERRORS, OSError) as e:
+            close()
+            raise MailConnectionLost(str(e), sent, attempted) from e
+    return sent
+
+
+def close():
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            pass
+        _connection = None
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from apps.notifications import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Convert the notifications table to monthly range partitions (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Print the conversion SQL without running it',
+        )
+        parser.add_argument(
+            '--maintain',
+            action='store_true',
+            help='Only create upcoming partitions and drop expired ones',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        if partitioning.is_partitioned():
+            if options['dry_run']:
+                self.stdout.write('Table is already partitioned')
+                return
+            created, dropped = partitioning.maintain_partitions()
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {len(created)} partitions, dropped {len(dropped)} expired partitions'
+            ))
+            return
+
+        if options['maintain']:
+            raise CommandError('Table is not partitioned yet, run without --maintain first')
+
+        if options['dry_run']:
+            for statement in partitioning.conversion_plan():
+                self.stdout.write(f'{statement};')
+            return
+
+        # Holds an exclusive lock while rows are copied, run in a maintenance window
+        plan = partitioning.convert()
+        partitions = sum(1 for statement in plan if 'PARTITION OF' in statement)
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {partitioning.table_name()} to {partitions} partitions'
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["created_at"], name="notificatio_created_46ad24_idx"
+            ),
+        ),
+    ]
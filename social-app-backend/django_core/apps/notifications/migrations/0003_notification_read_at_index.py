@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0002_notification_created_at_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["read_at"], name="notificatio_read_at_6329f9_idx"
+            ),
+        ),
+    ]
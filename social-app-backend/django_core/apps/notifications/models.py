@@ -90,6 +90,8 @@ class Notification(models.Model):
             models.Index(fields=['recipient', '-created_at']),
             models.Index(fields=['recipient', 'is_read']),
             models.Index(fields=['notification_type']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['read_at']),
         ]
 
     def __str__(self):
@@ -253,6 +255,17 @@ class NotificationTemplate(models.Model):
     def __str__(self):
         return f"{self.name} ({self.notification_type})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        from .templating import invalidate
+        invalidate(self.name)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        from .templating import invalidate
+        invalidate(self.name)
+        return result
+
 
 class EmailCampaign(models.Model):
     """
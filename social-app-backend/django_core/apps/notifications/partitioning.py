@@ -0,0 +1,296 @@
+"""
+Notification retention: monthly range partitions on PostgreSQL, bounded
+chunked deletes everywhere else.
+
+`manage.py partition_notifications` converts notifications_notification
+into a table partitioned by RANGE (created_at) with one partition per
+month (notifications_notification_pYYYYMM) plus a default partition.
+The primary key becomes (id, created_at), as PostgreSQL requires the
+partition key in unique constraints; Django keeps using id alone.
+
+Once partitioned, maintain_partitions() (daily, from
+cleanup_expired_notifications) creates the upcoming months and drops the
+months older than NOTIFICATION_PARTITION_RETENTION_MONTHS, which frees
+the space at once without row-by-row deletes. Unread notifications go
+with their month, so the unread counters of their recipients are
+decremented by the same job. delete_in_chunks() removes
+the read notifications past NOTIFICATION_RETENTION_DAYS in small batches,
+so neither layout ever runs one huge DELETE.
+"""
+import logging
+import re
+import time
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 30)
+PARTITION_RETENTION_MONTHS = getattr(settings, 'NOTIFICATION_PARTITION_RETENTION_MONTHS', 6)
+PARTITION_PREMAKE_MONTHS = getattr(settings, 'NOTIFICATION_PARTITION_PREMAKE_MONTHS', 3)
+DELETE_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_DELETE_CHUNK_SIZE', 5000)
+# Pause between chunks so replication and autovacuum keep up
+DELETE_CHUNK_PAUSE = getattr(settings, 'NOTIFICATION_DELETE_CHUNK_PAUSE', 0.05)
+# DETACH PARTITION takes ACCESS EXCLUSIVE on the parent: give up (until the
+# next run) rather than queue every notification query behind the lock
+DETACH_LOCK_TIMEOUT = getattr(settings, 'NOTIFICATION_PARTITION_LOCK_TIMEOUT', '5s')
+
+PARTITION_SUFFIX = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def table_name():
+    from .models import Notification
+    return Notification._meta.db_table
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _bound(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+
+def partition_name(month, table=None):
+    return f'{table or table_name()}_p{month:%Y%m}'
+
+
+def create_partition_sql(month, table=None):
+    table = table or table_name()
+    return (
+        f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(partition_name(month, table))} '
+        f'PARTITION OF {connection.ops.quote_name(table)} '
+        f"FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(_add_months(month, 1))}')"
+    )
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt '
+            'JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s)',
+            [table_name()]
+        )
+        return cursor.fetchone()[0]
+
+
+def monthly_partitions():
+    """{month: partition name} of the attached monthly partitions"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits i '
+            'JOIN pg_class parent ON parent.oid = i.inhparent '
+            'JOIN pg_class child ON child.oid = i.inhrelid '
+            'WHERE parent.relname = %s',
+            [table_name()]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def conversion_plan():
+    """
+    SQL that converts the plain table into a partitioned one, in order.
+    Reads the catalog only, so it can be printed with --dry-run.
+    """
+    table = table_name()
+    legacy = f'{table}_legacy'
+    qn = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(created_at) FROM {qn(table)}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        # Foreign keys and secondary indexes are not copied by LIKE
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            'SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid), indisunique FROM pg_index '
+            'WHERE indrelid = %s::regclass AND NOT indisprimary',
+            [table]
+        )
+        indexes = cursor.fetchall()
+
+        # Identity (Django >= 4.1) or serial id, the sequence must survive the old table
+        cursor.execute(
+            "SELECT is_identity = 'YES', pg_get_serial_sequence(%s, 'id') "
+            "FROM information_schema.columns WHERE table_name = %s AND column_name = 'id'",
+            [table, table]
+        )
+        is_identity, sequence = cursor.fetchone()
+
+    plan = [
+        f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE',
+        f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}',
+        f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY '
+        f'INCLUDING CONSTRAINTS INCLUDING STORAGE) PARTITION BY RANGE (created_at)',
+        f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)',
+    ]
+
+    month = _month_start(oldest)
+    last = _add_months(_month_start(timezone.now()), PARTITION_PREMAKE_MONTHS)
+    while month <= last:
+        plan.append(create_partition_sql(month, table))
+        month = _add_months(month, 1)
+    plan.append(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+    if is_identity:
+        plan.append(f'INSERT INTO {qn(table)} OVERRIDING SYSTEM VALUE SELECT * FROM {qn(legacy)}')
+        plan.append(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f'(SELECT COALESCE(MAX(id), 0) + 1 FROM {qn(table)}), false)'
+        )
+    else:
+        plan.append(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+        if sequence:
+            plan.append(f'ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.id')
+
+    plan.append(f'DROP TABLE {qn(legacy)}')
+    for name, definition in foreign_keys:
+        plan.append(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+    for name, definition, unique in indexes:
+        if unique:
+            # Would need created_at in the key, the model declares none
+            logger.warning(f"Skipping unique index {name} on partitioned {table}")
+            continue
+        plan.append(re.sub(r' ON (ONLY )?\S+ ', f' ON {qn(table)} ', definition, count=1))
+
+    return plan
+
+
+def convert():
+    """Run conversion_plan() in one transaction, returns the statements run"""
+    plan = conversion_plan()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for statement in plan:
+                cursor.execute(statement)
+    return plan
+
+
+def maintain_partitions():
+    """
+    Create partitions for the coming months, drop those past retention.
+    Returns (created, dropped) partition names.
+    """
+    partitions = monthly_partitions()
+    current = _month_start(timezone.now())
+
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(PARTITION_PREMAKE_MONTHS + 1):
+            month = _add_months(current, offset)
+            if month not in partitions:
+                cursor.execute(create_partition_sql(month))
+                created.append(partition_name(month))
+
+    dropped = []
+    cutoff = _add_months(current, -PARTITION_RETENTION_MONTHS)
+    for month, name in sorted(partitions.items()):
+        if month < cutoff:
+            if _drop_partition(name):
+                dropped.append(name)
+
+    if created or dropped:
+        logger.info(f"Notification partitions: created {created}, dropped {dropped}")
+    return created, dropped
+
+
+def _drop_partition(name):
+    """
+    Detach and drop one monthly partition, then take its unread
+    notifications off their recipients' unread counters. Returns False
+    when the parent couldn't be locked within DETACH_LOCK_TIMEOUT.
+
+    Plain DETACH PARTITION locks the parent ACCESS EXCLUSIVE (CONCURRENTLY
+    isn't allowed next to the default partition), so each partition gets
+    its own short transaction with a lock_timeout.
+    """
+    from . import counters
+
+    qn = connection.ops.quote_name
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+            cursor.execute(f'ALTER TABLE {qn(table_name())} DETACH PARTITION {qn(name)}')
+            # Detached, nothing can mark these read any more
+            cursor.execute(
+                f'SELECT recipient_id, COUNT(*) FROM {qn(name)} WHERE NOT is_read GROUP BY recipient_id'
+            )
+            unread = {str(recipient_id): -count for recipient_id, count in cursor.fetchall()}
+            cursor.execute(f'DROP TABLE {qn(name)}')
+    except OperationalError as e:
+        logger.warning(f"Could not detach notification partition {name}, retrying next run: {e}")
+        return False
+
+    counters.increment_many(unread)
+    if unread:
+        logger.info(f"Dropped {-sum(unread.values())} unread notifications of {len(unread)} users with {name}")
+    return True
+
+
+def delete_in_chunks(queryset, chunk_size=DELETE_CHUNK_SIZE, pause=DELETE_CHUNK_PAUSE, max_seconds=None):
+    """
+    Delete the rows of queryset in id order, chunk_size per statement, each
+    in its own short transaction. Returns progress stats.
+    """
+    stats = {'deleted': 0, 'chunks': 0, 'seconds': 0.0, 'complete': False}
+    start = time.monotonic()
+    last_id = 0
+
+    while True:
+        ids = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            stats['complete'] = True
+            break
+
+        deleted, _ = queryset.model.objects.filter(id__in=ids).delete()
+        last_id = ids[-1]
+        stats['deleted'] += deleted
+        stats['chunks'] += 1
+        stats['seconds'] = time.monotonic() - start
+        logger.info(
+            f"Deleted chunk {stats['chunks']}: {deleted} rows, {stats['deleted']} total "
+            f"({stats['deleted'] / max(stats['seconds'], 1e-6):,.0f} rows/s)"
+        )
+
+        if len(ids) < chunk_size:
+            stats['complete'] = True
+            break
+        if max_seconds is not None and stats['seconds'] >= max_seconds:
+            break
+        if pause:
+            time.sleep(pause)
+
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+
+def expired_read_notifications(days=RETENTION_DAYS):
+    from .models import Notification
+    return Notification.objects.filter(
+        is_read=True,
+        created_at__lt=timezone.now() - timedelta(days=days)
+    )
@@ -0,0 +1,190 @@
+"""
+Cached notification preference snapshots for the delivery paths.
+
+A snapshot is a bitmask of the boolean NotificationPreference flags plus
+the quiet-hours window in seconds since midnight, stored in the default
+(Redis) cache under a versioned key. Users without a preference row are
+cached with the model defaults so they don't hit the database either.
+NotificationPreferenceViewSet rewrites the snapshot on every update.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_time
+
+logger = logging.getLogger(__name__)
+
+# Bump when FLAG_FIELDS or the snapshot layout changes, old keys are then ignored
+SNAPSHOT_VERSION = 1
+SNAPSHOT_TTL = getattr(settings, 'NOTIFICATION_PREFERENCE_CACHE_TTL', 3600)
+
+# Bit positions of the boolean preference fields
+FLAG_FIELDS = (
+    'email_likes', 'email_comments', 'email_follows', 'email_mentions',
+    'email_gifts', 'email_badges', 'email_marketing', 'email_weekly_digest',
+    'push_likes', 'push_comments', 'push_follows', 'push_mentions',
+    'push_gifts', 'push_badges', 'push_system',
+    'in_app_likes', 'in_app_comments', 'in_app_follows', 'in_app_mentions',
+    'in_app_gifts', 'in_app_badges',
+)
+FLAG_BITS = {field: 1 << index for index, field in enumerate(FLAG_FIELDS)}
+
+# Map notification types to push preference fields
+PUSH_PREFERENCE_FIELDS = {
+    'like': 'push_likes',
+    'comment': 'push_comments',
+    'follow': 'push_follows',
+    'mention': 'push_mentions',
+    'gift': 'push_gifts',
+    'badge': 'push_badges',
+    'system': 'push_system',
+}
+
+# Map notification types to email preference fields, types without one
+# (system, transactional mail) are always emailed
+EMAIL_PREFERENCE_FIELDS = {
+    'like': 'email_likes',
+    'comment': 'email_comments',
+    'follow': 'email_follows',
+    'mention': 'email_mentions',
+    'gift': 'email_gifts',
+    'badge': 'email_badges',
+    'marketing': 'email_marketing',
+    'weekly_digest': 'email_weekly_digest',
+}
+
+
+def _seconds(value):
+    # Views may assign 'HH:MM' strings before the instance is reloaded
+    if isinstance(value, str):
+        value = parse_time(value)
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class PreferenceSnapshot:
+    """
+    Immutable view of one user's preferences, cached as a (mask, start, end) tuple
+    """
+    __slots__ = ('mask', 'quiet_start', 'quiet_end')
+
+    def __init__(self, mask, quiet_start=None, quiet_end=None):
+        self.mask = mask
+        # Seconds since midnight, None when quiet hours are off
+        self.quiet_start = quiet_start
+        self.quiet_end = quiet_end
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        mask = 0
+        for field, bit in FLAG_BITS.items():
+            if getattr(preferences, field):
+                mask |= bit
+
+        quiet_start = quiet_end = None
+        if preferences.quiet_hours_enabled and preferences.quiet_hours_start and preferences.quiet_hours_end:
+            quiet_start = _seconds(preferences.quiet_hours_start)
+            quiet_end = _seconds(preferences.quiet_hours_end)
+        return cls(mask, quiet_start, quiet_end)
+
+    def to_tuple(self):
+        return (self.mask, self.quiet_start, self.quiet_end)
+
+    def has(self, field):
+        return bool(self.mask & FLAG_BITS[field])
+
+    def allows_push(self, notification_type):
+        return self.has(PUSH_PREFERENCE_FIELDS.get(notification_type, 'push_system'))
+
+    def allows_email(self, notification_type):
+        field = EMAIL_PREFERENCE_FIELDS.get(notification_type)
+        return field is None or self.has(field)
+
+    def in_quiet_hours(self, now):
+        """Check if now (a time) is within the quiet hours window"""
+        if self.quiet_start is None:
+            return False
+
+        now = _seconds(now)
+        if self.quiet_start <= self.quiet_end:
+            # Same day range
+            return self.quiet_start <= now <= self.quiet_end
+        # Overnight range
+        return now >= self.quiet_start or now <= self.quiet_end
+
+    def quiet_hours_release(self, now):
+        """First datetime after the quiet hours that contain now (a datetime)"""
+        # The end second itself is still quiet (see in_quiet_hours)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        release = midnight + timedelta(seconds=self.quiet_end + 1)
+        if release <= now:
+            release += timedelta(days=1)
+        return release
+
+
+def _default_snapshot():
+    from .models import NotificationPreference
+    return PreferenceSnapshot.from_preferences(NotificationPreference())
+
+
+def cache_key(user_id):
+    return f'notification_prefs:v{SNAPSHOT_VERSION}:{user_id}'
+
+
+def get_snapshots(user_ids):
+    """
+    Snapshots for many users keyed by str(user_id): one cache round trip,
+    plus one query for the misses
+    """
+    from .models import NotificationPreference
+
+    keys = {cache_key(user_id): str(user_id) for user_id in user_ids}
+    try:
+        cached = cache.get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"Preference cache unavailable, reading from database: {e}")
+        cached = {}
+
+    snapshots = {keys[key]: PreferenceSnapshot(*value) for key, value in cached.items()}
+    missing = [user_id for key, user_id in keys.items() if key not in cached]
+    if not missing:
+        return snapshots
+
+    loaded = {
+        str(preferences.user_id): PreferenceSnapshot.from_preferences(preferences)
+        for preferences in NotificationPreference.objects.filter(user_id__in=missing)
+    }
+    default = _default_snapshot()
+    for user_id in missing:
+        loaded.setdefault(user_id, default)
+
+    try:
+        cache.set_many({cache_key(user_id): s.to_tuple() for user_id, s in loaded.items()}, SNAPSHOT_TTL)
+    except Exception as e:
+        logger.warning(f"Could not cache preference snapshots: {e}")
+
+    snapshots.update(loaded)
+    return snapshots
+
+
+def get_snapshot(user_id):
+    return get_snapshots([user_id])[str(user_id)]
+
+
+def store_snapshot(preferences):
+    """Replace the cached snapshot after preferences are saved"""
+    try:
+        cache.set(
+            cache_key(preferences.user_id),
+            PreferenceSnapshot.from_preferences(preferences).to_tuple(),
+            SNAPSHOT_TTL
+        )
+    except Exception as e:
+        logger.error(f"Could not refresh preference snapshot for user {preferences.user_id}: {e}")
+
+
+def invalidate(user_id):
+    try:
+        cache.delete(cache_key(user_id))
+    except Exception as e:
+        logger.error(f"Could not invalidate preference snapshot for user {user_id}: {e}")
@@ -0,0 +1,201 @@
+"""
+Push delivery engine for FCM.
+
+One pooled HTTP/2 client per worker process is reused across tasks.
+Tokens are sent as multicast requests of up to FCM_BATCH_SIZE
+registration_ids, several in flight at once over the same connections,
+and the resulting PushToken updates are applied in bulk.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# FCM multicast limit is 1000 registration_ids, 500 keeps responses small
+FCM_BATCH_SIZE = getattr(settings, 'FCM_BATCH_SIZE', 500)
+FCM_MAX_CONNECTIONS = getattr(settings, 'FCM_MAX_CONNECTIONS', 4)
+FCM_CONCURRENCY = getattr(settings, 'FCM_CONCURRENCY', 8)
+FCM_TIMEOUT = getattr(settings, 'FCM_TIMEOUT', 10)
+
+# Errors meaning the token will never work again
+INVALID_TOKEN_ERRORS = {'InvalidRegistration', 'NotRegistered', 'InvalidPackageName', 'MismatchSenderId'}
+
+# Tokens per UPDATE ... WHERE token IN (...)
+UPDATE_CHUNK_SIZE = 1000
+
+
+class PushResult:
+    """
+    Outcome of a multicast send, tokens split by what happened to them
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.invalid = []
+        self.failed = []
+        self.requests = 0
+
+    @property
+    def total(self):
+        return len(self.succeeded) + len(self.invalid) + len(self.failed)
+
+    def merge(self, other):
+        self.succeeded += other.succeeded
+        self.invalid += other.invalid
+        self.failed += other.failed
+        self.requests += other.requests
+
+
+class FCMPushEngine:
+    """
+    Sends notifications to many tokens over a persistent HTTP/2 connection pool
+    """
+
+    def __init__(self, server_key=None, url=None, batch_size=FCM_BATCH_SIZE,
+                 max_connections=FCM_MAX_CONNECTIONS, concurrency=FCM_CONCURRENCY, timeout=FCM_TIMEOUT):
+        self.server_key = server_key if server_key is not None else getattr(settings, 'FCM_SERVER_KEY', None)
+        self.url = url or getattr(settings, 'FCM_URL', 'https://fcm.googleapis.com/fcm/send')
+        self.batch_size = batch_size
+        self.max_connections = max_connections
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._client = None
+        self._executor = None
+
+    @property
+    def client(self):
+        # Created lazily so each forked Celery worker opens its own connections
+        if self._client is None:
+            import httpx
+            self._client = httpx.Client(
+                # Plain http (local fake FCM) speaks HTTP/2 with prior knowledge
+                http1=self.url.startswith('https://'),
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout,
+                headers={
+                    'Authorization': f'key={self.server_key}',
+                    'Content-Type': 'application/json',
+                },
+            )
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def send(self, tokens, title, message, data=None, collapse_key=None):
+        """
+        Send one notification to every token, returns a PushResult.
+        Batches are multiplexed over the pool, nothing is written to the database.
+        With collapse_key, a newer push replaces an undelivered/displayed older one.
+        """
+        result = PushResult()
+        if not tokens:
+            return result
+        if not self.server_key:
+            logger.warning("FCM_SERVER_KEY not configured")
+            result.failed = list(tokens)
+            return result
+
+        batches = [tokens[i:i + self.batch_size] for i in range(0, len(tokens), self.batch_size)]
+
+        # Until an HTTP/2 connection exists, httpcore opens one connection
+        # per concurrent request, so the first batch goes out on its own
+        if self._client is None or len(batches) == 1:
+            result.merge(self._send_batch(batches.pop(0), title, message, data, collapse_key))
+            if not batches:
+                return result
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        for batch_result in self._executor.map(
+                lambda b: self._send_batch(b, title, message, data, collapse_key), batches):
+            result.merge(batch_result)
+        return result
+
+    def _send_batch(self, tokens, title, message, data, collapse_key=None):
+        result = PushResult()
+        result.requests = 1
+
+        payload = {
+            'registration_ids': tokens,
+            'notification': {
+                'title': title,
+                'body': message,
+                'sound': 'default',
+                'badge': '1',
+            },
+            'data': data or {},
+            'priority': 'high',
+        }
+        if collapse_key:
+            payload['collapse_key'] = collapse_key
+            payload['notification']['tag'] = collapse_key
+
+        try:
+            response = self.client.post(self.url, json=payload)
+            if response.status_code != 200:
+                logger.error(f"FCM HTTP error: {response.status_code}")
+                result.failed = list(tokens)
+                return result
+
+            # results[] is in the same order as registration_ids
+            for token, item in zip(tokens, response.json().get('results', [])):
+                error = item.get('error')
+                if error is None:
+                    result.succeeded.append(token)
+                elif error in INVALID_TOKEN_ERRORS:
+                    result.invalid.append(token)
+                else:
+                    result.failed.append(token)
+        except Exception as e:
+            logger.error(f"Error sending FCM batch of {len(tokens)}: {e}")
+            result.failed = list(tokens)
+
+        return result
+
+
+_engine = None
+
+
+def get_engine():
+    """Process-wide engine, so tasks share the connection pool"""
+    global _engine
+    if _engine is None:
+        _engine = FCMPushEngine()
+    return _engine
+
+
+def apply_results(result):
+    """Bulk-update PushTokens: last_used for delivered tokens, deactivate invalid ones"""
+    from .models import PushToken
+
+    now = timezone.now()
+    for i in range(0, len(result.succeeded), UPDATE_CHUNK_SIZE):
+        # update() skips auto_now, so last_used is set explicitly
+        PushToken.objects.filter(token__in=result.succeeded[i:i + UPDATE_CHUNK_SIZE]).update(last_used=now)
+
+    for i in range(0, len(result.invalid), UPDATE_CHUNK_SIZE):
+        PushToken.objects.filter(token__in=result.invalid[i:i + UPDATE_CHUNK_SIZE]).update(is_active=False)
+
+    if result.invalid:
+        logger.info(f"Deactivated {len(result.invalid)} invalid push tokens")
+
+
+def deliver(tokens, title, message, data=None, collapse_key=None):
+    """Send to tokens with the shared engine and record the outcome"""
+    if not tokens:
+        return PushResult()
+    result = get_engine().send(tokens, title, message, data, collapse_key)
+    apply_results(result)
+    return result
@@ -0,0 +1,73 @@
+"""
+Publish notification events to connected devices over the channel layer.
+
+Every device of a user joins the group notifications_<user_id> (see
+consumers.NotificationConsumer). New notifications are sent in the same
+shape as NotificationSerializer, along with the unread count delta they
+cause; reads and deletes send only the delta. Publishing is best effort,
+clients still resync through unread_count when they reconnect.
+"""
+import asyncio
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(user_id):
+    return f'notifications_{user_id}'
+
+
+def notification_payload(notification, actor_username=None):
+    return {
+        'id': notification.id,
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'data': notification.data,
+        'is_read': notification.is_read,
+        'read_at': notification.read_at.isoformat() if notification.read_at else None,
+        'created_at': notification.created_at.isoformat(),
+        'actor_username': actor_username,
+    }
+
+
+def _publish(events):
+    """Send (user_id, event) pairs concurrently in one event loop run"""
+    if not events:
+        return
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    async def send_all():
+        await asyncio.gather(*(
+            channel_layer.group_send(group_name(user_id), event)
+            for user_id, event in events
+        ))
+
+    try:
+        async_to_sync(send_all)()
+    except Exception as e:
+        logger.warning(f"Could not publish {len(events)} notification events: {e}")
+
+
+def publish_notifications(notifications, unread_delta=1, actor_username=None):
+    """New (unread_delta=1) or updated (unread_delta=0) notifications"""
+    _publish([
+        (notification.recipient_id, {
+            'type': 'notification_created',
+            'notification': notification_payload(notification, actor_username),
+            'unread_delta': unread_delta,
+        })
+        for notification in notifications
+    ])
+
+
+def publish_unread(counts):
+    """Unread count changes, {user_id: delta}"""
+    _publish([
+        (user_id, {'type': 'unread_changed', 'unread_delta': delta})
+        for user_id, delta in counts.items() if delta
+    ])
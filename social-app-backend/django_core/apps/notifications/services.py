@@ -1,5 +1,8 @@
-from apps.notifications.tasks import send_push_notification
-from typing import Dict
+from apps.notifications import aggregation, scheduler, templating
+from apps.notifications.tasks import send_bulk_notifications, send_push_notification
+from datetime import datetime
+from django.utils import timezone
+from typing import Dict, List
 
 class NotificationService:
     """
@@ -12,72 +15,77 @@ class NotificationService:
         notification_type: str,
         title: str,
         message: str,
-        data: Dict = None
+        data: Dict = None,
+        scheduled_at: datetime = None
     ):
         """
-        Send notification to user
+        Send notification to user, at scheduled_at if it is in the future
         """
+        if scheduled_at:
+            scheduled_at = scheduler.parse_at(scheduled_at)
+            if scheduled_at > timezone.now():
+                scheduler.schedule([user_id], title, message, data, notification_type, at=scheduled_at)
+                return
+
         # Send push notification async
         send_push_notification.delay(
             user_id=user_id,
+            notification_type=notification_type,
             title=title,
             message=message,
             data=data or {}
         )
 
     @staticmethod
-    def notify_new_follower(follower_id: str, following_id: str):
+    def send_templated(
+        template_name: str,
+        user_ids: List[str],
+        context: Dict = None,
+        actor_id: str = None,
+        data: Dict = None,
+        scheduled_at: datetime = None
+    ):
         """
-        Notify user about new follower
+        Render a notification template once (see templating.py) and send it
+        to user_ids in bulk
         """
-        from apps.users.models import CustomUser
+        rendered = templating.render(template_name, context, actor_id=actor_id)
+        if rendered is None:
+            return
+        title, message = rendered
+        notification_type = templating.get(template_name).notification_type
+        data = dict(data or {}, actor_id=str(actor_id)) if actor_id else (data or {})
 
-        try:
-            follower = CustomUser.objects.get(id=follower_id)
-            NotificationService.send_notification(
-                user_id=following_id,
-                notification_type='new_follower',
-                title='New Follower',
-                message=f'{follower.username} started following you',
-                data={'follower_id': follower_id}
-            )
-        except:
-            pass
+        if len(user_ids) == 1:
+            NotificationService.send_notification(user_ids[0], notification_type, title, message, data, scheduled_at)
+            return
+
+        send_bulk_notifications.delay(
+            [str(user_id) for user_id in user_ids], title, message, data, notification_type,
+            scheduled_at=scheduled_at.isoformat() if scheduled_at else None
+        )
 
     @staticmethod
-    def notify_new_like(liker_id: str, post_owner_id: str, post_id: str):
+    def notify_new_follower(follower_id: str, following_id: str):
         """
-        Notify post owner about new like
+        Notify user about new follower (aggregated per window)
         """
-        from apps.users.models import CustomUser
+        aggregation.record_event(following_id, 'follow', follower_id)
 
-        try:
-            liker = CustomUser.objects.get(id=liker_id)
-            NotificationService.send_notification(
-                user_id=post_owner_id,
-                notification_type='new_like',
-                title='New Like',
-                message=f'{liker.username} liked your post',
-                data={'post_id': post_id, 'liker_id': liker_id}
-            )
-        except:
-            pass
+    @staticmethod
+    def notify_new_like(liker_id: str, post_owner_id: str, post_id: str):
+        """
+        Notify post owner about new like (aggregated per post and window)
+        """
+        aggregation.record_event(post_owner_id, 'like', liker_id, post_id=post_id)
 
     @staticmethod
     def notify_new_comment(commenter_id: str, post_owner_id: str, post_id: str, comment_text: str):
         """
-        Notify post owner about new comment
+        Notify post owner about new comment (aggregated per post and window)
         """
-        from apps.users.models import CustomUser
-
-        try:
-            commenter = CustomUser.objects.get(id=commenter_id)
-            NotificationService.send_notification(
-                user_id=post_owner_id,
-                notification_type='new_comment',
-                title='New Comment',
-                message=f'{commenter.username} commented: {comment_text[:50]}',
-                data={'post_id': post_id, 'commenter_id': commenter_id}
-            )
-        except:
-            pass
+        aggregation.record_event(
+            post_owner_id, 'comment', commenter_id,
+            post_id=post_id,
+            data={'comment_text': comment_text[:50]}
+        )
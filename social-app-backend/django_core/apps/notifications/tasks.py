@@ -1,15 +1,16 @@
 from celery import shared_task
 import logging
-import requests
+from collections import Counter
+from datetime import date, timedelta
 from django.conf import settings
 from django.utils import timezone
-from .models import PushToken, Notification, NotificationPreference
+from . import analytics, counters, mail, preferences, push, realtime, scheduler
+from .models import PushToken, Notification
 
 logger = logging.getLogger(__name__)
 
-# FCM Server Key - should be in settings
-FCM_SERVER_KEY = getattr(settings, 'FCM_SERVER_KEY', None)
-FCM_URL = 'https://fcm.googleapis.com/fcm/send'
+# Users resolved per query batch (and per Celery task) by bulk sends
+BULK_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_BULK_CHUNK_SIZE', 1000)
 
 
 @shared_task
@@ -18,259 +19,384 @@ def send_push_notification(user_id, title, message, data=None, notification_type
     Send push notification to user via FCM
     """
     try:
-        # Get user's active push tokens
-        push_tokens = PushToken.objects.filter(
-            user_id=user_id,
-            is_active=True
-        ).exclude(token='')
-
-        if not push_tokens.exists():
+        stats = _send_push_to_users([user_id], title, message, data, notification_type)
+        if stats['deferred']:
+            logger.info(f"Push notification deferred until after quiet hours for user {user_id}")
+        elif stats['blocked']:
+            logger.info(f"Push notification blocked by preferences for user {user_id}")
+        elif not stats['devices']:
             logger.info(f"No active push tokens found for user {user_id}")
-            return
+        else:
+            logger.info(f"Sent push notification to {stats['delivered']}/{stats['devices']} devices for user {user_id}")
 
-        # Check user preferences for this notification type
-        try:
-            preferences = NotificationPreference.objects.get(user_id=user_id)
-            should_send_push = _should_send_push_notification(preferences, notification_type)
-            if not should_send_push:
-                logger.info(f"Push notification blocked by user preferences for user {user_id}")
-                return
-        except NotificationPreference.DoesNotExist:
-            # Default to sending if no preferences set
-            pass
-
-        # Check quiet hours
-        if _is_in_quiet_hours(user_id):
-            logger.info(f"Notification blocked by quiet hours for user {user_id}")
-            return
+    except Exception as e:
+        logger.error(f"Error sending push notification to user {user_id}: {e}")
 
-        # Create notification record
-        notification = Notification.objects.create(
-            recipient_id=user_id,
-            notification_type=notification_type,
-            title=title,
-            message=message,
-            data=data or {},
-            sent_via_push=True,
+
+@shared_task
+def send_push_notification_chunk(user_ids, title, message, data=None, notification_type='system',
+                                 record=True, collapse_key=None, scheduled_at=None):
+    """
+    Send push notification to a chunk of users (see send_bulk_notifications
+    and scheduler.drain)
+    """
+    try:
+        stats = _send_push_to_users(
+            user_ids, title, message, data, notification_type,
+            record=record, collapse_key=collapse_key, scheduled_at=scheduled_at
+        )
+        logger.info(
+            f"Bulk push chunk: {stats['notified']}/{len(user_ids)} users notified "
+            f"({stats['blocked']} blocked, {stats['deferred']} deferred), "
+            f"{stats['delivered']}/{stats['devices']} devices"
         )
 
-        # Send to each device
-        success_count = 0
-        for push_token in push_tokens:
-            if _send_fcm_notification(push_token.token, title, message, data):
-                success_count += 1
-                push_token.last_used = timezone.now()
-                push_token.save()
+    except Exception as e:
+        logger.error(f"Error sending push notification chunk of {len(user_ids)} users: {e}")
 
-        logger.info(f"Sent push notification to {success_count}/{push_tokens.count()} devices for user {user_id}")
 
-    except Exception as e:
-        logger.error(f"Error sending push notification to user {user_id}: {e}")
+def _send_push_to_users(user_ids, title, message, data, notification_type, record=True, collapse_key=None,
+                        scheduled_at=None):
+    """
+    Resolve preferences (cached snapshots), quiet hours and tokens for a batch
+    of users, bulk insert their Notifications and multicast to all devices.
+    record=False skips the Notification rows (the caller already stored them).
+    Users in quiet hours are queued on the scheduler until their window ends.
+    """
+    stats = {'blocked': 0, 'deferred': 0, 'notified': 0, 'devices': 0, 'delivered': 0}
+
+    # Cached preference snapshots, users without preferences get the defaults
+    snapshots = preferences.get_snapshots(user_ids)
+    now = timezone.now()
+    blocked = set()
+    deferred = {}  # release time -> user ids
+    for user_id, snapshot in snapshots.items():
+        if not snapshot.allows_push(notification_type):
+            blocked.add(user_id)
+        elif snapshot.in_quiet_hours(now.time()):
+            blocked.add(user_id)
+            deferred.setdefault(snapshot.quiet_hours_release(now), []).append(user_id)
+
+    for release_at, deferred_ids in deferred.items():
+        try:
+            scheduler.schedule(
+                deferred_ids, title, message, data, notification_type,
+                at=release_at, record=record, collapse_key=collapse_key
+            )
+            stats['deferred'] += len(deferred_ids)
+        except Exception as e:
+            # Better early than never: send now instead of dropping them
+            logger.warning(f"Could not defer notification for {len(deferred_ids)} users in quiet hours, "
+                           f"sending now: {e}")
+            blocked.difference_update(deferred_ids)
+
+    allowed = [user_id for user_id in user_ids if str(user_id) not in blocked]
+    stats['blocked'] = len(user_ids) - len(allowed) - stats['deferred']
+    if not allowed:
+        return stats
+
+    # Active tokens of every allowed user in one query
+    tokens_by_user = {}
+    device_types = {}
+    for user_id, token, device_type in PushToken.objects.filter(
+        user_id__in=allowed,
+        is_active=True
+    ).exclude(token='').values_list('user_id', 'token', 'device_type'):
+        tokens_by_user.setdefault(user_id, []).append(token)
+        device_types[token] = device_type
+
+    if not tokens_by_user:
+        return stats
+
+    # Create notification records
+    if record:
+        notifications = Notification.objects.bulk_create([
+            Notification(
+                recipient_id=user_id,
+                notification_type=notification_type,
+                title=title,
+                message=message,
+                data=data or {},
+                sent_via_push=True,
+                scheduled_at=scheduled_at,
+            )
+            for user_id in tokens_by_user
+        ], batch_size=BULK_CHUNK_SIZE)
+        counters.increment_many({user_id: 1 for user_id in tokens_by_user}, publish=False)
+        realtime.publish_notifications(notifications)
+
+    # Multicast to every device, token updates in bulk
+    tokens = [token for user_tokens in tokens_by_user.values() for token in user_tokens]
+    result = push.deliver(tokens, title, message, data, collapse_key)
+
+    succeeded = set(result.succeeded)
+    platforms = Counter((device_types[token], 'sent') for token in tokens)
+    platforms.update((device_types[token], 'delivered') for token in succeeded)
+    analytics.record_push(platforms)
+    if record:
+        undelivered = {
+            user_id for user_id, user_tokens in tokens_by_user.items()
+            if not any(token in succeeded for token in user_tokens)
+        }
+        # sent_via_push means the push reached a device, as counted by analytics
+        if undelivered:
+            Notification.objects.filter(
+                id__in=[notification.id for notification in notifications if notification.recipient_id in undelivered]
+            ).update(sent_via_push=False)
+        analytics.record_sent(notification_type, len(tokens_by_user), len(tokens_by_user) - len(undelivered))
+
+    stats.update(notified=len(tokens_by_user), devices=len(tokens), delivered=len(result.succeeded))
+    return stats
 
 
-def _send_fcm_notification(token, title, message, data=None):
+@shared_task
+def flush_notification_group(recipient_id, group_key):
     """
-    Send notification via FCM
+    Emit the collapsed notification for one aggregation window (see aggregation.py)
     """
-    if not FCM_SERVER_KEY:
-        logger.warning("FCM_SERVER_KEY not configured")
-        return False
+    from . import aggregation
+
+    try:
+        count = aggregation.flush(recipient_id, group_key)
+        if count:
+            logger.info(f"Flushed {count} aggregated events for user {recipient_id} ({group_key})")
 
-    headers = {
-        'Authorization': f'key={FCM_SERVER_KEY}',
-        'Content-Type': 'application/json',
-    }
+    except Exception as e:
+        logger.error(f"Error flushing notification group {group_key} for user {recipient_id}: {e}")
 
-    payload = {
-        'to': token,
-        'notification': {
-            'title': title,
-            'body': message,
-            'sound': 'default',
-            'badge': '1',
-        },
-        'data': data or {},
-        'priority': 'high',
-    }
+
+@shared_task
+def emit_notification_group(recipient_id, group_key, notification_type, actor_ids, data):
+    """
+    Emit a group's notification without a window, when the aggregation
+    buffer is unavailable (see aggregation.record_event)
+    """
+    from . import aggregation
 
     try:
-        response = requests.post(FCM_URL, json=payload, headers=headers, timeout=10)
-        response_data = response.json()
-
-        if response.status_code == 200:
-            if response_data.get('success') == 1:
-                return True
-            else:
-                # Token might be invalid, mark as inactive
-                error = response_data.get('results', [{}])[0].get('error')
-                if error in ['InvalidRegistration', 'NotRegistered', 'InvalidPackageName']:
-                    PushToken.objects.filter(token=token).update(is_active=False)
-                logger.warning(f"FCM error for token {token[:20]}...: {error}")
-        else:
-            logger.error(f"FCM HTTP error: {response.status_code}")
+        aggregation.emit(recipient_id, group_key, notification_type, actor_ids, data)
 
     except Exception as e:
-        logger.error(f"Error sending FCM notification: {e}")
+        logger.error(f"Error emitting notification group {group_key} for user {recipient_id}: {e}")
 
-    return False
 
+@shared_task
+def release_scheduled_notifications():
+    """
+    Release due scheduled and quiet-hours notifications (see scheduler.py)
+    """
+    try:
+        released = scheduler.drain()
+        if released:
+            logger.info(f"Released {released} scheduled notification jobs")
 
-def _should_send_push_notification(preferences, notification_type):
+    except Exception as e:
+        logger.error(f"Error releasing scheduled notifications: {e}")
+
+
+@shared_task
+def send_email_notification(user_id, subject, message, html_message=None, notification_type=None):
     """
-    Check if push notification should be sent based on user preferences
+    Send email notification to user, on the worker's shared mail connection.
+    With a notification_type the user's email preference for it is honoured;
+    emails falling in quiet hours are retried when the window ends.
     """
-    # Map notification types to preference fields
-    type_mapping = {
-        'like': 'push_likes',
-        'comment': 'push_comments',
-        'follow': 'push_follows',
-        'mention': 'push_mentions',
-        'gift': 'push_gifts',
-        'badge': 'push_badges',
-        'system': 'push_system',
-    }
+    from django.core.mail import EmailMultiAlternatives
+    from apps.users.models import CustomUser
+
+    try:
+        # Check email preferences (cached snapshot)
+        snapshot = preferences.get_snapshot(user_id)
+        if notification_type and not snapshot.allows_email(notification_type):
+            logger.info(f"Email notification blocked by preferences for user {user_id}")
+            return
+
+        now = timezone.now()
+        if snapshot.in_quiet_hours(now.time()):
+            send_email_notification.apply_async(
+                (user_id, subject, message, html_message, notification_type),
+                eta=snapshot.quiet_hours_release(now)
+            )
+            logger.info(f"Email notification deferred until after quiet hours for user {user_id}")
+            return
 
-    preference_field = type_mapping.get(notification_type, 'push_system')
-    return getattr(preferences, preference_field, True)
+        user = CustomUser.objects.get(id=user_id)
+
+        email = EmailMultiAlternatives(
+            subject,
+            message,
+            getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@yourapp.com'),
+            [user.email],
+        )
+        if html_message:
+            email.attach_alternative(html_message, 'text/html')
+        if mail.send_messages([email]):
+            logger.info(f"Sent email notification to user {user_id}")
+
+    except Exception as e:
+        logger.error(f"Error sending email notification to user {user_id}: {e}")
 
 
-def _is_in_quiet_hours(user_id):
+@shared_task
+def send_email_campaign(campaign_id, resume=False):
     """
-    Check if current time is within user's quiet hours
+    Send an email campaign (see campaigns.py)
     """
+    from . import campaigns
+
     try:
-        preferences = NotificationPreference.objects.get(user_id=user_id)
-        if not preferences.quiet_hours_enabled:
-            return False
+        campaigns.dispatch(campaign_id, resume=resume)
 
-        now = timezone.now().time()
-        start = preferences.quiet_hours_start
-        end = preferences.quiet_hours_end
+    except Exception as e:
+        logger.error(f"Error sending email campaign {campaign_id}: {e}")
 
-        if start and end:
-            if start <= end:
-                # Same day range
-                return start <= now <= end
-            else:
-                # Overnight range
-                return now >= start or now <= end
 
-    except NotificationPreference.DoesNotExist:
-        pass
+@shared_task
+def dispatch_scheduled_campaigns():
+    """
+    Start the email campaigns whose scheduled_at has passed, and resume the
+    ones left in 'sending' by a lost mail server or a dead worker
+    """
+    from . import campaigns
+    from .models import EmailCampaign
+
+    for campaign_id in EmailCampaign.objects.filter(
+        status='scheduled',
+        scheduled_at__lte=timezone.now()
+    ).values_list('id', flat=True):
+        send_email_campaign.delay(campaign_id)
 
-    return False
+    for campaign_id in campaigns.stale():
+        logger.warning(f"Resuming stalled email campaign {campaign_id}")
+        send_email_campaign.delay(campaign_id, resume=True)
 
 
 @shared_task
-def send_email_notification(user_id, subject, message, html_message=None):
+def flush_email_tracking():
     """
-    Send email notification to user
+    Write buffered email opens/clicks into their campaigns (see tracking.py)
     """
-    from django.core.mail import send_mail
-    from apps.users.models import CustomUser
+    from . import tracking
 
     try:
-        user = CustomUser.objects.get(id=user_id)
+        flushed = tracking.flush()
+        if flushed:
+            logger.info(f"Flushed email tracking for {flushed} campaigns")
 
-        # Check email preferences
+    except Exception as e:
+        logger.error(f"Error flushing email tracking: {e}")
+
+
+@shared_task
+def send_bulk_notifications(user_ids, title, message, data=None, notification_type='system', scheduled_at=None):
+    """
+    Send push notifications to multiple users, one task per BULK_CHUNK_SIZE users.
+    With a future scheduled_at (ISO 8601) the chunks are queued on the scheduler.
+    """
+    if scheduled_at:
         try:
-            preferences = NotificationPreference.objects.get(user=user)
-            # For now, assume email notifications are enabled
-            # You could add more granular email preferences here
-        except NotificationPreference.DoesNotExist:
-            pass
+            at = scheduler.parse_at(scheduled_at)
+        except ValueError as e:
+            logger.error(f"Not sending bulk notification to {len(user_ids)} users: {e}")
+            return
+        if at > timezone.now():
+            scheduler.schedule(user_ids, title, message, data, notification_type, at=at)
+            return
 
-        send_mail(
-            subject,
-            message,
-            getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@yourapp.com'),
-            [user.email],
-            html_message=html_message,
-            fail_silently=False,
+    for i in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        send_push_notification_chunk.delay(
+            user_ids[i:i + BULK_CHUNK_SIZE], title, message, data, notification_type
         )
 
-        logger.info(f"Sent email notification to user {user_id}")
+
+@shared_task
+def send_template_to_audience(template_name, context=None, data=None):
+    """
+    Send a notification template to its target_audience segment
+    (see segments.py), one chunk task per BULK_CHUNK_SIZE users
+    """
+    from . import segments, templating
+
+    try:
+        template = templating.get(template_name)
+        title, message = template.render(context or {})
+        audience = segments.get(template.target_audience)
+        for user_ids in audience.user_ids(BULK_CHUNK_SIZE):
+            send_push_notification_chunk.delay(user_ids, title, message, data, template.notification_type)
+        logger.info(f"Queued template {template_name} for {len(audience)} users ({template.target_audience})")
 
     except Exception as e:
-        logger.error(f"Error sending email notification to user {user_id}: {e}")
+        logger.error(f"Error sending template {template_name} to its audience: {e}")
 
 
 @shared_task
-def send_bulk_notifications(user_ids, title, message, data=None, notification_type='system'):
+def materialize_segments():
     """
-    Send push notifications to multiple users
+    Recompute the audience segments (see segments.py)
     """
-    for user_id in user_ids:
-        send_push_notification.delay(user_id, title, message, data, notification_type)
+    from . import segments
+
+    try:
+        segments.materialize()
+
+    except Exception as e:
+        logger.error(f"Error materializing segments: {e}")
 
 
 @shared_task
 def cleanup_expired_notifications():
     """
-    Clean up old read notifications (keep last 30 days)
+    Clean up old read notifications (keep NOTIFICATION_RETENTION_DAYS) in
+    bounded chunks, and rotate monthly partitions when the table is partitioned
     """
-    from django.utils import timezone
-    from datetime import timedelta
+    from . import partitioning
+
+    if partitioning.is_partitioned():
+        partitioning.maintain_partitions()
 
-    cutoff_date = timezone.now() - timedelta(days=30)
-    deleted_count = Notification.objects.filter(
-        is_read=True,
-        created_at__lt=cutoff_date
-    ).delete()
+    stats = partitioning.delete_in_chunks(
+        partitioning.expired_read_notifications(),
+        max_seconds=getattr(settings, 'NOTIFICATION_DELETE_MAX_SECONDS', 900)
+    )
+
+    logger.info(
+        f"Cleaned up {stats['deleted']} expired notifications in {stats['chunks']} chunks "
+        f"({stats['seconds']:.1f}s{'' if stats['complete'] else ', time budget reached'})"
+    )
+
+
+@shared_task
+def reconcile_unread_counters():
+    """
+    Correct drifted Redis unread counters against the database
+    """
+    try:
+        checked, corrected = counters.reconcile()
+        logger.info(f"Reconciled unread counters: {corrected}/{checked} corrected")
 
-    logger.info(f"Cleaned up {deleted_count} expired notifications")
+    except Exception as e:
+        logger.error(f"Error reconciling unread counters: {e}")
 
 
 @shared_task
 def update_notification_analytics():
     """
-    Update daily notification analytics
-    """
-    from django.utils import timezone
-    from django.db.models import Count, Q
-
-    today = timezone.now().date()
-
-    # Calculate metrics
-    notifications_sent = Notification.objects.filter(
-        created_at__date=today
-    ).count()
-
-    notifications_delivered = Notification.objects.filter(
-        created_at__date=today,
-        sent_via_push=True
-    ).count()
-
-    notifications_read = Notification.objects.filter(
-        created_at__date=today,
-        is_read=True
-    ).count()
-
-    active_tokens = PushToken.objects.filter(
-        is_active=True,
-        created_at__date=today
-    ).count()
-
-    # By type analytics
-    by_type = {}
-    type_counts = Notification.objects.filter(
-        created_at__date=today
-    ).values('notification_type').annotate(count=Count('id'))
-
-    for item in type_counts:
-        by_type[item['notification_type']] = item['count']
-
-    # Update or create analytics record
-    from .models import NotificationAnalytics
-    NotificationAnalytics.objects.update_or_create(
-        date=today,
-        defaults={
-            'notifications_sent': notifications_sent,
-            'notifications_delivered': notifications_delivered,
-            'notifications_read': notifications_read,
-            'push_tokens_active': active_tokens,
-            'by_type': by_type,
-        }
-    )
+    Flush today's (and yesterday's late) analytics counters into NotificationAnalytics
+    """
+    today = timezone.localdate()
+    for day in (today - timedelta(days=1), today):
+        try:
+            if analytics.flush(day) is not None:
+                logger.info(f"Updated notification analytics for {day}")
+
+        except Exception as e:
+            logger.error(f"Error flushing notification analytics for {day}: {e}")
+
 
-    logger.info(f"Updated notification analytics for {today}")
+@shared_task
+def backfill_notification_analytics(day):
+    """
+    Rebuild one day's analytics (YYYY-MM-DD) from the notification rows
+    """
+    analytics.backfill(date.fromisoformat(day))
+    logger.info(f"Backfilled notification analytics for {day}")
@@ -0,0 +1,165 @@
+"""
+Compiled notification templates.
+
+Titles and messages use str.format placeholders ("{actor} liked your
+post"). get(name) returns the NotificationTemplate of that name, or the
+built-in default when there is no active row, compiled once per process
+and version (the row's updated_at). Template rows are cached in the
+Django cache and invalidated when a template is saved or deleted.
+
+render_many() renders a whole batch from one query for the usernames of
+every actor involved, instead of a CustomUser lookup per notification.
+"""
+import logging
+from string import Formatter
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_TTL = 60 * 60
+DEFAULT_VERSION = 'default'
+
+# name: (notification_type, title_template, message_template)
+DEFAULTS = {
+    'like': ('like', 'New Like', '{actor} liked your post'),
+    'like_grouped': ('like', 'New Like', '{actor} and {others} liked your post'),
+    'comment': ('comment', 'New Comment', '{actor} commented: {text}'),
+    'comment_grouped': ('comment', 'New Comment', '{actor} and {others} commented on your post'),
+    'follow': ('follow', 'New Follower', '{actor} started following you'),
+    'follow_grouped': ('follow', 'New Follower', '{actor} and {others} started following you'),
+    'level_up': ('level_up', 'Level Up! 🎉', 'Congratulations! You reached Level {level}'),
+}
+
+_formatter = Formatter()
+_compiled = {}  # name -> CompiledTemplate of the latest version seen
+
+
+def _cache_key(name):
+    return f'notif_template:{name}'
+
+
+def _compile(source):
+    """Split a format string once into (literal, field, conversion, spec) parts"""
+    return [
+        (literal, field, conversion, spec)
+        for literal, field, spec, conversion in _formatter.parse(source)
+    ]
+
+
+def _render(parts, context):
+    chunks = []
+    for literal, field, conversion, spec in parts:
+        chunks.append(literal)
+        if field is None:
+            continue
+        # Missing variables render empty rather than failing a whole batch
+        value = context.get(field, '')
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        chunks.append(format(value, spec) if spec else str(value))
+    return ''.join(chunks)
+
+
+class CompiledTemplate:
+    def __init__(self, name, version, notification_type, title_template, message_template, target_audience='all'):
+        self.name = name
+        self.version = version
+        self.notification_type = notification_type
+        self.target_audience = target_audience
+        self._title = _compile(title_template)
+        self._message = _compile(message_template)
+
+    def render(self, context):
+        """(title, message) for a context dict"""
+        return _render(self._title, context), _render(self._message, context)
+
+
+def _load(name):
+    from .models import NotificationTemplate
+
+    source = cache.get(_cache_key(name))
+    if source is None:
+        row = NotificationTemplate.objects.filter(name=name, is_active=True).values(
+            'notification_type', 'title_template', 'message_template', 'target_audience', 'updated_at'
+        ).first()
+        if row:
+            source = {
+                'version': row['updated_at'].isoformat(),
+                'notification_type': row['notification_type'],
+                'title': row['title_template'],
+                'message': row['message_template'],
+                'target_audience': row['target_audience'],
+            }
+        else:
+            source = {'version': None}  # Cache the miss too
+        cache.set(_cache_key(name), source, TEMPLATE_CACHE_TTL)
+    return source
+
+
+def get(name):
+    """Compiled template by name, KeyError when there is neither a row nor a default"""
+    try:
+        source = _load(name)
+    except Exception as e:
+        logger.warning(f"Could not load notification template {name}, using the default: {e}")
+        source = {'version': None}
+
+    if source['version'] is None:
+        if name not in DEFAULTS:
+            raise KeyError(f"Unknown notification template: {name}")
+        notification_type, title, message = DEFAULTS[name]
+        source = {'version': DEFAULT_VERSION, 'notification_type': notification_type,
+                  'title': title, 'message': message}
+
+    compiled = _compiled.get(name)
+    if compiled is None or compiled.version != source['version']:
+        compiled = CompiledTemplate(
+            name, source['version'], source['notification_type'], source['title'], source['message'],
+            source.get('target_audience', 'all')
+        )
+        _compiled[name] = compiled
+    return compiled
+
+
+def invalidate(name):
+    cache.delete(_cache_key(name))
+
+
+def render(name, context=None, actor_id=None):
+    """(title, message) for one notification, None when the actor doesn't exist"""
+    return render_many(name, [dict(context or {}, actor_id=actor_id)])[0]
+
+
+def actor_names(actor_ids):
+    """{str(user_id): username} for actor_ids in one query"""
+    from apps.users.models import CustomUser
+
+    actor_ids = {str(actor_id) for actor_id in actor_ids if actor_id}
+    if not actor_ids:
+        return {}
+    return {
+        str(user_id): username
+        for user_id, username in CustomUser.objects.filter(id__in=actor_ids).values_list('id', 'username')
+    }
+
+
+def render_many(name, items):
+    """
+    Render a batch of context dicts with the compiled template. Items with
+    an actor_id get {actor} from one username query for the whole batch;
+    their entry is None when that user no longer exists.
+    """
+    template = get(name)
+    usernames = actor_names(item.get('actor_id') for item in items)
+
+    rendered = []
+    for item in items:
+        context = item
+        if item.get('actor_id'):
+            actor = usernames.get(str(item['actor_id']))
+            if actor is None:
+                rendered.append(None)
+                continue
+            context = dict(item, actor=actor)
+        rendered.append(template.render(context))
+    return rendered
@@ -0,0 +1,351 @@
+import smtplib
+from datetime import datetime, time, timedelta
+from unittest import mock
+import fakeredis
+from django.core.mail.backends.locmem import EmailBackend
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.activities.models import Activity
+from apps.monetization.models import Transaction
+from core import redis_client
+from apps.notifications import aggregation, analytics, campaigns, push, scheduler, segments
+from apps.notifications import mail as campaign_mail
+from apps.notifications.models import EmailCampaign, Notification, NotificationPreference, PushToken
+from apps.notifications.preferences import PreferenceSnapshot
+from apps.notifications.services import NotificationService
+from apps.notifications.tasks import (
+    _send_push_to_users, dispatch_scheduled_campaigns, emit_notification_group, send_bulk_notifications,
+    send_email_campaign, send_email_notification
+)
+
+User = get_user_model()
+
+
+class FakeRedisMixin:
+    """Points core.redis_client at an in-memory Redis for the test"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(redis_client, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class SegmentTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        segments._state.update(generation=None, index=None, segments={})
+        self.users = {
+            name: User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+            for name in ('ann', 'bob', 'cat', 'dan', 'eve')
+        }
+        Activity.objects.create(user=self.users['ann'], activity_type='login')
+        Activity.objects.create(user=self.users['bob'], activity_type='login')
+        Activity.objects.create(user=self.users['eve'], activity_type='login')
+        Transaction.objects.create(user=self.users['bob'], transaction_type='purchase', amount=100, description='coins')
+        Transaction.objects.create(user=self.users['cat'], transaction_type='purchase', amount=100, description='coins')
+        NotificationPreference.objects.create(user=self.users['dan'], email_marketing=True)
+        User.objects.filter(pk=self.users['ann'].pk).update(is_verified=True)
+        # Deactivated accounts never make it into a segment
+        User.objects.filter(pk=self.users['eve'].pk).update(is_active=False)
+
+    def names(self, segment):
+        ids = {user_id for chunk in segment.user_ids() for user_id in chunk}
+        return {name for name, user in self.users.items() if str(user.id) in ids}
+
+    def test_materialize(self):
+        segments.materialize()
+
+        self.assertEqual(self.names(segments.get('all')), {'ann', 'bob', 'cat', 'dan'})
+        self.assertEqual(self.names(segments.get('active')), {'ann', 'bob'})
+        self.assertEqual(self.names(segments.get('inactive')), {'cat', 'dan'})
+        self.assertEqual(self.names(segments.get('premium')), {'bob', 'cat'})
+        self.assertEqual(self.names(segments.get('verified')), {'ann'})
+        self.assertEqual(self.names(segments.get('email_marketing')), {'dan'})
+
+    def test_evaluate(self):
+        segments.materialize()
+
+        self.assertEqual(self.names(segments.evaluate(['verified', 'premium'])), {'ann', 'bob', 'cat'})
+        self.assertEqual(self.names(segments.evaluate({'require': ['active'], 'exclude': ['premium']})), {'ann'})
+        self.assertEqual(len(segments.evaluate({'include': ['inactive'], 'require': ['premium']})), 1)
+        with self.assertRaises(ValueError):
+            segments.evaluate({'only': ['active']})
+
+    def test_membership_and_resume(self):
+        segments.materialize()
+        everyone = segments.get('all')
+        ordered = [user_id for chunk in everyone.user_ids(chunk_size=2) for user_id in chunk]
+
+        self.assertEqual(ordered, sorted(ordered))
+        self.assertIn(self.users['bob'].id, everyone)
+        self.assertNotIn(self.users['eve'].id, everyone)
+        self.assertEqual([user_id for chunk in everyone.user_ids(after=ordered[1]) for user_id in chunk], ordered[2:])
+
+    def test_loaded_from_cache_by_other_workers(self):
+        generation = segments.materialize()
+        segments._state.update(generation=None, index=None, segments={})
+
+        self.assertEqual(self.names(segments.get('premium')), {'bob', 'cat'})
+        self.assertEqual(segments._state['generation'], generation)
+
+
+class EmailPreferenceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ann', email='ann@example.com', password='testpass123')
+        self.preferences = NotificationPreference.objects.create(user=self.user, email_likes=False)
+
+    def test_opted_out_type_is_not_sent(self):
+        send_email_notification(str(self.user.id), 'Liked', 'Someone liked your post', notification_type='like')
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_opted_in_and_untyped_mail_is_sent(self):
+        send_email_notification(str(self.user.id), 'Comment', 'New comment', notification_type='comment')
+        send_email_notification(str(self.user.id), 'Receipt', 'Thanks for your purchase')
+        self.assertEqual([message.subject for message in mail.outbox], ['Comment', 'Receipt'])
+        self.assertEqual(mail.outbox[0].to, ['ann@example.com'])
+
+    def test_quiet_hours_defer_the_email(self):
+        self.preferences.quiet_hours_enabled = True
+        self.preferences.quiet_hours_start = time(0, 0)
+        self.preferences.quiet_hours_end = time(23, 59, 59)
+        self.preferences.save()
+        cache.clear()
+
+        with mock.patch.object(send_email_notification, 'apply_async') as apply_async:
+            send_email_notification(str(self.user.id), 'Comment', 'New comment', notification_type='comment')
+
+        self.assertEqual(len(mail.outbox), 0)
+        args, kwargs = apply_async.call_args
+        self.assertEqual(args[0], (str(self.user.id), 'Comment', 'New comment', None, 'comment'))
+        self.assertIn('eta', kwargs)
+
+
+class AggregationTest(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner, self.ann, self.bob = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+            for name in ('owner', 'ann', 'bob')
+        ]
+
+    def follow_window(self, *actors):
+        with mock.patch('apps.notifications.tasks.flush_notification_group.apply_async'):
+            for actor in actors:
+                aggregation.record_event(self.owner.id, 'follow', actor.id)
+        aggregation.flush(str(self.owner.id), 'follow')
+        return Notification.objects.get(recipient=self.owner, group_key='follow', is_read=False)
+
+    def test_window_collapses_into_one_notification(self):
+        notification = self.follow_window(self.ann, self.bob, self.ann)
+
+        self.assertEqual(notification.data['actor_count'], 2)
+        self.assertEqual(notification.message, 'ann and 1 other started following you')
+
+    def test_repeated_actor_across_windows_counts_once(self):
+        self.follow_window(self.ann)
+        notification = self.follow_window(self.ann)
+        self.assertEqual(notification.data['actor_count'], 1)
+
+        notification = self.follow_window(self.bob)
+        self.assertEqual(notification.data['actor_count'], 2)
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 1)
+
+    def test_read_notification_starts_a_new_count(self):
+        self.follow_window(self.ann, self.bob)
+        Notification.objects.filter(recipient=self.owner).update(is_read=True)
+
+        notification = self.follow_window(self.ann)
+        self.assertEqual(notification.data['actor_count'], 1)
+
+    def test_redis_down_emits_from_a_task(self):
+        with mock.patch.object(self.redis, 'pipeline', side_effect=ConnectionError('down')), \
+                mock.patch('apps.notifications.tasks._send_push_to_users') as send_push, \
+                mock.patch.object(emit_notification_group, 'delay') as delay:
+            aggregation.record_event(self.owner.id, 'follow', self.ann.id)
+
+        send_push.assert_not_called()
+        delay.assert_called_once_with(str(self.owner.id), 'follow', 'follow', [str(self.ann.id)], {})
+
+
+class AnalyticsTest(FakeRedisMixin, TestCase):
+    """Live counters and backfill() agree on sent, delivered and read"""
+
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create_user(username='ann', email='ann@example.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='testpass123')
+        PushToken.objects.create(user=self.ann, token='ann-token', device_type='android')
+        PushToken.objects.create(user=self.bob, token='bob-token', device_type='ios')
+
+    def test_backfill_matches_the_live_counters(self):
+        yesterday = Notification.objects.create(recipient=self.ann, notification_type='system', title='Old', message='Old')
+        Notification.objects.filter(id=yesterday.id).update(created_at=timezone.now() - timedelta(days=1))
+        result = push.PushResult()
+        result.succeeded.append('ann-token')
+        with mock.patch.object(push, 'deliver', return_value=result):
+            _send_push_to_users([str(self.ann.id), str(self.bob.id)], 'Hi', 'Now', {}, 'system')
+
+        client = APIClient()
+        client.force_authenticate(self.ann)
+        client.post(reverse('notification-mark-read', args=[yesterday.id]))
+        live = analytics.flush()
+        live = (live.notifications_sent, live.notifications_delivered, live.notifications_read)
+
+        repaired = analytics.backfill(timezone.localdate())
+        self.assertEqual(live, (2, 1, 1))
+        self.assertEqual(
+            (repaired.notifications_sent, repaired.notifications_delivered, repaired.notifications_read), live
+        )
+
+
+class FlakyBackend(EmailBackend):
+    """locmem backend refusing 'refused' addresses and dropping the connection on EMAIL_TEST_UNREACHABLE ones"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0] in getattr(settings, 'EMAIL_TEST_UNREACHABLE', ()):
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            if 'refused' in message.to[0]:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='apps.notifications.tests.FlakyBackend')
+class CampaignDispatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        campaign_mail.close()
+        self.addCleanup(campaign_mail.close)
+        for patch in (mock.patch.object(campaigns, 'BATCH_SIZE', 2), mock.patch.object(campaigns, 'RATE_LIMIT', 0)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        for name in ('ann', 'bob', 'refused', 'dan', 'eve'):
+            user = User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+            NotificationPreference.objects.create(user=user, email_marketing=True)
+        self.campaign = EmailCampaign.objects.create(
+            name='Spring', subject='Hello', content='<p>Hi {{ username }} ({{ campaign_name }}){{ campaign.id }}</p>'
+        )
+
+    def sent_to(self):
+        return sorted(message.to[0] for message in mail.outbox)
+
+    def test_refused_recipient_does_not_stop_the_campaign(self):
+        self.assertEqual(campaigns.dispatch(self.campaign.id), 4)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sent')
+        self.assertEqual((self.campaign.total_recipients, self.campaign.sent_count), (5, 4))
+        self.assertNotIn('refused@example.com', self.sent_to())
+
+    def test_fixed_template_context(self):
+        campaigns.dispatch(self.campaign.id)
+
+        body = next(message for message in mail.outbox if message.to == ['ann@example.com']).body
+        self.assertIn('Hi ann (Spring)', body)
+        self.assertNotIn(str(self.campaign.id), body)
+
+    def test_resume_after_connection_loss_sends_nobody_twice(self):
+        emails = [email for _, email, _ in campaigns._rows(campaigns.recipients(self.campaign), None, None)]
+        with self.settings(EMAIL_TEST_UNREACHABLE=[emails[3]]), self.assertRaises(campaign_mail.MailConnectionLost):
+            campaigns.dispatch(self.campaign.id)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sending')
+        sent_before = self.sent_to()
+
+        campaigns.dispatch(self.campaign.id, resume=True)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sent')
+        self.assertEqual(self.campaign.sent_count, 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(self.sent_to(), sorted(email for email in emails if 'refused' not in email))
+        self.assertTrue(set(sent_before) < set(self.sent_to()))
+
+    def test_stalled_campaign_is_resumed_by_beat(self):
+        emails = [email for _, email, _ in campaigns._rows(campaigns.recipients(self.campaign), None, None)]
+        with self.settings(EMAIL_TEST_UNREACHABLE=[emails[3]]), self.assertRaises(campaign_mail.MailConnectionLost):
+            campaigns.dispatch(self.campaign.id)
+
+        with mock.patch.object(send_email_campaign, 'delay') as delay:
+            dispatch_scheduled_campaigns()
+            delay.assert_not_called()
+
+            stalled_at = timezone.now() - timedelta(seconds=campaigns.STALE_AFTER + 1)
+            EmailCampaign.objects.filter(id=self.campaign.id).update(updated_at=stalled_at)
+            dispatch_scheduled_campaigns()
+            dispatch_scheduled_campaigns()
+        delay.assert_called_once_with(self.campaign.id, resume=True)
+
+        send_email_campaign(self.campaign.id, resume=True)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count), ('sent', 4))
+
+    def test_total_counts_segment_members_who_are_recipients(self):
+        segments._state.update(generation=None, index=None, segments={})
+        User.objects.filter(username='ann').update(is_verified=True)
+        segments.materialize()
+        self.campaign.target_segments = {'segments': ['all'], 'is_verified': True}
+        self.campaign.save()
+
+        self.assertEqual(campaigns.dispatch(self.campaign.id), 1)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.total_recipients, self.campaign.sent_count), (1, 1))
+
+
+class SchedulingTest(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='ann', email='ann@example.com', password='testpass123')
+
+    def test_naive_scheduled_at_is_scheduled(self):
+        at = timezone.make_naive(timezone.now() + timedelta(hours=1))
+        NotificationService.send_notification(str(self.user.id), 'system', 'Hi', 'Later', scheduled_at=at)
+
+        self.assertEqual(scheduler.pending(), 1)
+        (_, score), = self.redis.zrange(scheduler.SCHEDULE_KEY, 0, -1, withscores=True)
+        self.assertEqual(score, timezone.make_aware(at).timestamp())
+
+    def test_malformed_scheduled_at_is_rejected(self):
+        with mock.patch('apps.notifications.tasks.send_push_notification_chunk.delay') as delay:
+            send_bulk_notifications([str(self.user.id)], 'Hi', 'Later', scheduled_at='next tuesday')
+            send_bulk_notifications([str(self.user.id)], 'Hi', 'Later', scheduled_at='2025-02-30T10:00:00')
+
+        delay.assert_not_called()
+        self.assertEqual(scheduler.pending(), 0)
+        with self.assertRaises(ValueError):
+            scheduler.parse_at('soon')
+
+    def test_quiet_hours_fall_back_to_sending_when_scheduler_fails(self):
+        NotificationPreference.objects.create(
+            user=self.user, quiet_hours_enabled=True, quiet_hours_start=time(0, 0), quiet_hours_end=time(23, 59, 59)
+        )
+        PushToken.objects.create(user=self.user, token='token-1', device_type='android')
+        result = push.PushResult()
+        result.succeeded.append('token-1')
+
+        with mock.patch.object(scheduler, 'schedule', side_effect=ConnectionError('down')), \
+                mock.patch.object(push, 'deliver', return_value=result) as deliver:
+            stats = _send_push_to_users([str(self.user.id)], 'Hi', 'Now', {}, 'system')
+
+        deliver.assert_called_once()
+        self.assertEqual((stats['deferred'], stats['delivered']), (0, 1))
+        self.assertTrue(Notification.objects.filter(recipient=self.user).exists())
+
+    def test_quiet_hours_release_right_after_the_end_second(self):
+        snapshot = PreferenceSnapshot(0, 22 * 3600, 7 * 3600)
+        now = timezone.make_aware(datetime(2025, 4, 2, 23, 30))
+
+        self.assertTrue(snapshot.in_quiet_hours(time(7, 0, 0)))
+        self.assertFalse(snapshot.in_quiet_hours(time(7, 0, 1)))
+        self.assertEqual(snapshot.quiet_hours_release(now), timezone.make_aware(datetime(2025, 4, 3, 7, 0, 1)))
@@ -0,0 +1,126 @@
+"""
+Email campaign open/click tracking, buffered in Redis.
+
+Campaign HTML gets a tracking pixel and its links rewritten to the click
+redirect (instrument()); both carry a signed (campaign, user[, url])
+token, so ids can't be forged and the redirect only goes where the
+campaign linked. Each hit is an INCR plus a PFADD of the user into a
+HyperLogLog and marks the campaign dirty; flush() then writes the unique
+counts into EmailCampaign.open_count/click_count with one UPDATE per
+dirty campaign instead of one per open.
+"""
+import html
+import logging
+import re
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SALT = 'notifications.email_tracking'
+DIRTY_KEY = 'email_track:dirty'
+# Long enough for late opens, refreshed on every hit
+TRACKING_TTL = 90 * 24 * 60 * 60
+EVENTS = ('open', 'click')
+
+LINK_PATTERN = re.compile(r'href="(https?://[^"]+)"', re.IGNORECASE)
+
+
+def _key(campaign_id, name):
+    return f'email_track:{campaign_id}:{name}'
+
+
+def make_token(campaign_id, user_id, url=None):
+    value = [campaign_id, str(user_id)] + ([url] if url else [])
+    return signing.dumps(value, salt=SALT, compress=True)
+
+
+def read_token(token):
+    """(campaign_id, user_id, url or None), None when the token is not valid"""
+    try:
+        value = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        return None
+    campaign_id, user_id, *url = value
+    return campaign_id, user_id, url[0] if url else None
+
+
+def _absolute(path):
+    return getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/') + path
+
+
+def instrument(content, campaign_id, user_id):
+    """Add the open pixel and route links through the click redirect"""
+    def track_link(match):
+        url = html.unescape(match.group(1))
+        path = reverse('email_track_click', args=[make_token(campaign_id, user_id, url)])
+        return f'href="{html.escape(_absolute(path))}"'
+
+    content = LINK_PATTERN.sub(track_link, content)
+    pixel_url = _absolute(reverse('email_track_open', args=[make_token(campaign_id, user_id)]))
+    pixel = f'<img src="{html.escape(pixel_url)}" width="1" height="1" alt="" style="display:none">'
+    if '</body>' in content:
+        return content.replace('</body>', pixel + '</body>', 1)
+    return content + pixel
+
+
+def record(campaign_id, user_id, event):
+    """Count one open or click, never raises"""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(_key(campaign_id, f'{event}s'))
+        pipe.pfadd(_key(campaign_id, f'{event}_users'), user_id)
+        if event == 'click':
+            # A click means the mail was opened, even with images blocked
+            pipe.pfadd(_key(campaign_id, 'open_users'), user_id)
+        for name in ('opens', 'clicks', 'open_users', 'click_users'):
+            pipe.expire(_key(campaign_id, name), TRACKING_TTL)
+        pipe.sadd(DIRTY_KEY, campaign_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record email {event} for campaign {campaign_id}: {e}")
+
+
+def stats(campaign_id):
+    """Total and unique opens/clicks straight from Redis"""
+    pipe = get_redis().pipeline(transaction=False)
+    for event in EVENTS:
+        pipe.get(_key(campaign_id, f'{event}s'))
+        pipe.pfcount(_key(campaign_id, f'{event}_users'))
+    opens, unique_opens, clicks, unique_clicks = pipe.execute()
+    return {
+        'opens': int(opens or 0),
+        'unique_opens': unique_opens,
+        'clicks': int(clicks or 0),
+        'unique_clicks': unique_clicks,
+    }
+
+
+def flush():
+    """Write unique counts of campaigns hit since the last flush, returns how many"""
+    from .models import EmailCampaign
+
+    client = get_redis()
+    pipe = client.pipeline()
+    pipe.smembers(DIRTY_KEY)
+    pipe.delete(DIRTY_KEY)
+    campaign_ids, _ = pipe.execute()
+    if not campaign_ids:
+        return 0
+
+    campaign_ids = sorted(campaign_ids)
+    pipe = client.pipeline(transaction=False)
+    for campaign_id in campaign_ids:
+        pipe.pfcount(_key(campaign_id, 'open_users'))
+        pipe.pfcount(_key(campaign_id, 'click_users'))
+    counts = pipe.execute()
+
+    for index, campaign_id in enumerate(campaign_ids):
+        # Absolute values, so a repeated flush is harmless
+        EmailCampaign.objects.filter(id=campaign_id).update(
+            open_count=counts[2 * index],
+            click_count=counts[2 * index + 1],
+        )
+    return len(campaign_ids)
@@ -5,7 +5,9 @@ from rest_framework.response import Response
 from .views import (
     NotificationViewSet,
     PushTokenViewSet,
-    NotificationPreferenceViewSet
+    NotificationPreferenceViewSet,
+    track_email_open,
+    track_email_click
 )
 
 @api_view(['GET'])
@@ -31,4 +33,6 @@ router.register(r'preferences', NotificationPreferenceViewSet, basename='notific
 urlpatterns = [
     path('', notifications_status, name='notifications_status'),
     path('api/', include(router.urls)),
+    path('track/open/<str:token>/', track_email_open, name='email_track_open'),
+    path('track/click/<str:token>/', track_email_click, name='email_track_click'),
 ]
@@ -3,7 +3,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.pagination import PageNumberPagination
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect
 from django.utils import timezone
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+from . import analytics, counters, preferences, tracking
 from .models import Notification, PushToken, NotificationPreference
 from .serializers import (
     NotificationSerializer,
@@ -31,18 +35,28 @@ class NotificationViewSet(viewsets.ModelViewSet):
             return NotificationSerializer
         return NotificationSerializer
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        if not instance.is_read:
+            counters.decrement(instance.recipient_id)
+
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
-        """Get count of unread notifications"""
-        count = self.get_queryset().filter(is_read=False).count()
-        return Response({'unread_count': count})
+        """Get count of unread notifications (Redis counter)"""
+        return Response({'unread_count': counters.get_unread(request.user.id)})
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark notification as read"""
         try:
             notification = self.get_queryset().get(pk=pk)
-            notification.mark_as_read()
+            # Conditional UPDATE, so concurrent requests decrement once
+            if not notification.is_read and self.get_queryset().filter(pk=pk, is_read=False).update(
+                is_read=True,
+                read_at=timezone.now()
+            ):
+                counters.decrement(request.user.id)
+                analytics.record_read()
             return Response({'message': 'Notification marked as read'})
         except Notification.DoesNotExist:
             return Response(
@@ -53,16 +67,20 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         """Mark all notifications as read"""
-        self.get_queryset().filter(is_read=False).update(
+        updated = self.get_queryset().filter(is_read=False).update(
             is_read=True,
             read_at=timezone.now()
         )
+        counters.decrement(request.user.id, updated)
+        analytics.record_read(updated)
         return Response({'message': 'All notifications marked as read'})
 
     @action(detail=False, methods=['delete'])
     def clear_all(self, request):
         """Delete all notifications"""
+        unread = self.get_queryset().filter(is_read=False).delete()[1].get(Notification._meta.label, 0)
         self.get_queryset().delete()
+        counters.decrement(request.user.id, unread)
         return Response({'message': 'All notifications cleared'})
 
 
@@ -145,6 +163,18 @@ class NotificationPreferenceViewSet(viewsets.ModelViewSet):
         )
         return obj
 
+    # Delivery reads cached snapshots, refresh them on every write
+    def perform_create(self, serializer):
+        preferences.store_snapshot(serializer.save())
+
+    def perform_update(self, serializer):
+        preferences.store_snapshot(serializer.save())
+
+    def perform_destroy(self, instance):
+        user_id = instance.user_id
+        instance.delete()
+        preferences.invalidate(user_id)
+
     @action(detail=False, methods=['post'])
     def update_preferences(self, request):
         """Update notification preferences"""
@@ -155,7 +185,7 @@ class NotificationPreferenceViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(preference, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            self.perform_update(serializer)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -178,6 +208,37 @@ class NotificationPreferenceViewSet(viewsets.ModelViewSet):
             preference.quiet_hours_end = quiet_hours_end
 
         preference.save()
+        preferences.store_snapshot(preference)
 
         serializer = self.get_serializer(preference)
         return Response(serializer.data)
+
+
+# Transparent 1x1 GIF served by the open pixel
+TRACKING_PIXEL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+@never_cache
+@require_GET
+def track_email_open(request, token):
+    """Email campaign open pixel, always answers with the pixel"""
+    value = tracking.read_token(token)
+    if value:
+        campaign_id, user_id, _ = value
+        tracking.record(campaign_id, user_id, 'open')
+    return HttpResponse(TRACKING_PIXEL, content_type='image/gif')
+
+
+@never_cache
+@require_GET
+def track_email_click(request, token):
+    """Email campaign link redirect, the target comes from the signed token"""
+    value = tracking.read_token(token)
+    if not value or not value[2]:
+        return HttpResponseNotFound()
+    campaign_id, user_id, url = value
+    tracking.record(campaign_id, user_id, 'click')
+    return HttpResponseRedirect(url)
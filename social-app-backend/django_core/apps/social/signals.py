@@ -3,7 +3,7 @@ from django.dispatch import receiver
 from django.db import models
 from .models import Like, Comment, Follow
 from apps.content.models import Post
-from apps.gamification.tasks import award_points
+from apps.gamification import ledger
 
 @receiver(post_save, sender=Like)
 def handle_like_created(sender, instance, created, **kwargs):
@@ -14,7 +14,7 @@ def handle_like_created(sender, instance, created, **kwargs):
             likes_count=models.F('likes_count') + 1
         )
         # Award points to post owner
-        award_points.delay(
+        ledger.award(
             user_id=str(instance.post.user.id),
             action_type='get_like',
             points=1
@@ -37,7 +37,7 @@ def handle_comment_created(sender, instance, created, **kwargs):
         )
         
         # Award points to post owner for receiving comment
-        award_points.delay(
+        ledger.award(
             user_id=str(instance.post.user.id),
             action_type='get_comment',
             points=5
@@ -46,14 +46,14 @@ def handle_comment_created(sender, instance, created, **kwargs):
         # Award points to commenter for making comment/reply
         if instance.parent:
             # It's a reply
-            award_points.delay(
+            ledger.award(
                 user_id=str(instance.user.id),
                 action_type='reply_comment',
                 points=2
             )
         else:
             # It's a top-level comment
-            award_points.delay(
+            ledger.award(
                 user_id=str(instance.user.id),
                 action_type='comment_post',
                 points=2
@@ -74,7 +74,7 @@ def handle_follow_created(sender, instance, created, **kwargs):
         )
         
         # Award points to follower for following someone
-        award_points.delay(
+        ledger.award(
             user_id=str(instance.follower.id),
             action_type='follow_user',
             points=10
@@ -6,6 +6,7 @@ from django.contrib.contenttypes.models import ContentType
 from .models import Follow, Like, Comment, Report
 from .serializers import FollowSerializer, LikeSerializer, CommentSerializer
 from apps.users.models import CustomUser
+from apps.notifications.services import NotificationService
 
 class FollowViewSet(viewsets.ModelViewSet):
     queryset = Follow.objects.all()
@@ -46,6 +47,8 @@ class FollowViewSet(viewsets.ModelViewSet):
             except CustomUser.DoesNotExist:
                 pass
 
+            NotificationService.notify_new_follower(str(request.user.id), following_id)
+
             return Response({'message': 'Followed successfully'})
         return Response({'message': 'Already following'})
 
@@ -93,6 +96,8 @@ class LikeViewSet(viewsets.ViewSet):
                     object_id=post.id,
                     defaults={'content_object': post}
                 )
+                if created:
+                    NotificationService.notify_new_like(str(request.user.id), str(post.user_id), str(post.id))
             elif comment_id:
                 # Like a comment
                 from .models import Comment
@@ -138,6 +138,10 @@ class UserViewSet(viewsets.ModelViewSet):
             # Register device token if provided
             self._register_device_token(user, request.data)
 
+            # One login activity per login, daily streaks are counted from these
+            from apps.activities.models import Activity
+            Activity.objects.create(user=user, activity_type='login')
+
             refresh = RefreshToken.for_user(user)
             return Response({
                 'access': str(refresh.access_token),
@@ -1,5 +1,6 @@
 from pathlib import Path
 from decouple import config
+from corsheaders.defaults import default_headers
 import os
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -106,11 +107,52 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Push notifications (FCM). Point FCM_URL at scripts/fake_fcm.py for local testing.
+FCM_SERVER_KEY = config('FCM_SERVER_KEY', default='')
+FCM_URL = config('FCM_URL', default='https://fcm.googleapis.com/fcm/send')
+FCM_BATCH_SIZE = config('FCM_BATCH_SIZE', default=500, cast=int)
+FCM_MAX_CONNECTIONS = config('FCM_MAX_CONNECTIONS', default=4, cast=int)
+FCM_CONCURRENCY = config('FCM_CONCURRENCY', default=8, cast=int)
+# Users per query batch / Celery task for bulk notification sends
+NOTIFICATION_BULK_CHUNK_SIZE = config('NOTIFICATION_BULK_CHUNK_SIZE', default=1000, cast=int)
+# Seconds a cached notification preference snapshot lives (refreshed on every update)
+NOTIFICATION_PREFERENCE_CACHE_TTL = config('NOTIFICATION_PREFERENCE_CACHE_TTL', default=3600, cast=int)
+# Seconds like/comment/follow events are buffered before one collapsed notification is sent
+NOTIFICATION_AGGREGATION_WINDOW = config('NOTIFICATION_AGGREGATION_WINDOW', default=30, cast=int)
+# Seconds an idle unread counter stays in Redis before it is recounted
+NOTIFICATION_UNREAD_COUNTER_TTL = config('NOTIFICATION_UNREAD_COUNTER_TTL', default=604800, cast=int)
+# Retention: read notifications are deleted after NOTIFICATION_RETENTION_DAYS in chunks,
+# monthly partitions (manage.py partition_notifications) are dropped after the retention months
+NOTIFICATION_RETENTION_DAYS = config('NOTIFICATION_RETENTION_DAYS', default=30, cast=int)
+NOTIFICATION_PARTITION_RETENTION_MONTHS = config('NOTIFICATION_PARTITION_RETENTION_MONTHS', default=6, cast=int)
+NOTIFICATION_DELETE_CHUNK_SIZE = config('NOTIFICATION_DELETE_CHUNK_SIZE', default=5000, cast=int)
+NOTIFICATION_DELETE_MAX_SECONDS = config('NOTIFICATION_DELETE_MAX_SECONDS', default=900, cast=int)
+# Seconds between drains of the scheduled/quiet-hours delivery queue
+NOTIFICATION_SCHEDULER_TICK = config('NOTIFICATION_SCHEDULER_TICK', default=10, cast=int)
+# Email campaigns: recipients rendered/sent per batch, messages per second (0 = unthrottled)
+EMAIL_CAMPAIGN_BATCH_SIZE = config('EMAIL_CAMPAIGN_BATCH_SIZE', default=200, cast=int)
+EMAIL_CAMPAIGN_RATE_LIMIT = config('EMAIL_CAMPAIGN_RATE_LIMIT', default=50, cast=float)
+# Audience segments: seconds between recomputes, days of activity that make a user active
+SEGMENT_REFRESH_INTERVAL = config('SEGMENT_REFRESH_INTERVAL', default=900, cast=int)
+SEGMENT_ACTIVE_DAYS = config('SEGMENT_ACTIVE_DAYS', default=30, cast=int)
+# Public base URL of this API, used for email open pixels and click redirects
+SITE_URL = config('SITE_URL', default='http://localhost:8000')
+# Gamification: buffered points awards applied per batch, seconds between flushes
+GAMIFICATION_AWARD_BATCH_SIZE = config('GAMIFICATION_AWARD_BATCH_SIZE', default=1000, cast=int)
+GAMIFICATION_AWARD_FLUSH_INTERVAL = config('GAMIFICATION_AWARD_FLUSH_INTERVAL', default=5, cast=int)
+# Parallel user id ranges of the nightly login streak job
+GAMIFICATION_STREAK_CHUNKS = config('GAMIFICATION_STREAK_CHUNKS', default=16, cast=int)
+# Seconds a worker trusts its cached GamificationConfig before checking the version key
+GAMIFICATION_CONFIG_CHECK_INTERVAL = config('GAMIFICATION_CONFIG_CHECK_INTERVAL', default=30, cast=int)
+
+# Redis (cache, plus counters/buffers through core.redis_client)
+REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/1')
+
 # Cache
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/1'),
+        'LOCATION': REDIS_URL,
     }
 }
 
@@ -122,6 +164,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Encrypted {'payload': ...} envelope is produced/consumed here instead
+    # of re-parsing every body in EncryptionMiddleware
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.EncryptedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.EncryptedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
@@ -139,6 +192,9 @@ SIMPLE_JWT = {
 
 # CORS
 CORS_ALLOW_ALL_ORIGINS = DEBUG
+# Compressed payload envelope negotiation (see core/envelope.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'x-payload-encoding')
+CORS_EXPOSE_HEADERS = ['X-Payload-Encoding']
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:3001",
@@ -0,0 +1,83 @@
+import base64
+import os
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+
+# AES-256 Key (must be 32 bytes)
+# Using the UTF-8 bytes of the string provided
+KEY_STRING = 'd01851e405106173a11030e463584852'
+KEY = KEY_STRING.encode('utf-8')
+
+
+def encrypt_raw(data):
+    """
+    Encrypt str/bytes with AES-256-CBC and return IV + ciphertext as raw bytes
+    (binary websocket frames, no base64)
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    iv = os.urandom(16)
+    cipher = Cipher(algorithms.AES(KEY), modes.CBC(iv), backend=default_backend())
+    encryptor = cipher.encryptor()
+
+    padder = padding.PKCS7(128).padder()
+    padded_data = padder.update(data) + padder.finalize()
+
+    return iv + encryptor.update(padded_data) + encryptor.finalize()
+
+
+def encrypt(data):
+    """
+    Encrypt str/bytes with AES-256-CBC and return 'IV:Ciphertext' in base64
+    """
+    encrypted = encrypt_raw(data)
+
+    # Return IV:Ciphertext
+    return base64.b64encode(encrypted[:16]).decode('utf-8') + ':' + base64.b64encode(encrypted[16:]).decode('utf-8')
+
+
+def decrypt(data):
+    """
+    Decrypt an 'IV:Ciphertext' string, returns None if it is not a valid payload
+    """
+    plaintext = decrypt_bytes(data)
+    if plaintext is None:
+        return None
+    try:
+        return plaintext.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def decrypt_bytes(data):
+    """
+    Decrypt an 'IV:Ciphertext' string to raw bytes (used for compressed payloads)
+    """
+    try:
+        parts = data.split(':')
+        if len(parts) != 2:
+            return None
+
+        return decrypt_raw(base64.b64decode(parts[0]) + base64.b64decode(parts[1]))
+    except Exception:
+        return None
+
+
+def decrypt_raw(data):
+    """
+    Decrypt IV + ciphertext raw bytes, returns None if it is not a valid payload
+    """
+    try:
+        iv, ciphertext = data[:16], data[16:]
+
+        cipher = Cipher(algorithms.AES(KEY), modes.CBC(iv), backend=default_backend())
+        decryptor = cipher.decryptor()
+
+        padded_data = decryptor.update(ciphertext) + decryptor.finalize()
+
+        unpadder = padding.PKCS7(128).unpadder()
+        return unpadder.update(padded_data) + unpadder.finalize()
+    except Exception:
+        return None
@@ -0,0 +1,158 @@
+"""
+Encrypted payload envelope.
+
+Version 1 (legacy):  {"payload": "<iv>:<ciphertext>"}
+Version 2:           {"v": 2, "enc": "zstd|gzip|identity", "payload": "<iv>:<ciphertext>"}
+
+Ciphertext is incompressible, so version 2 compresses the JSON body before
+encrypting it. Clients opt in by sending the X-Payload-Encoding header with
+the encodings they can decode (e.g. "zstd, gzip"); clients that do not send
+it keep receiving version 1.
+"""
+import gzip
+import io
+import json
+import zlib
+from django.conf import settings
+from core import encryption
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+PAYLOAD_ENCODING_HEADER = 'X-Payload-Encoding'
+PAYLOAD_ENCODING_META_KEY = 'HTTP_X_PAYLOAD_ENCODING'
+ENVELOPE_VERSION = 2
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+# Upper bound for a decompressed request body, a few kilobytes of zstd or
+# gzip can otherwise expand into gigabytes
+MAX_DECOMPRESSED_SIZE = getattr(settings, 'PAYLOAD_MAX_DECOMPRESSED_SIZE', 10 * 1024 * 1024)
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class PayloadTooLarge(ValueError):
+    """The decompressed payload exceeds MAX_DECOMPRESSED_SIZE"""
+
+
+def supported_encodings():
+    """Encodings this server can produce, in order of preference"""
+    if zstandard is not None:
+        return ['zstd', 'gzip']
+    return ['gzip']
+
+
+def negotiate_encoding(header_value):
+    """
+    Pick the best encoding advertised by the client, None means legacy envelope
+    """
+    if not header_value:
+        return None
+
+    offered = {item.split(';')[0].strip().lower() for item in header_value.split(',')}
+    for encoding in supported_encodings():
+        if encoding in offered:
+            return encoding
+    if 'identity' in offered:
+        return 'identity'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+
+def _read_bounded(reader, limit):
+    """Read a decompressing stream, giving up as soon as it passes limit"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = reader.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise PayloadTooLarge(f'Decompressed payload exceeds {limit} bytes')
+        chunks.append(chunk)
+
+
+def decompress(data, encoding):
+    """
+    Decompress a payload, raises PayloadTooLarge past MAX_DECOMPRESSED_SIZE.
+    The declared frame size is not trusted, output is streamed and counted.
+    """
+    limit = MAX_DECOMPRESSED_SIZE
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd payloads are not supported on this server')
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return _read_bounded(reader, limit)
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        plaintext = decompressor.decompress(data, limit + 1)
+        if len(plaintext) > limit:
+            raise PayloadTooLarge(f'Decompressed payload exceeds {limit} bytes')
+        if not decompressor.eof:
+            raise ValueError('Truncated gzip payload')
+        return plaintext
+    if encoding == 'identity':
+        return data
+    raise ValueError(f'Unknown payload encoding: {encoding}')
+
+
+def build_envelope(content, encoding=None):
+    """
+    Wrap rendered JSON bytes into an encrypted envelope (as bytes)
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    if encoding is None:
+        return json.dumps({'payload': encryption.encrypt(content)}).encode('utf-8')
+
+    if len(content) < MIN_COMPRESS_SIZE:
+        encoding = 'identity'
+
+    return json.dumps({
+        'v': ENVELOPE_VERSION,
+        'enc': encoding,
+        'payload': encryption.encrypt(compress(content, encoding)),
+    }).encode('utf-8')
+
+
+def is_envelope(data):
+    """Check if parsed JSON is already an encrypted envelope"""
+    if not isinstance(data, dict) or 'payload' not in data:
+        return False
+    return set(data) <= {'v', 'enc', 'payload'}
+
+
+def open_envelope(data):
+    """
+    Decrypt (and decompress) a parsed envelope, returns plaintext bytes or None.
+    PayloadTooLarge is raised rather than swallowed so callers can reject it.
+    """
+    plaintext = encryption.decrypt_bytes(data['payload'])
+    if plaintext is None:
+        return None
+
+    encoding = data.get('enc')
+    if not encoding:
+        return plaintext
+
+    try:
+        return decompress(plaintext, encoding)
+    except PayloadTooLarge:
+        raise
+    except Exception:
+        return None
@@ -0,0 +1,38 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils import json
+from core import envelope
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Decompressed request payload is too large.'
+    default_code = 'payload_too_large'
+
+
+class EncryptedJSONParser(JSONParser):
+    """
+    JSON parser that unwraps the encrypted {'payload': ...} request envelope
+    (legacy or compressed version 2). Plain JSON bodies are passed through
+    unchanged.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = super().parse(stream, media_type, parser_context)
+
+        if not (isinstance(data, dict) and 'payload' in data):
+            return data
+
+        try:
+            decrypted = envelope.open_envelope(data)
+        except envelope.PayloadTooLarge:
+            raise PayloadTooLarge()
+        if not decrypted:
+            return data
+
+        try:
+            parse_constant = json.strict_constant if self.strict else None
+            return json.loads(decrypted.decode('utf-8'), parse_constant=parse_constant)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,18 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Shared redis-py client on REDIS_URL for data structures the cache API
+    doesn't cover (sets, sorted sets, hashes, atomic counters)
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            getattr(settings, 'REDIS_URL', 'redis://127.0.0.1:6379/1'),
+            decode_responses=True
+        )
+    return _client
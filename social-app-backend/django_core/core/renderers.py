@@ -0,0 +1,53 @@
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from core import envelope
+
+
+class EncryptedJSONRenderer(JSONRenderer):
+    """
+    JSON renderer that emits the encrypted {'payload': ...} envelope directly,
+    so API responses are serialized once instead of being re-parsed and
+    re-dumped by EncryptionMiddleware.
+
+    Clients that send X-Payload-Encoding get the compressed version 2
+    envelope (see core.envelope), everyone else gets the legacy format.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        content = super().render(data, accepted_media_type, renderer_context)
+
+        if not content or not self.should_encrypt(data, renderer_context):
+            return content
+
+        request = renderer_context['request']
+        encoding = envelope.negotiate_encoding(request.META.get(envelope.PAYLOAD_ENCODING_META_KEY))
+
+        response = renderer_context.get('response')
+        if response is not None:
+            # Tell EncryptionMiddleware this body is already an envelope
+            response.payload_encrypted = True
+            patch_vary_headers(response, [envelope.PAYLOAD_ENCODING_HEADER])
+            if encoding:
+                response[envelope.PAYLOAD_ENCODING_HEADER] = encoding
+
+        return envelope.build_envelope(content, encoding)
+
+    def should_encrypt(self, data, renderer_context):
+        request = renderer_context.get('request')
+        if request is None or not request.path.startswith('/api/'):
+            return False
+
+        # Browsable API embeds this renderer's output in HTML, keep it readable
+        response = renderer_context.get('response')
+        if isinstance(getattr(response, 'accepted_renderer', None), BrowsableAPIRenderer):
+            return False
+
+        # Already an envelope (avoid double encryption), and keep
+        # EncryptionMiddleware from wrapping it again
+        if envelope.is_envelope(data):
+            if response is not None:
+                response.payload_encrypted = True
+            return False
+
+        return True
@@ -0,0 +1,109 @@
+import json
+from unittest import mock
+from django.test import SimpleTestCase
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from core import encryption, envelope
+from core.encryption_middleware import EncryptionMiddleware
+
+
+class EchoView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        return Response({'received': request.data})
+
+
+class PlainView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response({'ok': True})
+
+
+class EnvelopeView(PlainView):
+    """Hands out an envelope it encrypted itself"""
+
+    def get(self, request):
+        return Response({'payload': encryption.encrypt(b'{"ok": true}')})
+
+
+class EncryptedJSONParserTest(SimpleTestCase):
+    """Request envelopes going through the default parser"""
+
+    body = {'text': 'hello ' * 200, 'count': 3}
+
+    def post(self, payload):
+        request = APIRequestFactory().post(
+            '/echo/', json.dumps(payload), content_type='application/json'
+        )
+        return EchoView.as_view()(request)
+
+    def v2(self, encoding, content):
+        return {
+            'v': 2,
+            'enc': encoding,
+            'payload': encryption.encrypt(envelope.compress(content, encoding)),
+        }
+
+    def test_plain_json_passes_through(self):
+        response = self.post({'text': 'hi'})
+        self.assertEqual(response.data, {'received': {'text': 'hi'}})
+
+    def test_v1_envelope(self):
+        response = self.post({'payload': encryption.encrypt(json.dumps(self.body))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received'], self.body)
+
+    def test_v2_envelope(self):
+        content = json.dumps(self.body).encode('utf-8')
+        for encoding in envelope.supported_encodings() + ['identity']:
+            with self.subTest(encoding=encoding):
+                response = self.post(self.v2(encoding, content))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['received'], self.body)
+
+    def test_oversized_body_is_rejected(self):
+        content = json.dumps({'text': 'a' * 100_000}).encode('utf-8')
+        with mock.patch.object(envelope, 'MAX_DECOMPRESSED_SIZE', 10_000):
+            for encoding in envelope.supported_encodings():
+                with self.subTest(encoding=encoding):
+                    response = self.post(self.v2(encoding, content))
+                    self.assertEqual(response.status_code, 413)
+
+    def test_declared_frame_size_is_not_trusted(self):
+        # zstd frames carry their content size, the cap must still apply
+        compressed = envelope.compress(b'a' * 100_000, 'zstd')
+        with mock.patch.object(envelope, 'MAX_DECOMPRESSED_SIZE', 10_000):
+            with self.assertRaises(envelope.PayloadTooLarge):
+                envelope.decompress(compressed, 'zstd')
+
+    def test_corrupt_payload_is_left_alone(self):
+        payload = {'v': 2, 'enc': 'gzip', 'payload': encryption.encrypt(b'not gzip')}
+        response = self.post(payload)
+        self.assertEqual(response.data['received'], payload)
+
+
+class EncryptedJSONRendererTest(SimpleTestCase):
+    """Responses rendered by the default renderer, then EncryptionMiddleware"""
+
+    def get(self, view, **headers):
+        request = APIRequestFactory().get('/api/test/', **headers)
+        response = view.as_view()(request).render()
+        return EncryptionMiddleware(lambda request: response).process_response(request, response)
+
+    def test_response_is_encrypted_once(self):
+        response = self.get(PlainView)
+        body = json.loads(response.content)
+        self.assertEqual(set(body), {'payload'})
+        self.assertEqual(json.loads(encryption.decrypt(body['payload'])), {'ok': True})
+
+    def test_envelope_is_passed_through(self):
+        response = self.get(EnvelopeView)
+        self.assertTrue(response.payload_encrypted)
+        body = json.loads(response.content)
+        self.assertEqual(encryption.decrypt(body['payload']), '{"ok": true}')
@@ -1,12 +1,13 @@
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import JSONResponse, Response
 import json
 import base64
 import os
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
+from middleware import envelope
 
 class EncryptionMiddleware(BaseHTTPMiddleware):
     # AES-256 Key (must be 32 bytes)
@@ -28,18 +29,23 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
                     try:
                         data = json.loads(body_str)
                         if isinstance(data, dict) and 'payload' in data:
-                            decrypted_data = self.decrypt(data['payload'])
+                            decrypted_data = envelope.open_envelope(data, self.decrypt_bytes)
                             if decrypted_data:
                                 # Replace the body in the request
                                 # This is valid for Starlette/FastAPI requests
                                 # We define a new receive function that returns the decrypted body
                                 async def new_receive():
-                                    return {"type": "http.request", "body": decrypted_data.encode('utf-8')}
+                                    return {"type": "http.request", "body": decrypted_data}
                                 
                                 # Set request._receive to override the body reading mechanism
                                 request._receive = new_receive
                     except (json.JSONDecodeError, UnicodeDecodeError):
                         pass
+            except envelope.PayloadTooLarge:
+                return JSONResponse(
+                    {"detail": "Decompressed request payload is too large."},
+                    status_code=413
+                )
             except Exception as e:
                 # print(f"Request decryption error: {e}")
                 pass
@@ -58,12 +64,11 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
                     body_chunks.append(chunk)
                 
                 body_bytes = b"".join(body_chunks)
-                body_str = body_bytes.decode('utf-8')
 
-                # Check if already encrypted format (avoid double encrypt)
+                # Check if already encrypted format, v1 or v2 (avoid double encrypt)
                 try:
-                    data = json.loads(body_str)
-                    if isinstance(data, dict) and 'payload' in data and len(data) == 1:
+                    data = json.loads(body_bytes)
+                    if envelope.is_envelope(data):
                         # Already encrypted
                          return Response(
                             content=body_bytes,
@@ -74,13 +79,20 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
                 except:
                     pass
 
-                # Encrypt
-                encrypted = self.encrypt(body_str)
-                new_data = json.dumps({"payload": encrypted})
-                
+                # Encrypt (compressing first if the client negotiated it)
+                encoding = envelope.negotiate_encoding(
+                    request.headers.get(envelope.PAYLOAD_ENCODING_HEADER)
+                )
+                new_data = envelope.build_envelope(body_bytes, self.encrypt, encoding)
+
                 # Update headers
                 headers = dict(response.headers)
                 headers['content-length'] = str(len(new_data))
+                headers['vary'] = ', '.join(
+                    filter(None, [headers.get('vary'), envelope.PAYLOAD_ENCODING_HEADER])
+                )
+                if encoding:
+                    headers[envelope.PAYLOAD_ENCODING_HEADER.lower()] = encoding
                 
                 return Response(
                     content=new_data,
@@ -106,7 +118,9 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
         encryptor = cipher.encryptor()
         
         padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(data.encode('utf-8')) + padder.finalize()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        padded_data = padder.update(data) + padder.finalize()
         
         encrypted = encryptor.update(padded_data) + encryptor.finalize()
         
@@ -114,6 +128,15 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
         return base64.b64encode(iv).decode('utf-8') + ':' + base64.b64encode(encrypted).decode('utf-8')
 
     def decrypt(self, data):
+        plaintext = self.decrypt_bytes(data)
+        if plaintext is None:
+            return None
+        try:
+            return plaintext.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+
+    def decrypt_bytes(self, data):
         try:
             parts = data.split(':')
             if len(parts) != 2:
@@ -128,8 +151,6 @@ class EncryptionMiddleware(BaseHTTPMiddleware):
             padded_data = decryptor.update(ciphertext) + decryptor.finalize()
             
             unpadder = padding.PKCS7(128).unpadder()
-            data = unpadder.update(padded_data) + unpadder.finalize()
-            
-            return data.decode('utf-8')
+            return unpadder.update(padded_data) + unpadder.finalize()
         except Exception as e:
             return None
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Benchmark the encrypted payload envelope: legacy (v1) vs compress-then-encrypt (v2)
+
+Feed pages are taken from the database (PostSerializer, same shape as
+/api/v1/posts/feed/) when posts exist, otherwise synthetic posts with the
+same fields are generated.
+
+Usage:
+    python scripts/benchmark_envelope.py [--pages 20] [--page-size 50] [--iterations 200]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+import random
+from datetime import datetime, timedelta
+
+# Add the django_core directory to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'django_core'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+from core import envelope
+
+
+def load_feed_pages(pages, page_size):
+    """Serialize real posts from the database, returns [] if unavailable"""
+    try:
+        import django
+        django.setup()
+        from rest_framework.renderers import JSONRenderer
+        from apps.content.models import Post
+        from apps.content.serializers import PostSerializer
+
+        posts = list(
+            Post.objects.select_related('user__profile').order_by('-created_at')[:pages * page_size]
+        )
+    except Exception as e:
+        print(f"Database feed unavailable ({e}), using synthetic posts")
+        return []
+
+    renderer = JSONRenderer()
+    return [
+        renderer.render(PostSerializer(posts[i:i + page_size], many=True).data)
+        for i in range(0, len(posts), page_size)
+    ]
+
+
+def synthetic_feed_pages(pages, page_size):
+    """Generate feed pages shaped like PostSerializer output"""
+    words = ['sunset', 'travel', 'coffee', 'friends', 'music', 'weekend', 'vibes',
+             'food', 'city', 'beach', 'art', 'fitness', 'love', 'photo', 'day']
+    now = datetime.utcnow()
+    result = []
+    for _ in range(pages):
+        page = []
+        for _ in range(page_size):
+            user_id = str(uuid.uuid4())
+            username = f"{random.choice(words)}_{random.randint(1, 99999)}"
+            caption = ' '.join(random.choices(words, k=random.randint(5, 25)))
+            hashtags = random.sample(words, k=random.randint(0, 5))
+            page.append({
+                'id': str(uuid.uuid4()),
+                'user': {
+                    'id': user_id,
+                    'username': username,
+                    'email': f"{username}@example.com",
+                    'is_verified': random.random() < 0.1,
+                    'profile': {
+                        'bio': ' '.join(random.choices(words, k=12)),
+                        'avatar': f"https://cdn.example.com/avatars/{user_id}.jpg",
+                        'followers_count': random.randint(0, 100000),
+                        'following_count': random.randint(0, 2000),
+                        'posts_count': random.randint(0, 500),
+                    },
+                },
+                'post_type': random.choice(['image', 'video', 'reel']),
+                'caption': caption + ' ' + ' '.join(f"#{tag}" for tag in hashtags),
+                'media_url': f"https://cdn.example.com/media/{uuid.uuid4()}.mp4",
+                'thumbnail_url': f"https://cdn.example.com/thumbs/{uuid.uuid4()}.jpg",
+                'duration': random.randint(0, 60),
+                'likes_count': random.randint(0, 50000),
+                'comments_count': random.randint(0, 3000),
+                'shares_count': random.randint(0, 1000),
+                'views_count': random.randint(0, 1000000),
+                'hashtags': hashtags,
+                'mentions': [],
+                'location': random.choice(['', 'Mumbai', 'Delhi', 'Pune']),
+                'music_id': None,
+                'is_liked': random.random() < 0.3,
+                'created_at': (now - timedelta(minutes=random.randint(0, 10000))).isoformat() + 'Z',
+            })
+        result.append(json.dumps(page).encode('utf-8'))
+    return result
+
+
+def bench(payloads, encoding, iterations):
+    """Return (avg envelope bytes, encode us/payload, decode us/payload)"""
+    envelopes = [envelope.build_envelope(p, encoding) for p in payloads]
+    size = sum(len(e) for e in envelopes) / len(envelopes)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for p in payloads:
+            envelope.build_envelope(p, encoding)
+    encode_us = (time.perf_counter() - start) / (iterations * len(payloads)) * 1e6
+
+    parsed = [json.loads(e) for e in envelopes]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for data in parsed:
+            envelope.open_envelope(data)
+    decode_us = (time.perf_counter() - start) / (iterations * len(payloads)) * 1e6
+
+    return size, encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--synthetic', action='store_true', help='Skip the database')
+    args = parser.parse_args()
+
+    payloads = [] if args.synthetic else load_feed_pages(args.pages, args.page_size)
+    source = 'database'
+    if not payloads:
+        payloads = synthetic_feed_pages(args.pages, args.page_size)
+        source = 'synthetic'
+
+    raw = sum(len(p) for p in payloads) / len(payloads)
+    nginx_gzip = sum(len(gzip.compress(p)) for p in payloads) / len(payloads)
+    print(f"Feed pages: {len(payloads)} ({source}), avg plaintext JSON {raw:,.0f} B")
+    print(f"Reference: plaintext gzip (what nginx could do unencrypted) {nginx_gzip:,.0f} B")
+    print()
+    print(f"{'envelope':<14}{'bytes':>12}{'vs plain':>10}{'encode us':>12}{'decode us':>12}")
+
+    for label, encoding in [('v1 legacy', None)] + [(f"v2 {e}", e) for e in envelope.supported_encodings()]:
+        size, encode_us, decode_us = bench(payloads, encoding, args.iterations)
+        print(f"{label:<14}{size:>12,.0f}{size / raw:>9.0%}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Benchmark chat socket frames: JSON text vs MessagePack binary, with and
+without permessage-deflate
+
+Bytes and CPU per message are measured on synthetic chat traffic for:
+  standalone  websocket_service/server.py frames (plaintext)
+  channels    ChatConsumer frames (AES encrypted, JSON envelope vs binary)
+
+permessage-deflate is simulated the way websockets applies it: one raw
+deflate stream per connection with context takeover, sync-flushed per
+message, using the server's window size and memLevel.
+
+Usage:
+    python scripts/benchmark_frames.py [--messages 5000] [--iterations 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, 'websocket_service'))
+sys.path.append(os.path.join(BASE_DIR, 'django_core'))
+
+import protocol as ws_protocol
+from apps.chat import protocol as chat_protocol
+
+WORDS = ['hey', 'what', 'are', 'you', 'doing', 'tonight', 'lol', 'see', 'the',
+         'new', 'reel', 'haha', 'okay', 'coming', 'later', 'love', 'this', 'song']
+
+
+def synthetic_text():
+    return ' '.join(random.choices(WORDS, k=random.randint(1, 20)))
+
+
+def standalone_frames(count):
+    """Frames as queued by server.deliver_to_room (messages and typing)"""
+    users = [str(random.randint(1, 100000)) for _ in range(20)]
+    room_id = str(uuid.uuid4())
+    now = time.time()
+    frames = []
+    for i in range(count):
+        if i % 3 == 2:
+            frames.append({'type': 'typing', 'user_id': random.choice(users), 'room_id': room_id, 'typing': True})
+        else:
+            frames.append({
+                'type': 'message',
+                'event_id': f'{int((now + i) * 1000)}-0',
+                'user_id': random.choice(users),
+                'room_id': room_id,
+                'text': synthetic_text(),
+                'timestamp': now + i,
+            })
+    return frames
+
+
+def channels_frames(count):
+    """Frames as sent by ChatConsumer.chat_message / typing_indicator"""
+    users = [(str(uuid.uuid4()), f"{random.choice(WORDS)}_{random.randint(1, 9999)}") for _ in range(20)]
+    now = datetime.utcnow()
+    frames = []
+    for i in range(count):
+        user_id, username = random.choice(users)
+        if i % 3 == 2:
+            frames.append({'type': 'typing', 'user_id': user_id, 'username': username, 'is_typing': True})
+        else:
+            frames.append({
+                'type': 'message',
+                'message': {
+                    'id': str(uuid.uuid4()),
+                    'sender_id': user_id,
+                    'sender_username': username,
+                    'sender_avatar': f"https://cdn.example.com/avatars/{user_id}.jpg",
+                    'content': synthetic_text(),
+                    'media_url': '',
+                    'message_type': 'text',
+                    'reply_to': None,
+                    'created_at': (now + timedelta(seconds=i)).isoformat(),
+                },
+            })
+    return frames
+
+
+def wire_payload(frame):
+    """Bytes a frame puts on the wire, frames are str, bytes or Channels (text, bytes)"""
+    if isinstance(frame, tuple):
+        text_data, bytes_data = frame
+        frame = bytes_data if bytes_data is not None else text_data
+    return frame.encode('utf-8') if isinstance(frame, str) else frame
+
+
+def deflated_sizes(payloads):
+    """Per-message sizes through one permessage-deflate stream"""
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+        -ws_protocol.DEFLATE_WINDOW_BITS, ws_protocol.DEFLATE_MEM_LEVEL
+    )
+    sizes = []
+    for data in payloads:
+        out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        # The 00 00 ff ff tail is stripped on the wire
+        sizes.append(len(out) - 4)
+    return sizes
+
+
+def bench(frames, encode, decode, iterations):
+    """Return (avg bytes, avg deflated bytes, encode us/msg, decode us/msg)"""
+    encoded = [encode(f) for f in frames]
+    payloads = [wire_payload(e) for e in encoded]
+    size = sum(len(p) for p in payloads) / len(payloads)
+    deflated = sum(deflated_sizes(payloads)) / len(payloads)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for f in frames:
+            encode(f)
+    encode_us = (time.perf_counter() - start) / (iterations * len(frames)) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for e in encoded:
+            decode(e)
+    decode_us = (time.perf_counter() - start) / (iterations * len(frames)) * 1e6
+
+    return size, deflated, encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    modes = [
+        ('standalone', 'json', standalone_frames,
+         lambda f: ws_protocol.encode(f, None),
+         ws_protocol.decode),
+        ('standalone', 'msgpack', standalone_frames,
+         lambda f: ws_protocol.encode(f, ws_protocol.MSGPACK_SUBPROTOCOL),
+         ws_protocol.decode),
+        ('channels', 'json', channels_frames,
+         lambda f: chat_protocol.encode(f, None),
+         lambda e: chat_protocol.decode(*e)),
+        ('channels', 'msgpack', channels_frames,
+         lambda f: chat_protocol.encode(f, chat_protocol.MSGPACK_SUBPROTOCOL),
+         lambda e: chat_protocol.decode(*e)),
+    ]
+
+    print(f"Chat frames: {args.messages} per mode (2/3 messages, 1/3 typing)")
+    print(f"permessage-deflate: window {ws_protocol.DEFLATE_WINDOW_BITS} bits, memLevel {ws_protocol.DEFLATE_MEM_LEVEL}")
+    print()
+    print(f"{'target':<12}{'format':<10}{'bytes':>8}{'deflated':>10}{'encode us':>12}{'decode us':>12}")
+
+    for target, label, make_frames, encode, decode in modes:
+        random.seed(0)
+        frames = make_frames(args.messages)
+        size, deflated, encode_us, decode_us = bench(frames, encode, decode, args.iterations)
+        print(f"{target:<12}{label:<10}{size:>8.0f}{deflated:>10.0f}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
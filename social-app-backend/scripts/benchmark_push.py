@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Benchmark push delivery: legacy per-device requests.post vs FCMPushEngine
+
+Runs against scripts/fake_fcm.py (spawned on --port unless --url is given)
+with an added per-request latency standing in for the round trip to FCM.
+Reports tokens per second, HTTP requests and TCP connections for each path
+and the PushToken UPDATE statements each one issues.
+
+Usage:
+    python scripts/benchmark_push.py [--tokens 20000] [--latency-ms 20] [--legacy-sample 500]
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, 'django_core'))
+
+
+def setup_django(url):
+    from django.conf import settings
+    settings.configure(FCM_SERVER_KEY='benchmark', FCM_URL=url)
+    import django
+    django.setup()
+
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f'{base_url}/stats', timeout=5) as response:
+        return json.loads(response.read())
+
+
+def wait_for_server(base_url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return fetch_stats(base_url)
+        except OSError:
+            time.sleep(0.1)
+    return None
+
+
+def make_tokens(count, invalid_ratio):
+    invalid_every = int(1 / invalid_ratio) if invalid_ratio else 0
+    return [
+        f'invalid-{i}' if invalid_every and i % invalid_every == 0 else f'token-{i:08d}-' + 'x' * 140
+        for i in range(count)
+    ]
+
+
+def legacy_send(url, tokens):
+    """The old path: one requests.post (new connection) per device"""
+    import requests
+    delivered = 0
+    for token in tokens:
+        response = requests.post(url, json={
+            'to': token,
+            'notification': {'title': 'Benchmark', 'body': 'Hello', 'sound': 'default', 'badge': '1'},
+            'data': {},
+            'priority': 'high',
+        }, headers={'Authorization': 'key=benchmark'}, timeout=10)
+        if response.status_code == 200 and response.json().get('success') == 1:
+            delivered += 1
+    return delivered
+
+
+def run_path(label, base_url, send):
+    before = fetch_stats(base_url)
+    start = time.perf_counter()
+    delivered, tokens = send()
+    elapsed = time.perf_counter() - start
+    after = fetch_stats(base_url)
+    return {
+        'label': label,
+        'tokens': tokens,
+        'delivered': delivered,
+        'seconds': elapsed,
+        'rate': tokens / elapsed,
+        'requests': after['requests'] - before['requests'],
+        # The /stats fetch itself opens one connection
+        'connections': after['connections'] - before['connections'] - 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=20000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.02)
+    parser.add_argument('--latency-ms', type=float, default=20, help='Fake FCM latency per request')
+    parser.add_argument('--legacy-sample', type=int, default=500, help='Tokens sent on the legacy path')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--url', help='Running fake FCM base URL, e.g. http://127.0.0.1:9090')
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, 'scripts', 'fake_fcm.py'),
+             '--port', str(args.port), '--latency-ms', str(args.latency_ms)],
+            stdout=subprocess.DEVNULL,
+        )
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        if wait_for_server(base_url) is None:
+            sys.exit('Fake FCM server did not come up')
+
+        send_url = f'{base_url}/fcm/send'
+        setup_django(send_url)
+        from apps.notifications import push
+
+        tokens = make_tokens(args.tokens, args.invalid_ratio)
+        sample = tokens[:args.legacy_sample]
+
+        legacy = run_path('legacy requests.post', base_url,
+                          lambda: (legacy_send(send_url, sample), len(sample)))
+
+        engine = push.FCMPushEngine()
+
+        def engine_send():
+            result = engine.send(tokens, 'Benchmark', 'Hello')
+            engine.last_result = result
+            return len(result.succeeded), len(tokens)
+
+        pooled = run_path('FCMPushEngine', base_url, engine_send)
+        result = engine.last_result
+        engine.close()
+    finally:
+        if process is not None:
+            process.terminate()
+
+    invalid = len(result.invalid)
+    print(f"Tokens: {args.tokens} ({invalid} invalid), fake FCM latency {args.latency_ms:g} ms/request")
+    print()
+    print(f"{'path':<22}{'tokens':>8}{'tokens/s':>11}{'requests':>10}{'conns':>7}{'UPDATEs for all tokens':>24}")
+    legacy_updates = len(result.succeeded) + invalid
+    engine_updates = math.ceil(len(result.succeeded) / push.UPDATE_CHUNK_SIZE) + math.ceil(invalid / push.UPDATE_CHUNK_SIZE)
+    for row, updates in ((legacy, legacy_updates), (pooled, engine_updates)):
+        print(f"{row['label']:<22}{row['tokens']:>8}{row['rate']:>11,.0f}{row['requests']:>10}"
+              f"{row['connections']:>7}{updates:>24}")
+    print()
+    print(f"Speed-up: {pooled['rate'] / legacy['rate']:,.0f}x tokens/s")
+
+
+if __name__ == '__main__':
+    main()
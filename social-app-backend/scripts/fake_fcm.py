@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Local fake of the FCM legacy HTTP endpoint (POST /fcm/send) for push tests and benchmarks
+
+Speaks HTTP/2 with prior knowledge (what FCMPushEngine uses against plain
+http URLs) and HTTP/1.1 (what requests.post uses). Accepts both 'to' and
+'registration_ids' payloads and answers per token:
+  tokens starting with 'invalid'  -> NotRegistered
+  tokens starting with 'unavailable' -> Unavailable
+  anything else                   -> message_id
+
+GET /stats returns connection and request counters as JSON.
+
+Usage:
+    python scripts/fake_fcm.py [--port 9090] [--latency-ms 20]
+    FCM_URL=http://127.0.0.1:9090/fcm/send FCM_SERVER_KEY=test ...
+"""
+import argparse
+import asyncio
+import json
+import uuid
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+WINDOW_SIZE = 16 * 1024 * 1024
+
+
+class FakeFCM:
+    def __init__(self, latency):
+        self.latency = latency
+        self.stats = {
+            'connections': 0,
+            'http2_connections': 0,
+            'requests': 0,
+            'tokens': 0,
+        }
+
+    def handle(self, method, path, headers, body):
+        """Return (status, body dict) for a request"""
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats
+
+        if method != 'POST' or path != '/fcm/send':
+            return 404, {'error': 'Not found'}
+
+        if not headers.get('authorization', '').startswith('key='):
+            return 401, {'error': 'Unauthorized'}
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, {'error': 'Invalid JSON'}
+
+        tokens = payload.get('registration_ids') or [payload.get('to')]
+        if len(tokens) > 1000:
+            return 400, {'error': 'Too many registration_ids'}
+
+        self.stats['requests'] += 1
+        self.stats['tokens'] += len(tokens)
+
+        results = []
+        for token in tokens:
+            if token.startswith('invalid'):
+                results.append({'error': 'NotRegistered'})
+            elif token.startswith('unavailable'):
+                results.append({'error': 'Unavailable'})
+            else:
+                results.append({'message_id': f'0:{uuid.uuid4().hex}'})
+
+        success = sum(1 for r in results if 'message_id' in r)
+        return 200, {
+            'multicast_id': uuid.uuid4().int >> 64,
+            'success': success,
+            'failure': len(results) - success,
+            'canonical_ids': 0,
+            'results': results,
+        }
+
+    async def respond(self, method, path, headers, body):
+        if self.latency and path != '/stats':
+            await asyncio.sleep(self.latency)
+        status, data = self.handle(method, path, headers, body)
+        return status, json.dumps(data).encode('utf-8')
+
+    async def serve_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            start = await reader.readexactly(len(H2_PREFACE))
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+
+        try:
+            if start == H2_PREFACE:
+                self.stats['http2_connections'] += 1
+                await self.serve_http2(start, reader, writer)
+            else:
+                await self.serve_http1(start, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_http1(self, buffered, reader, writer):
+        while True:
+            # The first bytes were already read while sniffing for the HTTP/2 preface
+            head = buffered + await reader.readuntil(b'\r\n\r\n')
+            buffered = b''
+            lines = head.decode('latin-1').split('\r\n')
+            method, path, _ = lines[0].split(' ', 2)
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, data = await self.respond(method, path, headers, body)
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(
+                f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(data)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + data
+            )
+            await writer.drain()
+            if not keep_alive:
+                return
+
+    async def serve_http2(self, preface, reader, writer):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        # Large windows like Google's frontends, so 500-token request bodies
+        # never wait on flow control
+        conn.local_settings = h2.settings.Settings(
+            client=False, initial_values={h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: WINDOW_SIZE}
+        )
+        conn.initiate_connection()
+        conn.increment_flow_control_window(WINDOW_SIZE)
+        writer.write(conn.data_to_send())
+
+        requests = {}  # stream_id -> (headers, body)
+        window_open = asyncio.Event()
+
+        async def answer(stream_id, headers, body):
+            status, data = await self.respond(headers[':method'], headers[':path'], headers, body)
+            try:
+                conn.send_headers(stream_id, [
+                    (':status', str(status)),
+                    ('content-type', 'application/json'),
+                    ('content-length', str(len(data))),
+                ])
+                # Respect the client's flow control window
+                while data:
+                    chunk = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size, len(data))
+                    if chunk <= 0:
+                        writer.write(conn.data_to_send())
+                        window_open.clear()
+                        await window_open.wait()
+                        continue
+                    conn.send_data(stream_id, data[:chunk])
+                    data = data[chunk:]
+                conn.end_stream(stream_id)
+            except h2.exceptions.StreamClosedError:
+                pass
+            writer.write(conn.data_to_send())
+
+        events = conn.receive_data(preface)
+        while True:
+            for event in events:
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = {k.decode(): v.decode() for k, v in event.headers}
+                    requests[event.stream_id] = (headers, bytearray())
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1].extend(event.data)
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    asyncio.create_task(answer(event.stream_id, headers, bytes(body)))
+                elif isinstance(event, h2.events.WindowUpdated):
+                    window_open.set()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+
+            # No drain() here: waiting on a client that is itself blocked
+            # writing a request body would stop us reading and deadlock
+            writer.write(conn.data_to_send())
+
+            data = await reader.read(65536)
+            if not data:
+                return
+            events = conn.receive_data(data)
+
+
+async def serve(port, latency):
+    fake = FakeFCM(latency)
+    server = await asyncio.start_server(fake.serve_connection, '127.0.0.1', port)
+    print(f"Fake FCM listening on http://127.0.0.1:{port}/fcm/send", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added latency per request')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms / 1000))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+from collections import deque
+from metrics import metrics
+from protocol import encode
+
+# Outbound frames buffered per connection before the overflow policy kicks in
+SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', 256))
+
+# What to do when a client can't keep up:
+#   drop_typing_then_disconnect - drop typing frames, then disconnect (default)
+#   drop_typing_then_oldest     - drop typing frames, then the oldest messages
+#   disconnect                  - disconnect as soon as the queue is full
+OVERFLOW_POLICY = os.getenv('WS_OVERFLOW_POLICY', 'drop_typing_then_disconnect')
+
+# Close code sent to slow consumers ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    """
+    A client socket with its own bounded outbound queue and writer task.
+
+    Broadcasting only appends to the queue, so one slow client never stalls
+    delivery to the rest of the room. Droppable frames (typing indicators)
+    are sacrificed first when the queue is full.
+    """
+
+    def __init__(self, websocket, user_id, maxsize=SEND_QUEUE_SIZE, policy=OVERFLOW_POLICY):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Negotiated subprotocol decides the frame encoding (None = JSON)
+        self.subprotocol = websocket.subprotocol
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = deque()  # (frame, droppable)
+        self.dropped = 0
+        self.closing = False
+        self._ready = asyncio.Event()
+        self._writer = None
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def send(self, frame, droppable=False):
+        """Queue a frame for delivery, returns False if it was not queued"""
+        if self.closing:
+            return False
+
+        if len(self.queue) >= self.maxsize and not self._make_room(droppable):
+            return False
+
+        self.queue.append((frame, droppable))
+        metrics.observe_queue_depth(len(self.queue))
+        self._ready.set()
+        return True
+
+    def send_data(self, data, droppable=False):
+        """Encode a dict for this connection's subprotocol and queue it"""
+        return self.send(encode(data, self.subprotocol), droppable=droppable)
+
+    def _make_room(self, droppable):
+        """Apply the overflow policy, returns True if the new frame can be queued"""
+        if self.policy != 'disconnect':
+            if droppable:
+                self._drop('typing')
+                return False
+
+            for index, (_, queued_droppable) in enumerate(self.queue):
+                if queued_droppable:
+                    del self.queue[index]
+                    self._drop('typing')
+                    return True
+
+            if self.policy == 'drop_typing_then_oldest':
+                self.queue.popleft()
+                self._drop('message')
+                return True
+
+        self._disconnect_slow_consumer()
+        return False
+
+    def _drop(self, kind):
+        self.dropped += 1
+        metrics.incr(f'frames_dropped_{kind}')
+
+    def _disconnect_slow_consumer(self):
+        self.closing = True
+        self.queue.clear()
+        metrics.incr('slow_consumer_disconnects')
+        print(f"Disconnecting slow consumer {self.user_id}")
+        asyncio.create_task(
+            self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason='Slow consumer')
+        )
+
+    async def _write_loop(self):
+        while True:
+            if not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame, _ = self.queue.popleft()
+            try:
+                await self.websocket.send(frame)
+                metrics.incr('frames_sent')
+            except Exception as e:
+                print(f"Error sending to user {self.user_id}: {e}")
+                self.closing = True
+                self.queue.clear()
+                return
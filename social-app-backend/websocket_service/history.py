@@ -0,0 +1,75 @@
+import json
+import os
+
+# Messages kept per room (approximate, trimmed with MAXLEN ~)
+STREAM_MAXLEN = int(os.getenv('WS_STREAM_MAXLEN', 1000))
+
+# Idle room logs expire after this many seconds
+STREAM_TTL = int(os.getenv('WS_STREAM_TTL', 7 * 24 * 3600))
+
+# Max messages replayed on reconnect, beyond that the client uses REST history
+CATCHUP_LIMIT = int(os.getenv('WS_CATCHUP_LIMIT', 500))
+
+
+def stream_key(room_id):
+    return f'stream:chat:{room_id}'
+
+
+def parse_event_id(event_id):
+    """'1700000000000-3' -> (1700000000000, 3), None if malformed"""
+    try:
+        ms, _, seq = event_id.partition('-')
+        return int(ms), int(seq or 0)
+    except (AttributeError, ValueError):
+        return None
+
+
+class MessageLog:
+    """
+    Capped per-room message log on Redis Streams.
+
+    Each chat message is appended with XADD and its stream id becomes the
+    message's event_id. A reconnecting client sends the last event_id it
+    saw and only the missed range is read back with XRANGE.
+    """
+
+    def __init__(self, redis_client, maxlen=STREAM_MAXLEN, ttl=STREAM_TTL):
+        self.redis = redis_client
+        self.maxlen = maxlen
+        self.ttl = ttl
+
+    async def append(self, room_id, message_data):
+        """Append a message, returns its event_id"""
+        key = stream_key(room_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {'data': json.dumps(message_data)}, maxlen=self.maxlen, approximate=True)
+            pipe.expire(key, self.ttl)
+            event_id, _ = await pipe.execute()
+        return event_id
+
+    async def since(self, room_id, last_event_id, limit=CATCHUP_LIMIT):
+        """
+        Messages after last_event_id (exclusive).
+        Returns (messages, has_more, truncated) where truncated means the
+        log was trimmed past last_event_id and some messages are missing.
+        """
+        last = parse_event_id(last_event_id)
+        if last is None:
+            return [], False, True
+
+        key = stream_key(room_id)
+        entries = await self.redis.xrange(key, min=f'({last_event_id}', max='+', count=limit + 1)
+
+        # Oldest retained entry newer than the client's position means the
+        # log was trimmed and the client may have missed messages
+        first = await self.redis.xrange(key, min='-', max='+', count=1)
+        truncated = bool(first) and parse_event_id(first[0][0]) > last
+
+        has_more = len(entries) > limit
+        messages = []
+        for event_id, fields in entries[:limit]:
+            data = json.loads(fields['data'])
+            data['event_id'] = event_id
+            messages.append(data)
+
+        return messages, has_more, truncated
@@ -0,0 +1,613 @@
+"""
+Websocket load-testing harness.
+
+Opens N simulated clients spread over M rooms, drives message and typing
+traffic at the configured per-client rates and reports fan-out latency
+percentiles, memory per connection and dropped frames.
+
+Targets:
+  standalone  websocket_service/server.py, either a running instance (--url)
+              or one spawned locally (--spawn) against a local Redis
+              (--redis-url) or an in-memory Redis stand-in (default)
+  channels    apps.chat.consumers.ChatConsumer running in-process on the
+              Channels InMemoryChannelLayer (database writes skipped, so
+              only the consumer and channel layer fan-out are measured)
+
+Examples:
+  python loadtest.py run --spawn --clients 10000 --rooms 100 --duration 30
+  python loadtest.py run --url ws://127.0.0.1:8002 --clients 2000 --rooms 20
+  python loadtest.py run --target channels --clients 2000 --rooms 20
+  python loadtest.py run --spawn --protocol msgpack   # binary frames
+  python loadtest.py serve --port 8765            # server on in-memory Redis
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import websockets
+
+import protocol
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DJANGO_DIR = os.path.join(os.path.dirname(BASE_DIR), 'django_core')
+
+# Prefix of load-test message texts: "lt|<client>|<seq>|<sent_at>"
+MARKER = 'lt'
+
+
+# ---------------------------------------------------------------------------
+# In-memory Redis stand-in (the subset server.py uses)
+# ---------------------------------------------------------------------------
+
+class InMemoryPubSub:
+    def __init__(self, broker, ignore_subscribe_messages=False):
+        self.broker = broker
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = set()
+        self.queue = asyncio.Queue()
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.channels.add(channel)
+            self.broker.subscribers[channel].add(self)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels:
+            self.channels.discard(channel)
+            self.broker.subscribers[channel].discard(self)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        await self.unsubscribe(*list(self.channels))
+
+
+class InMemoryPipeline:
+    def __init__(self, broker):
+        self.broker = broker
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        def queue_call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue_call
+
+    async def execute(self):
+        results = []
+        for name, args, kwargs in self.calls:
+            results.append(await getattr(self.broker, name)(*args, **kwargs))
+        self.calls = []
+        return results
+
+
+class InMemoryRedis:
+    """
+    Single-process stand-in for redis.asyncio.Redis covering pub/sub,
+    XADD/XRANGE and pipelines, so the server can be load tested without Redis.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.streams = defaultdict(list)
+        self.last_ms = 0
+        self.last_seq = 0
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return InMemoryPubSub(self, ignore_subscribe_messages)
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+    async def publish(self, channel, data):
+        subscribers = self.subscribers.get(channel, ())
+        for pubsub in subscribers:
+            pubsub.queue.put_nowait({'type': 'message', 'channel': channel, 'data': data})
+        return len(subscribers)
+
+    async def xadd(self, key, fields, maxlen=None, approximate=True):
+        ms = int(time.time() * 1000)
+        if ms <= self.last_ms:
+            ms, self.last_seq = self.last_ms, self.last_seq + 1
+        else:
+            self.last_seq = 0
+        self.last_ms = ms
+        event_id = f'{ms}-{self.last_seq}'
+        stream = self.streams[key]
+        stream.append((event_id, dict(fields)))
+        if maxlen and len(stream) > maxlen:
+            del stream[:len(stream) - maxlen]
+        return event_id
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def xrange(self, key, min='-', max='+', count=None):
+        def parse(event_id):
+            ms, _, seq = event_id.partition('-')
+            return int(ms), int(seq or 0)
+
+        exclusive = min.startswith('(')
+        low = None if min == '-' else parse(min.lstrip('('))
+        result = []
+        for event_id, fields in self.streams.get(key, ()):
+            position = parse(event_id)
+            if low is not None and (position < low or (exclusive and position == low)):
+                continue
+            result.append((event_id, fields))
+            if count and len(result) >= count:
+                break
+        return result
+
+
+# ---------------------------------------------------------------------------
+# Stats
+# ---------------------------------------------------------------------------
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_failed = 0
+        self.disconnected = 0
+        self.messages_sent = 0
+        self.typing_sent = 0
+        self.expected_deliveries = 0
+        self.messages_received = 0
+        self.typing_received = 0
+        self.latencies = []
+        # Set once the harness starts closing its own connections
+        self.closing = False
+
+    def record_message(self, text):
+        parts = text.split('|')
+        if len(parts) == 4 and parts[0] == MARKER:
+            self.messages_received += 1
+            self.latencies.append(time.time() - float(parts[3]))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def raise_fd_limit():
+    """Thousands of sockets need more than the default 1024 descriptors"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+async def poisson_sleep(rate, stop):
+    """Sleep an exponential interval for a Poisson process of `rate` per second"""
+    try:
+        await asyncio.wait_for(stop.wait(), random.expovariate(rate))
+    except asyncio.TimeoutError:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Standalone server clients
+# ---------------------------------------------------------------------------
+
+async def fetch_server_metrics(url):
+    """GET /metrics from the standalone server, {} if unavailable"""
+    host_port = url.split('://', 1)[-1].split('/', 1)[0]
+    host, _, port = host_port.partition(':')
+    try:
+        reader, writer = await asyncio.open_connection(host, int(port or 80))
+        writer.write(f'GET /metrics HTTP/1.1\r\nHost: {host_port}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.split(b'\r\n\r\n', 1)[1])
+    except Exception:
+        return {}
+
+
+class StandaloneClient:
+    # The sending connection does not get its own message back
+    echo = False
+
+    def __init__(self, index, room_id, args, stats):
+        self.index = index
+        self.room_id = room_id
+        self.args = args
+        self.stats = stats
+        self.ws = None
+        self.subprotocol = protocol.MSGPACK_SUBPROTOCOL if args.protocol == 'msgpack' else None
+
+    async def connect(self):
+        self.ws = await websockets.connect(
+            f'{self.args.url}/ws/chat/lt{self.index}',
+            ping_interval=None,
+            max_queue=None,
+            open_timeout=30,
+            subprotocols=[self.subprotocol] if self.subprotocol else None,
+            compression=None if self.args.no_deflate else 'deflate'
+        )
+        await self.ws.recv()  # connected
+        await self.send({'type': 'join_room', 'room_id': self.room_id})
+
+    async def send(self, data):
+        await self.ws.send(protocol.encode(data, self.subprotocol))
+
+    async def send_message(self, text):
+        await self.send({'type': 'message', 'room_id': self.room_id, 'text': text})
+
+    async def send_typing(self):
+        await self.send({'type': 'typing', 'room_id': self.room_id, 'typing': True})
+
+    async def read_loop(self):
+        try:
+            async for raw in self.ws:
+                data = protocol.decode(raw)
+                if data.get('type') == 'message':
+                    self.stats.record_message(data.get('text', ''))
+                elif data.get('type') == 'typing':
+                    self.stats.typing_received += 1
+        except websockets.ConnectionClosed:
+            pass
+        if not self.stats.closing:
+            self.stats.disconnected += 1
+
+    async def close(self):
+        await self.ws.close()
+
+
+# ---------------------------------------------------------------------------
+# Channels ChatConsumer clients (in-process, InMemoryChannelLayer)
+# ---------------------------------------------------------------------------
+
+def setup_channels(capacity):
+    sys.path.insert(0, DJANGO_DIR)
+    import django
+    from django.conf import settings
+    settings.configure(
+        INSTALLED_APPS=[],
+        CHANNEL_LAYERS={'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': capacity},
+        }},
+    )
+    django.setup()
+
+
+def load_test_consumer():
+    """ChatConsumer with its database writes replaced, only fan-out is measured"""
+    import uuid
+    from types import SimpleNamespace
+    from django.utils import timezone
+    from apps.chat.consumers import ChatConsumer
+
+    class LoadTestChatConsumer(ChatConsumer):
+        async def save_message(self, content, media_url, message_type, reply_to):
+            return SimpleNamespace(id=uuid.uuid4(), created_at=timezone.now())
+
+        async def update_typing_status(self, is_typing):
+            pass
+
+        async def mark_message_read(self, message_id):
+            pass
+
+    return LoadTestChatConsumer.as_asgi()
+
+
+class ChannelsClient:
+    # group_send reaches the sender too
+    echo = True
+
+    application = None
+
+    def __init__(self, index, room_id, args, stats):
+        from types import SimpleNamespace
+        from apps.chat import protocol as chat_protocol
+        self.protocol = chat_protocol
+        self.subprotocol = chat_protocol.MSGPACK_SUBPROTOCOL if args.protocol == 'msgpack' else None
+        self.index = index
+        self.room_id = room_id
+        self.stats = stats
+        self.user = SimpleNamespace(
+            id=f'lt{index}', username=f'lt{index}',
+            profile=SimpleNamespace(avatar='')
+        )
+        self.communicator = None
+
+    async def connect(self):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(
+            self.application, f'/ws/chat/{self.room_id}/',
+            subprotocols=[self.subprotocol] if self.subprotocol else None
+        )
+        self.communicator.scope['user'] = self.user
+        self.communicator.scope['url_route'] = {'kwargs': {'conversation_id': self.room_id}}
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError('Consumer rejected connection')
+
+    async def send_message(self, text):
+        await self.send({'type': 'message', 'content': text})
+
+    async def send_typing(self):
+        await self.send({'type': 'typing', 'is_typing': True})
+
+    async def send(self, data):
+        text_data, bytes_data = self.protocol.encode(data, self.subprotocol)
+        await self.communicator.send_to(text_data=text_data, bytes_data=bytes_data)
+
+    async def read_loop(self):
+        while True:
+            try:
+                message = await self.communicator.receive_output(timeout=3600)
+            except asyncio.TimeoutError:
+                break
+            if message['type'] != 'websocket.send':
+                break
+            data = self.protocol.decode(message.get('text'), message.get('bytes'))
+            if data is None:
+                continue
+            if data.get('type') == 'message':
+                self.stats.record_message(data['message'].get('content', ''))
+            elif data.get('type') == 'typing':
+                self.stats.typing_received += 1
+        if not self.stats.closing:
+            self.stats.disconnected += 1
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+async def drive_client(client, args, stats, start, stop):
+    await start.wait()
+    seq = 0
+    next_typing = time.monotonic()
+    while not stop.is_set():
+        await poisson_sleep(args.message_rate + args.typing_rate, stop)
+        if stop.is_set():
+            break
+        try:
+            # Pick message or typing in proportion to their rates
+            if random.random() * (args.message_rate + args.typing_rate) < args.message_rate:
+                seq += 1
+                await client.send_message(f'{MARKER}|{client.index}|{seq}|{time.time()}')
+                stats.messages_sent += 1
+                stats.expected_deliveries += args.room_sizes[client.room_id] - (0 if client.echo else 1)
+            elif time.monotonic() >= next_typing:
+                await client.send_typing()
+                stats.typing_sent += 1
+                next_typing = time.monotonic() + 1 / args.typing_rate
+        except Exception:
+            break
+
+
+def spawn_server(args):
+    """Start server.py in a subprocess (in-memory Redis unless --redis-url)"""
+    port = args.port
+    command = [sys.executable, os.path.abspath(__file__), 'serve', '--port', str(port)]
+    if args.redis_url:
+        command += ['--redis-url', args.redis_url]
+    # Server logs a line per connection, keep the report readable
+    process = subprocess.Popen(command, cwd=BASE_DIR, stdout=subprocess.DEVNULL)
+    args.url = f'ws://127.0.0.1:{port}'
+    return process
+
+
+async def wait_for_server(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await fetch_server_metrics(url):
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def run(args):
+    from metrics import rss_bytes
+
+    fd_limit = raise_fd_limit()
+    if args.clients + 100 > fd_limit:
+        print(f"Warning: open file limit is {fd_limit}, some connections may fail")
+
+    stats = Stats()
+    process = None
+
+    if args.target == 'channels':
+        setup_channels(args.channel_capacity)
+        ChannelsClient.application = staticmethod(load_test_consumer())
+        client_class = ChannelsClient
+    else:
+        client_class = StandaloneClient
+        if args.spawn:
+            process = spawn_server(args)
+            if not await wait_for_server(args.url):
+                process.terminate()
+                sys.exit('Spawned server did not come up')
+
+    def server_rss():
+        if process is not None:
+            return rss_bytes(process.pid)
+        return None
+
+    rooms = [f'room{i}' for i in range(args.rooms)]
+    clients = [client_class(i, rooms[i % args.rooms], args, stats) for i in range(args.clients)]
+    args.room_sizes = defaultdict(int)
+
+    # Baseline memory before connecting
+    if args.target == 'channels':
+        rss_before = rss_bytes()
+    elif process is not None:
+        rss_before = server_rss()
+    else:
+        rss_before = (await fetch_server_metrics(args.url)).get('rss_bytes', 0)
+
+    print(f"Connecting {args.clients} clients to {args.rooms} rooms ({args.target})...")
+    connect_started = time.monotonic()
+    readers = []
+    connected = []
+    for batch_start in range(0, len(clients), args.connect_batch):
+        batch = clients[batch_start:batch_start + args.connect_batch]
+        results = await asyncio.gather(*(c.connect() for c in batch), return_exceptions=True)
+        for client, result in zip(batch, results):
+            if isinstance(result, Exception):
+                stats.connect_failed += 1
+                continue
+            stats.connected += 1
+            args.room_sizes[client.room_id] += 1
+            connected.append(client)
+            readers.append(asyncio.create_task(client.read_loop()))
+    connect_time = time.monotonic() - connect_started
+
+    # Let join acknowledgements settle before measuring memory
+    await asyncio.sleep(1)
+    if args.target == 'channels':
+        rss_after = rss_bytes()
+    elif process is not None:
+        rss_after = server_rss()
+    else:
+        rss_after = (await fetch_server_metrics(args.url)).get('rss_bytes', 0)
+
+    print(f"Connected {stats.connected} ({stats.connect_failed} failed) in {connect_time:.1f}s, "
+          f"driving traffic for {args.duration}s...")
+
+    start, stop = asyncio.Event(), asyncio.Event()
+    drivers = [asyncio.create_task(drive_client(c, args, stats, start, stop)) for c in connected]
+    start.set()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*drivers, return_exceptions=True)
+
+    # Give in-flight frames time to arrive
+    await asyncio.sleep(args.drain)
+
+    server_metrics = {}
+    if args.target == 'standalone':
+        server_metrics = await fetch_server_metrics(args.url)
+
+    stats.closing = True
+    await asyncio.gather(*(c.close() for c in connected), return_exceptions=True)
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    if process is not None:
+        process.terminate()
+        process.wait()
+
+    report(args, stats, rss_before, rss_after, server_metrics)
+
+
+def report(args, stats, rss_before, rss_after, server_metrics):
+    latencies = sorted(stats.latencies)
+    dropped = max(0, stats.expected_deliveries - stats.messages_received)
+
+    print()
+    print(f"Target:                 {args.target}")
+    print(f"Clients / rooms:        {stats.connected} connected, {stats.connect_failed} failed, {args.rooms} rooms")
+    print(f"Messages sent:          {stats.messages_sent} ({stats.messages_sent / args.duration:.0f}/s)")
+    print(f"Typing events sent:     {stats.typing_sent}")
+    print(f"Message deliveries:     {stats.messages_received} of {stats.expected_deliveries} expected "
+          f"({stats.messages_received / args.duration:.0f}/s)")
+    print(f"Dropped message frames: {dropped} ({dropped / stats.expected_deliveries:.2%})"
+          if stats.expected_deliveries else "Dropped message frames: 0")
+    print(f"Typing deliveries:      {stats.typing_received}")
+    print(f"Server disconnects:     {stats.disconnected}")
+
+    if latencies:
+        print("Fan-out latency (ms):   " + "  ".join(
+            f"p{p}={percentile(latencies, p) * 1000:.1f}" for p in (50, 90, 99, 99.9)
+        ) + f"  max={latencies[-1] * 1000:.1f}")
+
+    if rss_before and rss_after and stats.connected:
+        per_connection = (rss_after - rss_before) / stats.connected
+        scope = 'harness process (server + clients)' if args.target == 'channels' else 'server'
+        print(f"Memory per connection:  {per_connection / 1024:.1f} KiB ({scope} RSS)")
+
+    if server_metrics:
+        keys = ['frames_sent', 'frames_dropped_typing', 'frames_dropped_message',
+                'slow_consumer_disconnects', 'queue_depth_max_seen']
+        print("Server metrics:         " + "  ".join(f"{k}={server_metrics.get(k, 0)}" for k in keys))
+
+
+def serve(args):
+    """Run server.py, on the in-memory Redis stand-in unless --redis-url is given"""
+    os.environ['WS_PORT'] = str(args.port)
+    sys.path.insert(0, BASE_DIR)
+    import server
+
+    if args.redis_url:
+        import redis.asyncio as redis
+        client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        client = InMemoryRedis()
+
+    server.redis_client = client
+    server.message_log.redis = client
+    server.subscriber.redis = client
+    server.subscriber.pubsub = client.pubsub(ignore_subscribe_messages=True)
+    asyncio.run(server.main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help='Run a load test')
+    run_parser.add_argument('--target', choices=['standalone', 'channels'], default='standalone')
+    run_parser.add_argument('--url', default='ws://127.0.0.1:8002', help='Standalone server URL')
+    run_parser.add_argument('--spawn', action='store_true', help='Start a local server subprocess')
+    run_parser.add_argument('--port', type=int, default=8765, help='Port for --spawn')
+    run_parser.add_argument('--redis-url', help='Use this Redis for --spawn instead of the in-memory stand-in')
+    run_parser.add_argument('--clients', type=int, default=1000)
+    run_parser.add_argument('--rooms', type=int, default=10)
+    run_parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic')
+    run_parser.add_argument('--message-rate', type=float, default=0.1, help='Messages per second per client')
+    run_parser.add_argument('--typing-rate', type=float, default=0.2, help='Typing events per second per client')
+    run_parser.add_argument('--connect-batch', type=int, default=500, help='Concurrent connects during ramp-up')
+    run_parser.add_argument('--drain', type=float, default=5, help='Seconds to wait for in-flight frames')
+    run_parser.add_argument('--protocol', choices=['json', 'msgpack'], default='json',
+                            help='Frame format clients negotiate')
+    run_parser.add_argument('--no-deflate', action='store_true',
+                            help="Don't offer permessage-deflate (standalone target)")
+    run_parser.add_argument('--channel-capacity', type=int, default=100,
+                            help='InMemoryChannelLayer per-channel capacity (channels target)')
+
+    serve_parser = sub.add_parser('serve', help='Run server.py for load testing')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--redis-url', help='Local Redis, defaults to the in-memory stand-in')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
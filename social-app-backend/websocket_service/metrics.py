@@ -0,0 +1,41 @@
+import os
+from collections import Counter
+
+
+def rss_bytes(pid='self'):
+    """Resident memory of a process (Linux /proc), 0 if unavailable"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class Metrics:
+    """
+    In-process counters for the websocket server, exposed on GET /metrics
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.max_queue_depth = 0
+
+    def incr(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe_queue_depth(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def snapshot(self, connections=()):
+        depths = [c.queue_depth for c in connections]
+        return {
+            **self.counters,
+            'queue_depth_total': sum(depths),
+            'queue_depth_max_current': max(depths, default=0),
+            'queue_depth_max_seen': self.max_queue_depth,
+            'rss_bytes': rss_bytes(),
+        }
+
+
+metrics = Metrics()
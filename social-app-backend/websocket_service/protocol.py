@@ -0,0 +1,84 @@
+import json
+import os
+import msgpack
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+# Subprotocols offered in Sec-WebSocket-Protocol. Clients that don't ask
+# for one (legacy clients) keep getting JSON text frames.
+MSGPACK_SUBPROTOCOL = 'chat.msgpack.v1'
+JSON_SUBPROTOCOL = 'chat.json'
+SUBPROTOCOLS = [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]
+
+# permessage-deflate on/off and its window size. Smaller windows cost less
+# memory per connection (zlib keeps one compressor per socket) at a small
+# loss in ratio, which matters at 10k+ sockets.
+COMPRESSION = os.getenv('WS_COMPRESSION', 'deflate')
+DEFLATE_WINDOW_BITS = int(os.getenv('WS_DEFLATE_WINDOW_BITS', 11))
+DEFLATE_MEM_LEVEL = int(os.getenv('WS_DEFLATE_MEM_LEVEL', 4))
+
+# Short keys used on the wire in MessagePack frames
+SHORT_KEYS = {
+    'type': 't',
+    'user_id': 'u',
+    'room_id': 'r',
+    'text': 'x',
+    'timestamp': 'ts',
+    'event_id': 'e',
+    'last_event_id': 'le',
+    'typing': 'ty',
+    'message': 'm',
+    'messages': 'ms',
+    'has_more': 'hm',
+    'truncated': 'tr',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+class FrameError(ValueError):
+    """Raised when an incoming frame can't be decoded"""
+
+
+def compression_extensions():
+    """Extension factories for websockets.serve, None disables compression"""
+    if COMPRESSION != 'deflate':
+        return None
+    return [
+        ServerPerMessageDeflateFactory(
+            server_max_window_bits=DEFLATE_WINDOW_BITS,
+            client_max_window_bits=DEFLATE_WINDOW_BITS,
+            compress_settings={'memLevel': DEFLATE_MEM_LEVEL},
+        )
+    ]
+
+
+def _rename(value, keys):
+    if isinstance(value, dict):
+        return {keys.get(k, k): _rename(v, keys) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rename(v, keys) for v in value]
+    return value
+
+
+def encode(data, subprotocol=None):
+    """Frame a dict for a connection: bytes for MessagePack, str for JSON"""
+    if subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb(_rename(data, SHORT_KEYS))
+    return json.dumps(data)
+
+
+def decode(frame):
+    """
+    Decode an incoming frame. Binary frames are MessagePack with short
+    keys, text frames are JSON, whatever subprotocol was negotiated.
+    """
+    try:
+        if isinstance(frame, bytes):
+            data = _rename(msgpack.unpackb(frame), LONG_KEYS)
+        else:
+            data = json.loads(frame)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise FrameError(str(e)) from e
+
+    if not isinstance(data, dict):
+        raise FrameError('Frame must be an object')
+    return data
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+
+def room_channels(room_id):
+    """Redis pub/sub channels carrying a room's traffic"""
+    return [f'chat:{room_id}', f'typing:{room_id}']
+
+
+class RoomSubscriber:
+    """
+    Cross-node fan-out through Redis pub/sub.
+
+    Every node publishes room traffic to Redis and only subscribes to the
+    rooms that have local members. Subscriptions are reference counted per
+    room: the first local join subscribes, the last local leave unsubscribes.
+    Messages received from Redis are handed to `deliver(room_id, kind, data)`
+    which sends them to the local connections of that room.
+    """
+
+    def __init__(self, redis_client, deliver, poll_timeout=1.0):
+        self.redis = redis_client
+        self.deliver = deliver
+        self.poll_timeout = poll_timeout
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.refcounts = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, room_id):
+        """A local connection joined room_id"""
+        async with self._lock:
+            count = self.refcounts.get(room_id, 0)
+            self.refcounts[room_id] = count + 1
+            if count == 0:
+                await self.pubsub.subscribe(*room_channels(room_id))
+
+    async def release(self, room_id):
+        """A local connection left room_id"""
+        async with self._lock:
+            count = self.refcounts.get(room_id, 0)
+            if count <= 1:
+                self.refcounts.pop(room_id, None)
+                if count == 1:
+                    await self.pubsub.unsubscribe(*room_channels(room_id))
+            else:
+                self.refcounts[room_id] = count - 1
+
+    async def run(self):
+        """Read messages from Redis and deliver them locally, forever"""
+        while True:
+            try:
+                if not self.pubsub.subscribed:
+                    if self.refcounts:
+                        # Lost our subscriptions (e.g. failed resubscribe)
+                        await self._resubscribe()
+                    else:
+                        await asyncio.sleep(self.poll_timeout)
+                    continue
+
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=self.poll_timeout
+                )
+                if message is None:
+                    continue
+
+                kind, _, room_id = message['channel'].partition(':')
+                await self.deliver(room_id, kind, json.loads(message['data']))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Pub/sub subscriber error: {e}")
+                await self._resubscribe()
+
+    async def _resubscribe(self):
+        """Recreate the pub/sub connection after an error and restore subscriptions"""
+        await asyncio.sleep(1)
+        async with self._lock:
+            try:
+                await self.pubsub.close()
+            except Exception:
+                pass
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            channels = [c for room_id in self.refcounts for c in room_channels(room_id)]
+            if channels:
+                try:
+                    await self.pubsub.subscribe(*channels)
+                except Exception as e:
+                    print(f"Pub/sub resubscribe failed: {e}")
+
+    def stats(self):
+        return {'subscribed_rooms': len(self.refcounts)}
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+
+class RoomRegistry:
+    """
+    Index of live connections by room and by user.
+
+    A user can be connected from several devices, so each user maps to a list
+    of connections, and each room maps to the set of connections that joined
+    it. Broadcasting to a room only touches that room's members.
+    """
+
+    def __init__(self):
+        self.rooms = defaultdict(set)    # room_id -> {connection}
+        self.users = defaultdict(list)   # user_id -> [connection]
+        self.joined = defaultdict(set)   # connection -> {room_id}
+
+    def add_connection(self, user_id, connection):
+        """Register a new connection for user"""
+        self.users[user_id].append(connection)
+
+    def remove_connection(self, user_id, connection):
+        """
+        Forget a connection and leave all its rooms.
+        Returns the rooms the connection was a member of.
+        """
+        rooms = self.joined.pop(connection, set())
+        for room_id in rooms:
+            self._discard_member(room_id, connection)
+
+        connections = self.users.get(user_id)
+        if connections is not None:
+            if connection in connections:
+                connections.remove(connection)
+            if not connections:
+                del self.users[user_id]
+
+        return list(rooms)
+
+    def join(self, room_id, connection):
+        """Add connection to room, returns False if it was already a member"""
+        members = self.rooms[room_id]
+        if connection in members:
+            return False
+        members.add(connection)
+        self.joined[connection].add(room_id)
+        return True
+
+    def leave(self, room_id, connection):
+        """Remove connection from room, returns False if it was not a member"""
+        rooms = self.joined.get(connection)
+        if rooms is None or room_id not in rooms:
+            return False
+        rooms.discard(room_id)
+        self._discard_member(room_id, connection)
+        return True
+
+    def members(self, room_id):
+        """Connections that joined room_id"""
+        return self.rooms.get(room_id, ())
+
+    def user_connections(self, user_id):
+        """All connections (devices) of a user"""
+        return self.users.get(user_id, ())
+
+    def is_member(self, room_id, connection):
+        return connection in self.rooms.get(room_id, ())
+
+    def _discard_member(self, room_id, connection):
+        members = self.rooms.get(room_id)
+        if members is None:
+            return
+        members.discard(connection)
+        if not members:
+            del self.rooms[room_id]
+
+    def stats(self):
+        return {
+            'rooms': len(self.rooms),
+            'users': len(self.users),
+            'connections': sum(len(c) for c in self.users.values()),
+        }
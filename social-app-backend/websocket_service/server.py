@@ -3,7 +3,16 @@ import websockets
 import json
 import redis.asyncio as redis
 import os
+import time
+import uuid
+from http import HTTPStatus
 from dotenv import load_dotenv
+from rooms import RoomRegistry
+from pubsub import RoomSubscriber
+from connection import Connection
+from history import MessageLog
+from metrics import metrics
+import protocol
 
 load_dotenv()
 
@@ -14,118 +23,231 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
-# Store active connections
-active_connections = {}
+# Identifies this server instance in published messages
+NODE_ID = os.getenv('WS_NODE_ID') or uuid.uuid4().hex
+
+# Active connections indexed by room and by user (multiple devices per user)
+registry = RoomRegistry()
+
+# Capped per-room message log used for reconnect catch-up
+message_log = MessageLog(redis_client)
+
+
+def room_of(data):
+    """
+    The frame's room_id as a string, the form pub/sub channel names give
+    back, None when missing
+    """
+    room_id = data.get('room_id')
+    if room_id is None or room_id == '':
+        return None
+    return str(room_id)
+
+
+def message_frame(data):
+    return {
+        'type': 'message',
+        'event_id': data.get('event_id'),
+        'user_id': data['user_id'],
+        'room_id': data['room_id'],
+        'text': data['text'],
+        'timestamp': data['timestamp']
+    }
+
+
+async def deliver_to_room(room_id, kind, data):
+    """Queue a message received from Redis for this node's members of room_id"""
+    if kind == 'chat':
+        payload = message_frame(data)
+    elif kind == 'typing':
+        payload = {
+            'type': 'typing',
+            'user_id': data['user_id'],
+            'room_id': room_id,
+            'typing': data['typing']
+        }
+    else:
+        return
+
+    # Don't echo back to the sending connection
+    sender = data.get('sender') if data.get('node') == NODE_ID else None
+    droppable = kind == 'typing'
+
+    # Encode once per subprotocol, not once per member
+    frames = {}
+
+    # Only enqueues, each connection's writer task does the actual send
+    for conn in registry.members(room_id):
+        if id(conn) != sender:
+            frame = frames.get(conn.subprotocol)
+            if frame is None:
+                frame = frames[conn.subprotocol] = protocol.encode(payload, conn.subprotocol)
+            conn.send(frame, droppable=droppable)
+
+
+# Subscribes to rooms with local members and fans out to them
+subscriber = RoomSubscriber(redis_client, deliver_to_room)
+
+
+async def process_request(path, request_headers):
+    """Serve GET /metrics over plain HTTP, everything else is a websocket"""
+    if path == '/metrics':
+        connections = [c for conns in registry.users.values() for c in conns]
+        body = json.dumps({
+            **metrics.snapshot(connections),
+            **registry.stats(),
+            **subscriber.stats(),
+        })
+        return HTTPStatus.OK, [('Content-Type', 'application/json')], body.encode('utf-8')
+    return None
+
 
 async def chat_handler(websocket, path):
     """Handle WebSocket connections for chat"""
+    user_id = None
+    conn = None
     try:
         # Extract user_id from path (e.g., /ws/chat/123)
         path_parts = path.strip('/').split('/')
         if len(path_parts) >= 3 and path_parts[1] == 'chat':
             user_id = path_parts[2]
         else:
-            await websocket.send(json.dumps({
+            await websocket.send(protocol.encode({
                 'type': 'error',
                 'message': 'Invalid path format. Use /ws/chat/{user_id}'
-            }))
+            }, websocket.subprotocol))
             return
 
         # Register connection
-        active_connections[user_id] = websocket
-        print(f"User {user_id} connected")
+        conn = Connection(websocket, user_id)
+        conn.start()
+        registry.add_connection(user_id, conn)
+        print(f"User {user_id} connected ({conn.subprotocol or 'json'})")
 
         # Send welcome message
-        await websocket.send(json.dumps({
+        conn.send_data({
             'type': 'connected',
             'user_id': user_id,
             'message': f'Welcome to chat, user {user_id}!'
-        }))
+        })
 
         async for message in websocket:
             try:
-                data = json.loads(message)
+                data = protocol.decode(message)
                 message_type = data.get('type', 'message')
 
+                room_id = room_of(data)
+                if room_id is None and message_type in ('message', 'typing', 'join_room', 'leave_room'):
+                    conn.send_data({
+                        'type': 'error',
+                        'message': 'room_id is required'
+                    })
+                    continue
+
                 if message_type == 'message':
                     # Handle chat message
-                    room_id = data.get('room_id')
                     text = data.get('text', '')
 
-                    # Store message in Redis for persistence
                     message_data = {
                         'user_id': user_id,
                         'room_id': room_id,
                         'text': text,
-                        'timestamp': asyncio.get_event_loop().time()
+                        'timestamp': time.time()
                     }
 
-                    # Publish to Redis pub/sub for real-time distribution
-                    await redis_client.publish(f'chat:{room_id}', json.dumps(message_data))
+                    # Append to the room's stream, its id is the event_id
+                    # clients resume from after reconnecting
+                    message_data['event_id'] = await message_log.append(room_id, message_data)
+                    message_data['node'] = NODE_ID
+                    message_data['sender'] = id(conn)
 
-                    # Broadcast to all users in the room (simplified - in production you'd track room members)
-                    for uid, conn in active_connections.items():
-                        if conn != websocket:  # Don't echo back to sender
-                            try:
-                                await conn.send(json.dumps({
-                                    'type': 'message',
-                                    'user_id': user_id,
-                                    'room_id': room_id,
-                                    'text': text,
-                                    'timestamp': message_data['timestamp']
-                                }))
-                            except Exception as e:
-                                print(f"Error sending to user {uid}: {e}")
+                    # Publish to Redis pub/sub, every node with members in the
+                    # room (including this one) delivers it to its connections
+                    await redis_client.publish(f'chat:{room_id}', json.dumps(message_data))
 
                 elif message_type == 'typing':
                     # Handle typing indicator
-                    room_id = data.get('room_id')
                     await redis_client.publish(f'typing:{room_id}', json.dumps({
                         'user_id': user_id,
-                        'typing': data.get('typing', True)
+                        'typing': data.get('typing', True),
+                        'node': NODE_ID,
+                        'sender': id(conn)
                     }))
 
                 elif message_type == 'join_room':
                     # Handle room joining
-                    room_id = data.get('room_id')
-                    await websocket.send(json.dumps({
+                    if registry.join(room_id, conn):
+                        await subscriber.acquire(room_id)
+                    conn.send_data({
                         'type': 'room_joined',
                         'room_id': room_id,
                         'message': f'Joined room {room_id}'
-                    }))
-
-            except json.JSONDecodeError:
-                await websocket.send(json.dumps({
+                    })
+
+                    # Reconnect catch-up: only the range missed since last_event_id.
+                    # Live messages may overlap with it, clients dedupe by event_id.
+                    last_event_id = data.get('last_event_id')
+                    if last_event_id:
+                        messages, has_more, truncated = await message_log.since(room_id, last_event_id)
+                        conn.send_data({
+                            'type': 'history',
+                            'room_id': room_id,
+                            'messages': [message_frame(m) for m in messages],
+                            'has_more': has_more,
+                            'truncated': truncated
+                        })
+
+                elif message_type == 'leave_room':
+                    if registry.leave(room_id, conn):
+                        await subscriber.release(room_id)
+                    conn.send_data({
+                        'type': 'room_left',
+                        'room_id': room_id
+                    })
+
+            except protocol.FrameError:
+                conn.send_data({
                     'type': 'error',
-                    'message': 'Invalid JSON format'
-                }))
+                    'message': 'Invalid JSON format' if isinstance(message, str) else 'Invalid MessagePack frame'
+                })
             except Exception as e:
                 print(f"Error processing message: {e}")
-                await websocket.send(json.dumps({
+                conn.send_data({
                     'type': 'error',
                     'message': 'Internal server error'
-                }))
+                })
 
     except Exception as e:
         print(f"Connection error: {e}")
     finally:
         # Clean up connection
-        if user_id in active_connections:
-            del active_connections[user_id]
+        if conn is not None:
+            for room_id in registry.remove_connection(user_id, conn):
+                await subscriber.release(room_id)
+            await conn.stop()
             print(f"User {user_id} disconnected")
 
 async def main():
     """Start the WebSocket server"""
+    subscriber_task = asyncio.create_task(subscriber.run())
+
     server = await websockets.serve(
         chat_handler,
         "0.0.0.0",
         int(os.getenv('WS_PORT', 8002)),
         ping_interval=30,
-        ping_timeout=10
+        ping_timeout=10,
+        process_request=process_request,
+        subprotocols=protocol.SUBPROTOCOLS,
+        extensions=protocol.compression_extensions(),
+        compression=None
     )
 
-    print(f"WebSocket server started on ws://0.0.0.0:{os.getenv('WS_PORT', 8002)}")
-    await server.wait_closed()
+    print(f"WebSocket server {NODE_ID} started on ws://0.0.0.0:{os.getenv('WS_PORT', 8002)}")
+    try:
+        await server.wait_closed()
+    finally:
+        subscriber_task.cancel()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import unittest
+import fakeredis.aioredis
+import websockets
+import server
+from history import MessageLog, stream_key
+from pubsub import RoomSubscriber
+
+
+class RoomFanOutTest(unittest.IsolatedAsyncioTestCase):
+    """Two clients of one node, traffic going through Redis pub/sub"""
+
+    async def asyncSetUp(self):
+        fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        self.patches = {
+            'redis_client': server.redis_client,
+            'message_log': server.message_log,
+            'subscriber': server.subscriber,
+            'registry': server.registry,
+        }
+        server.redis_client = fake
+        server.message_log = MessageLog(fake)
+        server.subscriber = RoomSubscriber(fake, server.deliver_to_room, poll_timeout=0.05)
+        server.registry = server.RoomRegistry()
+        self.subscriber_task = asyncio.create_task(server.subscriber.run())
+        self.server = await websockets.serve(server.chat_handler, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.subscriber_task.cancel()
+        for name, value in self.patches.items():
+            setattr(server, name, value)
+
+    async def connect(self, user_id):
+        client = await websockets.connect(f'ws://127.0.0.1:{self.port}/ws/chat/{user_id}')
+        self.addAsyncCleanup(client.close)
+        self.assertEqual(await self.receive(client, 'connected'), {
+            'type': 'connected',
+            'user_id': user_id,
+            'message': f'Welcome to chat, user {user_id}!'
+        })
+        return client
+
+    async def receive(self, client, message_type):
+        while True:
+            data = json.loads(await asyncio.wait_for(client.recv(), timeout=2))
+            if data['type'] == message_type:
+                return data
+
+    async def join(self, client, room_id):
+        await client.send(json.dumps({'type': 'join_room', 'room_id': room_id}))
+        return await self.receive(client, 'room_joined')
+
+    async def test_numeric_room_id_is_delivered(self):
+        alice = await self.connect('alice')
+        bob = await self.connect('bob')
+        self.assertEqual((await self.join(alice, 5))['room_id'], '5')
+        await self.join(bob, '5')
+
+        await alice.send(json.dumps({'type': 'message', 'room_id': 5, 'text': 'hi'}))
+        message = await self.receive(bob, 'message')
+
+        self.assertEqual(message['room_id'], '5')
+        self.assertEqual(message['user_id'], 'alice')
+        self.assertEqual(message['text'], 'hi')
+
+    async def test_leave_with_numeric_room_id_unsubscribes(self):
+        alice = await self.connect('alice')
+        await self.join(alice, 7)
+        self.assertEqual(server.subscriber.stats(), {'subscribed_rooms': 1})
+
+        await alice.send(json.dumps({'type': 'leave_room', 'room_id': 7}))
+        await self.receive(alice, 'room_left')
+        self.assertEqual(server.subscriber.stats(), {'subscribed_rooms': 0})
+
+    async def test_missing_room_id_is_rejected(self):
+        alice = await self.connect('alice')
+        await alice.send(json.dumps({'type': 'message', 'text': 'hi'}))
+
+        error = await self.receive(alice, 'error')
+        self.assertEqual(error['message'], 'room_id is required')
+        self.assertEqual(await server.redis_client.pubsub_numsub('chat:None'), [('chat:None', 0)])
+        self.assertEqual(await server.redis_client.xlen(stream_key(None)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()